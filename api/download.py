@@ -1,103 +1,36 @@
 from http.server import BaseHTTPRequestHandler
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
 import json
-import io
 import logging
 import base64
+from metrics import track_stage, instrument_handler
+from pdf_cache import PDFCache, etag_matches
+from worksheet_document import parse_worksheet, render_pdf as render_worksheet_pdf
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump whenever create_pdf's output changes so cached PDFs are re-rendered
+PDF_RENDERER_VERSION = "serverless-3"
+pdf_cache = PDFCache(PDF_RENDERER_VERSION)
+
 def create_pdf(content: str) -> bytes:
     try:
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        y = height - 40
-        
-        c.setFont("Helvetica-Bold", 16)
-        
-        lines = content.split('\n')
-        for line in lines:
-            if not line.strip():
-                y -= 15
-                continue
-                
-            # Handle double asterisk sections (smaller headers)
-            if line.startswith('**') and line.endswith('**'):
-                c.setFont("Helvetica-Bold", 14)
-                text = line.replace('**', '')
-                c.drawString(40, y, text)
-                y -= 25  # More spacing after headers
-                c.setFont("Helvetica", 12)  # Reset font
-                
-            # Handle single asterisk sections (major headers)
-            elif line.startswith('*') and line.endswith('*'):
-                c.setFont("Helvetica-Bold", 16)
-                text = line.replace('*', '')
-                c.drawString(40, y, text)
-                y -= 30  # More spacing after major headers
-                c.setFont("Helvetica", 12)  # Reset font
-                
-            # Handle questions (lines starting with numbers)
-            elif line.strip() and line[0].isdigit() and '. ' in line:
-                c.setFont("Helvetica", 12)
-                # Wrap long lines
-                words = line.split()
-                current_line = []
-                x = 40
-                
-                for word in words:
-                    current_line.append(word)
-                    if c.stringWidth(' '.join(current_line)) > width - 80:
-                        c.drawString(x, y, ' '.join(current_line[:-1]))
-                        y -= 15
-                        current_line = [word]
-                        x = 60  # Indent continuation lines
-                
-                if current_line:
-                    c.drawString(x, y, ' '.join(current_line))
-                y -= 20  # More spacing after questions
-                
-            # Regular text
-            else:
-                c.setFont("Helvetica", 12)
-                # Wrap long lines
-                words = line.split()
-                current_line = []
-                
-                for word in words:
-                    current_line.append(word)
-                    if c.stringWidth(' '.join(current_line)) > width - 80:
-                        c.drawString(40, y, ' '.join(current_line[:-1]))
-                        y -= 15
-                        current_line = [word]
-                
-                if current_line:
-                    c.drawString(40, y, ' '.join(current_line))
-                y -= 15
-            
-            # Check if we need a new page
-            if y < 40:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 12)  # Reset font for new page
-        
-        c.save()
-        buffer.seek(0)
-        return buffer.getvalue()
+        return render_worksheet_pdf(pdf_cache.document(content, parse_worksheet))
     except Exception as e:
         logger.error(f"Error generating PDF: {str(e)}")
         raise Exception(f"Error generating PDF: {str(e)}")
 
+def render_pdf(content: str) -> bytes:
+    with track_stage("render_pdf"):
+        return create_pdf(content)
+
 class Handler(BaseHTTPRequestHandler):
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept, If-None-Match')
         self.send_header('Access-Control-Max-Age', '86400')
         self.end_headers()
     
@@ -119,14 +52,27 @@ class Handler(BaseHTTPRequestHandler):
                     self.wfile.write(json.dumps({"error": "Content is required"}).encode())
                     return
                 
-                # Generate PDF
-                pdf_content = create_pdf(content)
+                # The client already has this PDF if its ETag matches
+                etag = pdf_cache.etag(content)
+                if etag_matches(self.headers.get('If-None-Match'), etag):
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Access-Control-Allow-Origin', '*')
+                    self.send_header('Access-Control-Expose-Headers', 'ETag')
+                    self.end_headers()
+                    return
+                
+                # Generate PDF, or reuse one rendered earlier
+                pdf_content, _ = pdf_cache.get_or_render(content, render_pdf)
                 
                 # Send response
                 self.send_response(200)
                 self.send_header('Content-Type', 'application/pdf')
                 self.send_header('Content-Disposition', 'attachment; filename=enhanced_worksheet.pdf')
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'private, no-cache')
                 self.send_header('Access-Control-Allow-Origin', '*')
+                self.send_header('Access-Control-Expose-Headers', 'ETag')
                 self.end_headers()
                 self.wfile.write(pdf_content)
                 
@@ -145,6 +91,7 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
 # Vercel serverless function handler
+@instrument_handler("/api/download")
 def handler(request):
     """Vercel serverless function handler"""
     logger.info("PDF generation handler called")
@@ -154,7 +101,7 @@ def handler(request):
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Accept, Authorization",
+            "Access-Control-Allow-Headers": "Content-Type, Accept, Authorization, If-None-Match",
             "Access-Control-Max-Age": "86400"
         }
         return {"statusCode": 200, "headers": headers, "body": ""}
@@ -185,8 +132,23 @@ def handler(request):
                 
                 logger.info(f"Received content for PDF generation, length: {len(content)}")
                 
-                # Generate PDF
-                pdf_content = create_pdf(content)
+                # The client already has this PDF if its ETag matches
+                etag = pdf_cache.etag(content)
+                headers = getattr(request, "headers", None) or {}
+                if_none_match = headers.get("If-None-Match") or headers.get("if-none-match")
+                if etag_matches(if_none_match, etag):
+                    return {
+                        "statusCode": 304,
+                        "headers": {
+                            "ETag": etag,
+                            "Access-Control-Allow-Origin": "*",
+                            "Access-Control-Expose-Headers": "ETag"
+                        },
+                        "body": ""
+                    }
+                
+                # Generate PDF, or reuse one rendered earlier
+                pdf_content, _ = pdf_cache.get_or_render(content, render_pdf)
                 
                 # Convert to base64 for response
                 pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
@@ -196,7 +158,10 @@ def handler(request):
                     "statusCode": 200,
                     "headers": {
                         "Content-Type": "application/json",
-                        "Access-Control-Allow-Origin": "*"
+                        "ETag": etag,
+                        "Cache-Control": "private, no-cache",
+                        "Access-Control-Allow-Origin": "*",
+                        "Access-Control-Expose-Headers": "ETag"
                     },
                     "body": json.dumps({"pdfBase64": pdf_base64})
                 }
@@ -3,34 +3,71 @@ import json
 import io
 import logging
 import base64
-from pypdf import PdfReader
 import os
-from dotenv import load_dotenv
-from openai import OpenAI
+from metrics import track_stage, record_token_usage, instrument_handler
+from deadlines import DEADLINE_HEADER, Deadline, DeadlineExceeded, deadline_scope, check_deadline, current_deadline, timeout_kwargs
+from text_compaction import PAGE_BREAK, compact_text
 
-# Load environment variables
-load_dotenv()
+# Heavy dependencies (pypdf, openai, dotenv) are imported on first use so that
+# cold starts and CORS preflights don't pay for them.
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-api_key = os.getenv('OPENAI_API_KEY')
-if not api_key:
-    logger.error("OPENAI_API_KEY not found in environment variables")
-else:
-    logger.info("OpenAI API key loaded successfully")
-openai_client = OpenAI(api_key=api_key)
+# Set once .env has been loaded, on the first enhancement request
+_env_loaded = False
 
 # Constants
 ALLOWED_EXTENSIONS = {'.pdf', '.docx'}
 
+def get_openai_client():
+    """Return the shared, pooled OpenAI client (see openai_client.py)"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+
+        # Load environment variables
+        load_dotenv()
+
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            logger.error("OPENAI_API_KEY not found in environment variables")
+        else:
+            logger.info("OpenAI API key loaded successfully")
+        _env_loaded = True
+
+    from openai_client import get_openai_client as shared_openai_client
+    return shared_openai_client()
+
+def extract_pdf_text(file_content: bytes) -> str:
+    """Extract the text of every page of a PDF"""
+    from pypdf import PdfReader
+
+    with track_stage("extract"):
+        pdf_reader = PdfReader(io.BytesIO(file_content))
+        document_text = ""
+        for page in pdf_reader.pages:
+            check_deadline("extract")
+            # Page breaks let compaction find repeated headers and footers
+            document_text += page.extract_text() + "\n" + PAGE_BREAK
+    return document_text
+
+def chat_completion(**kwargs):
+    """Run a chat completion, recording its latency and token usage"""
+    with track_stage("completion"):
+        # Bounded by what's left of the request deadline
+        response = get_openai_client().chat.completions.create(**kwargs, **timeout_kwargs())
+    record_token_usage(kwargs["model"], response.usage)
+    return response
+
 def enhance_document(document_text: str) -> str:
     """Process the document with OpenAI and return enhanced content"""
     try:
+        # Strip extraction noise first; blanks come back exactly in the output
+        compacted = compact_text(document_text)
         # Execute enhancement using the model
-        response = openai_client.chat.completions.create(
+        response = chat_completion(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": """You are an expert educator enhancing worksheets with climate change concepts.
@@ -71,10 +108,10 @@ Enhanced:
    - Line breaks
    - URLs
    - Instructions"""},
-                {"role": "user", "content": f"Enhance this worksheet by adding climate-related extensions in parentheses while preserving ALL original content exactly:\n\n{document_text}"}
+                {"role": "user", "content": f"Enhance this worksheet by adding climate-related extensions in parentheses while preserving ALL original content exactly:\n\n{compacted.text}"}
             ]
         )
-        return response.choices[0].message.content
+        return compacted.restore(response.choices[0].message.content)
     except Exception as e:
         logger.error(f"Error in enhance_document: {str(e)}")
         raise
@@ -145,12 +182,14 @@ def process_document(file_content, filename):
         # Process PDF files
         if filename.endswith('.pdf'):
             try:
-                pdf_file = io.BytesIO(file_content)
-                pdf_reader = PdfReader(pdf_file)
-                document_text = ""
-                for page in pdf_reader.pages:
-                    document_text += page.extract_text() + "\n"
+                document_text = extract_pdf_text(file_content)
                 logger.info(f"Extracted text from PDF, length: {len(document_text)}")
+            except DeadlineExceeded as e:
+                logger.warning(str(e))
+                return {
+                    "statusCode": 504,
+                    "body": json.dumps({"error": str(e)})
+                }
             except Exception as e:
                 logger.error(f"Error reading PDF: {str(e)}")
                 return {
@@ -185,8 +224,10 @@ def process_document(file_content, filename):
             }
         except Exception as e:
             logger.error(f"Error enhancing document: {str(e)}")
+            deadline = current_deadline()
             return {
-                "statusCode": 500,
+                # An upstream timeout caused by the deadline is a 504
+                "statusCode": 504 if deadline is not None and deadline.expired else 500,
                 "body": json.dumps({"error": f"Error enhancing document: {str(e)}"})
             }
     except Exception as e:
@@ -201,7 +242,7 @@ class Handler(BaseHTTPRequestHandler):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept')
+        self.send_header('Access-Control-Allow-Headers', f'Content-Type, Accept, {DEADLINE_HEADER}')
         self.send_header('Access-Control-Max-Age', '86400')
         self.end_headers()
     
@@ -233,8 +274,9 @@ class Handler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps({"error": "No file found in request"}).encode())
                 return
             
-            # Process the document
-            result = process_document(file_content, filename)
+            # Process the document within the request's deadline
+            with deadline_scope(Deadline.from_header(self.headers.get(DEADLINE_HEADER))):
+                result = process_document(file_content, filename)
             
             # Send response
             self.send_response(result.get('statusCode', 500))
@@ -252,6 +294,7 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
 # Vercel serverless function handler
+@instrument_handler("/api/enhance")
 def handler(request):
     logger.info("Vercel handler function called")
     
@@ -260,7 +303,7 @@ def handler(request):
         headers = {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "POST, OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type, Accept, Authorization",
+            "Access-Control-Allow-Headers": f"Content-Type, Accept, Authorization, {DEADLINE_HEADER}",
             "Access-Control-Max-Age": "86400"
         }
         return {"statusCode": 200, "headers": headers, "body": ""}
@@ -287,8 +330,9 @@ def handler(request):
                     "body": json.dumps({"error": "No file found in request"})
                 }
             
-            # Process the document
-            result = process_document(file_content, filename)
+            # Process the document within the request's deadline
+            with deadline_scope(Deadline.from_header(request.headers.get(DEADLINE_HEADER))):
+                result = process_document(file_content, filename)
             
             # Add CORS headers to response
             result["headers"] = {
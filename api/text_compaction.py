@@ -0,0 +1,203 @@
+"""Deterministic clean-up of extracted worksheet text before it is sent to the LLM.
+
+Text extracted with pypdf carries noise that costs input tokens (and, when
+the model copies it back, output tokens) without telling the model anything:
+
+- page headers and footers repeated on every page, and bare page numbers
+- long runs of ``____`` or ``....`` answer blanks
+- words split with a hyphen across a line break
+- trailing spaces, runs of blank lines and invisible characters
+
+compact_text() removes it. Extractors separate pages with PAGE_BREAK so
+headers and footers can be found: a line within EDGE_LINES of the top or
+bottom of at least half the pages (digits ignored, so "Page 3 of 9" matches)
+is kept where it first appears and dropped from the other pages. Blank runs
+become numbered placeholders, e.g. ``[blank 3]``, and restore() puts the
+original runs back into the model's output character for character. A word
+split across lines is rejoined only if the document never hyphenates it
+elsewhere, so "well-\nknown" next to "well-known" keeps its hyphen; the rest
+of the line below stays where it was. Spacing inside lines is left alone, as
+it may line up columns.
+
+
+    compacted = compact_text(document_text)
+    output = complete(compacted.text)
+    return compacted.restore(output)
+
+Tokens before and after are counted with tiktoken when it and its encoding
+are available, estimated from length otherwise, and what was saved is
+recorded per request. TEXT_COMPACTION=0 turns compaction off.
+"""
+import logging
+import math
+import os
+import re
+
+from metrics import record_tokens_saved
+
+logger = logging.getLogger(__name__)
+
+# Separates pages in extracted text; removed by compact_text()
+PAGE_BREAK = "\f"
+
+# How many non-empty lines at each end of a page can be a header or footer
+EDGE_LINES = 3
+
+# Blank runs shorter than this are left as they are; the placeholder is no shorter
+BLANK_MIN_LENGTH = 8
+
+BLANK_RUN = re.compile(r"_(?:[ \t]?_){%d,}|\.(?:[ \t]?\.){%d,}" % (BLANK_MIN_LENGTH - 1, BLANK_MIN_LENGTH - 1))
+PLACEHOLDER = re.compile(r"\[blank (\d+)\]")
+PAGE_NUMBER = re.compile(r"(page )?#( ?(of|/) ?#)?|- ?# ?-|#")
+QUESTION_START = re.compile(r"\s*\d+[.)]\s")
+HYPHENATED = re.compile(r"(\w*[a-z])-\n([a-z]\w*)[ \t]*")
+INVISIBLE = re.compile("[\u200b\u200c\u200d\u2060\ufeff\u00ad]")
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text under cl100k_base, or an estimate when tiktoken can't be loaded"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding couldn't be downloaded; don't retry per request
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+class CompactedText:
+    def __init__(self, text: str, blanks: list[str], tokens_before: int, tokens_after: int):
+        self.text = text
+        self.blanks = blanks
+        self.tokens_before = tokens_before
+        self.tokens_after = tokens_after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def restore(self, output: str) -> str:
+        """output with every placeholder the model kept replaced by its original blank run"""
+        if not self.blanks:
+            return output
+
+        def original(match):
+            index = int(match.group(1)) - 1
+            return self.blanks[index] if 0 <= index < len(self.blanks) else match.group(0)
+
+        return PLACEHOLDER.sub(original, output)
+
+
+def _line_key(line: str) -> str:
+    """Normalised form of a line for spotting repeats: case, spacing and digits ignored"""
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def _is_content(line: str) -> bool:
+    """Questions and lines with blanks to fill in are never headers, however often they repeat"""
+    return bool(QUESTION_START.match(line) or PLACEHOLDER.search(line))
+
+
+def _edge_keys(lines: list[str]) -> set:
+    keys = [_line_key(line) for line in lines if line.strip()]
+    return set(keys[:EDGE_LINES] + keys[-EDGE_LINES:])
+
+
+def _strip_repeated_edges(pages: list[list[str]]) -> list[list[str]]:
+    """Drop repeated headers and footers (all but their first appearance) and bare page numbers"""
+    counts = {}
+    for lines in pages:
+        for key in _edge_keys(lines):
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(2, math.ceil(len(pages) / 2))
+    repeated = {key for key, count in counts.items() if count >= threshold}
+
+    seen = set()
+    stripped = []
+    for lines in pages:
+        drop, visited = set(), set()
+        # Inwards from the top, then from the bottom, until a line isn't a header/footer
+        for order in (range(len(lines)), range(len(lines) - 1, -1, -1)):
+            checked = 0
+            for i in order:
+                if checked == EDGE_LINES or i in visited:
+                    break
+                visited.add(i)
+                if not lines[i].strip():
+                    continue
+                checked += 1
+                key = _line_key(lines[i])
+                if _is_content(lines[i]):
+                    break
+                if PAGE_NUMBER.fullmatch(key) or key in seen:
+                    drop.add(i)
+                elif key in repeated:
+                    # First appearance (e.g. the title on page one) stays
+                    seen.add(key)
+                else:
+                    break
+        stripped.append([line for i, line in enumerate(lines) if i not in drop])
+    return stripped
+
+
+def _dehyphenate(text: str) -> str:
+    """Rejoin words split across lines, unless the document hyphenates them elsewhere"""
+    def rejoin(match):
+        head, tail = match.group(1), match.group(2)
+        if f"{head}-{tail}".lower() in text.lower():
+            return match.group(0)
+        # Only the word moves up; the rest of the next line stays on its own line
+        rest = text[match.end():].split("\n", 1)[0]
+        return head + tail + ("\n" if rest.strip() else "")
+
+    return HYPHENATED.sub(rejoin, text)
+
+
+def _normalise_whitespace(text: str) -> str:
+    text = INVISIBLE.sub("", text).replace("\u00a0", " ")
+    lines = []
+    for line in text.split("\n"):
+        line = line.rstrip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip("\n") + "\n"
+
+
+def compact_text(text: str) -> CompactedText:
+    """Compact extracted worksheet text (pages separated by PAGE_BREAK) for a prompt"""
+    if os.getenv('TEXT_COMPACTION', '1') != '1':
+        text = text.replace(PAGE_BREAK, "")
+        tokens = count_tokens(text)
+        return CompactedText(text, [], tokens, tokens)
+
+    tokens_before = count_tokens(text.replace(PAGE_BREAK, ""))
+
+    blanks = []
+    # A worksheet already containing placeholder text keeps its blanks, so restore() stays exact
+    if not PLACEHOLDER.search(text):
+        def placeholder(match):
+            blanks.append(match.group(0))
+            return f"[blank {len(blanks)}]"
+
+        text = BLANK_RUN.sub(placeholder, text)
+
+    pages = [page.split("\n") for page in text.split(PAGE_BREAK) if page.strip()]
+    if len(pages) > 1:
+        pages = _strip_repeated_edges(pages)
+    text = "\n".join("\n".join(lines) for lines in pages)
+    text = _dehyphenate(text)
+    text = _normalise_whitespace(text)
+
+    compacted = CompactedText(text, blanks, tokens_before, count_tokens(text))
+    record_tokens_saved(max(compacted.tokens_saved, 0))
+    logger.info(
+        f"Compacted worksheet: {compacted.tokens_before} -> {compacted.tokens_after} tokens "
+        f"({compacted.tokens_saved} saved, {len(blanks)} blanks)"
+    )
+    return compacted
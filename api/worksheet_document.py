@@ -0,0 +1,246 @@
+"""Parsed form of an enhanced worksheet, shared by the PDF renderer and exporters.
+
+The enhancer formats worksheets as plain text with a few conventions:
+
+    *Title*               major title
+    **Section Header**    heading
+    1. Question text      numbered question
+    https://example.org   link on its own line
+    Answer: ________      answer blank (a label, or nothing, then a run of underscores)
+    anything else         paragraph
+
+parse_worksheet() classifies each line once into a tuple of Blocks. Callers
+that render the same worksheet repeatedly keep the result with the rendered
+output (see PDFCache.document()), so one worksheet is parsed once for PDF,
+DOCX and HTML and for every repeat download. PDFLayout lays Blocks out
+one at a time, so a worksheet still being generated can be laid out as its
+lines arrive (see parse_line()). reportlab and python-docx are imported by
+their renderers only.
+"""
+from typing import NamedTuple
+import html
+import io
+import re
+
+TITLE = "title"
+HEADING = "heading"
+QUESTION = "question"
+URL = "url"
+PARAGRAPH = "paragraph"
+BLANK = "blank"
+ANSWER = "answer"
+
+QUESTION_PATTERN = re.compile(r"(\d+)\.\s+(.*)")
+ANSWER_PATTERN = re.compile(r"(.*?)\s*_{3,}[_\s]*")
+
+# Shortest answer rule drawn after a label on the same line, in points
+MIN_RULE_WIDTH = 72
+
+
+class Block(NamedTuple):
+    kind: str
+    text: str = ""
+    # Question number as written, e.g. "3"
+    number: str = None
+
+
+def parse_line(line: str) -> Block:
+    """Classify one line of worksheet text"""
+    line = line.strip()
+    if not line:
+        return Block(BLANK)
+    if line.startswith('**') and line.endswith('**'):
+        return Block(HEADING, line.replace('**', ''))
+    if line.startswith('*') and line.endswith('*'):
+        return Block(TITLE, line.replace('*', ''))
+    if line.startswith(('http://', 'https://')) and ' ' not in line:
+        return Block(URL, line)
+    if question := QUESTION_PATTERN.fullmatch(line):
+        return Block(QUESTION, question.group(2), question.group(1))
+    if answer := ANSWER_PATTERN.fullmatch(line):
+        return Block(ANSWER, answer.group(1))
+    return Block(PARAGRAPH, line)
+
+
+def parse_worksheet(content: str) -> tuple:
+    """Split worksheet text into Blocks in a single pass"""
+    return tuple(parse_line(line) for line in content.split('\n'))
+
+
+class PDFLayout:
+    """Letter-size PDF laid out a Block at a time; add() each in order, then finish()"""
+
+    def __init__(self):
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+
+        self._buffer = io.BytesIO()
+        self._canvas = canvas.Canvas(self._buffer, pagesize=letter)
+        self.width, self.height = letter
+        self.y = self.height - 40  # Start 40 points down from top
+        # Font configurations
+        self._canvas.setFont("Helvetica-Bold", 16)  # Default font for headers
+
+    def _draw_wrapped(self, text: str, x: int, indent: int) -> None:
+        """Draw text word-wrapped to the page width, continuation lines at indent"""
+        c = self._canvas
+        current_line = []
+        for word in text.split():
+            current_line.append(word)
+            if c.stringWidth(' '.join(current_line)) > self.width - 80:
+                c.drawString(x, self.y, ' '.join(current_line[:-1]))
+                self.y -= 15
+                current_line = [word]
+                x = indent
+        if current_line:
+            c.drawString(x, self.y, ' '.join(current_line))
+
+    def _draw_wrapped_spaced(self, text: str, x: int, indent: int) -> None:
+        """_draw_wrapped() keeping the text's own spacing; only the space a line breaks at is dropped"""
+        c = self._canvas
+        current = ""
+        for space, word in re.findall(r"(\s*)(\S+)", text):
+            if current and c.stringWidth(current + space + word) > self.width - 80:
+                c.drawString(x, self.y, current)
+                self.y -= 15
+                current = word
+                x = indent
+            else:
+                current += space + word
+        if current:
+            c.drawString(x, self.y, current)
+
+    def add_all(self, blocks) -> None:
+        for block in blocks:
+            self.add(block)
+
+    def add(self, block: Block) -> None:
+        c = self._canvas
+        # Skip empty lines but add spacing
+        if block.kind == BLANK:
+            self.y -= 15
+            return
+
+        if block.kind == HEADING:
+            c.setFont("Helvetica-Bold", 14)
+            c.drawString(40, self.y, block.text)
+            self.y -= 25  # More spacing after headers
+            c.setFont("Helvetica", 12)  # Reset font
+
+        elif block.kind == TITLE:
+            c.setFont("Helvetica-Bold", 16)
+            c.drawString(40, self.y, block.text)
+            self.y -= 30  # More spacing after major headers
+            c.setFont("Helvetica", 12)  # Reset font
+
+        elif block.kind == QUESTION:
+            c.setFont("Helvetica", 12)
+            self._draw_wrapped_spaced(f"{block.number}. {block.text}", 40, 60)  # Indent continuation lines
+            self.y -= 20  # More spacing after questions
+
+        elif block.kind == URL:
+            # URLs have no spaces to wrap at, so break long ones after a '/'
+            c.setFont("Helvetica-Oblique", 12)
+            text = block.text
+            while c.stringWidth(text) > self.width - 80:
+                break_point = text.rfind('/', 0, len(text) - 1)
+                while break_point > 0 and c.stringWidth(text[:break_point + 1]) > self.width - 80:
+                    break_point = text.rfind('/', 0, break_point)
+                if break_point <= 0:
+                    break
+                c.drawString(40, self.y, text[:break_point + 1])
+                text = text[break_point + 1:]
+                self.y -= 15
+            c.drawString(40, self.y, text)
+            self.y -= 15
+
+        elif block.kind == ANSWER:
+            # A rule to write on, after the label if there is one
+            c.setFont("Helvetica", 12)
+            x = 40
+            if block.text and c.stringWidth(block.text + " ") + MIN_RULE_WIDTH > self.width - 80:
+                # Too long to share a line with the rule, so the rule goes underneath
+                self._draw_wrapped(block.text, 40, 40)
+                self.y -= 20
+            elif block.text:
+                c.drawString(x, self.y, block.text)
+                x += c.stringWidth(block.text + " ")
+            c.line(x, self.y - 2, self.width - 40, self.y - 2)
+            self.y -= 20
+
+        else:
+            c.setFont("Helvetica", 12)
+            self._draw_wrapped(block.text, 40, 40)
+            self.y -= 15
+
+        # Check if we need a new page
+        if self.y < 40:
+            c.showPage()
+            self.y = self.height - 40
+            c.setFont("Helvetica", 12)  # Reset font for new page
+
+    def finish(self) -> bytes:
+        self._canvas.save()
+        return self._buffer.getvalue()
+
+
+def render_pdf(blocks) -> bytes:
+    """Lay the worksheet out on letter-size pages"""
+    layout = PDFLayout()
+    for block in blocks:
+        layout.add(block)
+    return layout.finish()
+
+
+def render_docx(blocks) -> bytes:
+    """Export the worksheet as a Word document"""
+    from docx import Document
+
+    document = Document()
+    for block in blocks:
+        if block.kind == TITLE:
+            document.add_heading(block.text, level=0)
+        elif block.kind == HEADING:
+            document.add_heading(block.text, level=1)
+        elif block.kind == QUESTION:
+            paragraph = document.add_paragraph()
+            paragraph.add_run(f"{block.number}. ").bold = True
+            paragraph.add_run(block.text)
+        elif block.kind == URL:
+            document.add_paragraph().add_run(block.text).italic = True
+        elif block.kind == ANSWER:
+            document.add_paragraph(f"{block.text} {'_' * 40}".strip())
+        elif block.kind == PARAGRAPH:
+            document.add_paragraph(block.text)
+        # Paragraph spacing already separates blocks, so blank lines are dropped
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def render_html(blocks, title: str = "Enhanced worksheet") -> str:
+    """Export the worksheet as a standalone HTML page"""
+    body = []
+    for block in blocks:
+        text = html.escape(block.text)
+        if block.kind == TITLE:
+            body.append(f"<h1>{text}</h1>")
+        elif block.kind == HEADING:
+            body.append(f"<h2>{text}</h2>")
+        elif block.kind == QUESTION:
+            body.append(
+                f'<p class="question" style="white-space: pre-wrap"><strong>{html.escape(block.number)}.</strong> {text}</p>'
+            )
+        elif block.kind == URL:
+            body.append(f'<p><a href="{html.escape(block.text, quote=True)}">{text}</a></p>')
+        elif block.kind == ANSWER:
+            body.append(f'<p class="answer">{text} <span style="display: inline-block; width: 60%; border-bottom: 1px solid"></span></p>')
+        elif block.kind == PARAGRAPH:
+            body.append(f"<p>{text}</p>")
+
+    return (
+        "<!DOCTYPE html>\n"
+        f'<html lang="en">\n<head>\n<meta charset="utf-8">\n<title>{html.escape(title)}</title>\n</head>\n'
+        "<body>\n" + "\n".join(body) + "\n</body>\n</html>\n"
+    )
@@ -1,25 +1,84 @@
-from fastapi import FastAPI, UploadFile, File, Body, HTTPException
+from fastapi import FastAPI, UploadFile, File, Body, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Match
 from ml.rag_processor import DocumentEnhancer
+from ml.metrics import registry, track_stage, record_request
+from ml.profiling import request_profiler, profiled, PROFILE_ID_HEADER
+from ml.pdf_cache import PDFCache, etag_matches
+from ml.artifact_store import make_artifact_store
+from ml.admission import AdmissionController, Shed, PRIORITY_HEADER, request_priority
+from ml import pdf_extraction
+from ml.deadlines import (
+    DEADLINE_HEADER, Deadline, DeadlineExceeded, ClientDisconnected, deadline_scope, check_deadline, run_cancellable,
+    wait_for_disconnect
+)
+from ml.worksheet_document import (
+    PDFLayout, parse_line, parse_worksheet, render_pdf as render_worksheet_pdf, render_docx, render_html
+)
 import uvicorn
-from pypdf import PdfReader
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import io
+import asyncio
+import time
 from typing import List
 
 app = FastAPI()
 
-# Setup CORS
+# Enhancement requests go through admission control; see ml/admission.py
+admission = AdmissionController()
+ADMITTED_PATHS = {"/api/enhance-document", "/api/enhance-document/pdf"}
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Bound concurrent enhancements, queueing briefly and shedding the rest with Retry-After"""
+    if request.method != "POST" or request.url.path not in ADMITTED_PATHS:
+        return await call_next(request)
+    # The deadline starts on arrival, so time spent queued counts against it
+    deadline = request.state.deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    try:
+        async with admission.admit(request_priority(request.headers.get(PRIORITY_HEADER)), deadline):
+            return await call_next(request)
+    except Shed as e:
+        # Before the upload is read, so shedding costs next to nothing
+        return JSONResponse({"detail": str(e)}, status_code=e.status, headers={"Retry-After": str(e.retry_after)})
+
+# Setup CORS (added after admission control so shed responses get CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],  # Your React app URL
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After", "X-Document-Id"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count every request and its latency by route"""
+    start = time.perf_counter()
+    # Label by route template rather than raw URL to keep label cardinality bounded
+    path = next(
+        (route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL),
+        "unmatched"
+    )
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_request(request.method, path, 500, time.perf_counter() - start)
+        raise
+    record_request(request.method, path, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile the request when asked to by the admin header or the sample rate"""
+    if not request_profiler.should_profile(request.headers):
+        return await call_next(request)
+    with request_profiler.profile(f"{request.method} {request.url.path}") as profile:
+        response = await call_next(request)
+    if profile.id:
+        response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
+
 # Initialize RAG processor
 document_enhancer = DocumentEnhancer()
 
@@ -27,6 +86,17 @@ document_enhancer = DocumentEnhancer()
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 ALLOWED_EXTENSIONS = {'.pdf', '.docx'}
 
+# Bump whenever create_pdf's output changes so cached PDFs are re-rendered
+PDF_RENDERER_VERSION = "backend-3"
+pdf_cache = PDFCache(PDF_RENDERER_VERSION)
+
+# Enhanced worksheets, downloadable by id; see ml/artifact_store.py
+artifact_store = make_artifact_store()
+
+def request_deadline(request: Request) -> Deadline:
+    """The deadline admission control started for this request, else one starting now"""
+    return getattr(request.state, "deadline", None) or Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+
 def validate_file(file: UploadFile):
     """Validate file type and size"""
     # Check file extension
@@ -56,143 +126,109 @@ def validate_file(file: UploadFile):
 
 def create_pdf(content: str) -> bytes:
     try:
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        y = height - 40  # Start 40 points down from top
-        
-        # Font configurations
-        c.setFont("Helvetica-Bold", 16)  # Default font for headers
-        
-        # Split content into lines
-        lines = content.split('\n')
-        for line in lines:
-            # Skip empty lines but add spacing
-            if not line.strip():
-                y -= 15
-                continue
-                
-            # Handle double asterisk sections (smaller headers)
-            if line.startswith('**') and line.endswith('**'):
-                c.setFont("Helvetica-Bold", 14)
-                text = line.replace('**', '')
-                c.drawString(40, y, text)
-                y -= 25  # More spacing after headers
-                c.setFont("Helvetica", 12)  # Reset font
-                
-            # Handle single asterisk sections (major headers)
-            elif line.startswith('*') and line.endswith('*'):
-                c.setFont("Helvetica-Bold", 16)
-                text = line.replace('*', '')
-                c.drawString(40, y, text)
-                y -= 30  # More spacing after major headers
-                c.setFont("Helvetica", 12)  # Reset font
-                
-            # Handle questions (lines starting with numbers)
-            elif line.strip() and line[0].isdigit() and '. ' in line:
-                c.setFont("Helvetica", 12)
-                # Wrap long lines
-                words = line.split()
-                current_line = []
-                x = 40
-                
-                for word in words:
-                    current_line.append(word)
-                    if c.stringWidth(' '.join(current_line)) > width - 80:
-                        c.drawString(x, y, ' '.join(current_line[:-1]))
-                        y -= 15
-                        current_line = [word]
-                        x = 60  # Indent continuation lines
-                
-                if current_line:
-                    c.drawString(x, y, ' '.join(current_line))
-                y -= 20  # More spacing after questions
-                
-            # Regular text
-            else:
-                c.setFont("Helvetica", 12)
-                # Wrap long lines
-                words = line.split()
-                current_line = []
-                
-                for word in words:
-                    current_line.append(word)
-                    if c.stringWidth(' '.join(current_line)) > width - 80:
-                        c.drawString(40, y, ' '.join(current_line[:-1]))
-                        y -= 15
-                        current_line = [word]
-                
-                if current_line:
-                    c.drawString(40, y, ' '.join(current_line))
-                y -= 15
-            
-            # Check if we need a new page
-            if y < 40:
-                c.showPage()
-                y = height - 40
-                c.setFont("Helvetica", 12)  # Reset font for new page
-        
-        c.save()
-        buffer.seek(0)
-        return buffer.getvalue()
+        return render_worksheet_pdf(pdf_cache.document(content, parse_worksheet))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating PDF: {str(e)}"
         )
 
+def extract_pdf_text(content: bytes) -> str:
+    """Extract the text of every page, in parallel for large PDFs, within the request deadline"""
+    with track_stage("extract"):
+        return pdf_extraction.extract_pdf_text(content)
+
 @app.post("/api/enhance-document")
 async def enhance_document(
+    request: Request,
     file: UploadFile = File(...),
-    subject_area: str = "biology"
+    subject_area: str = "biology",
+    model: str = None
 ):
+    # One deadline covers queueing, extraction, retrieval and the completion, and the work
+    # is cancelled if the client goes away first; see ml/deadlines.py
+    with deadline_scope(request_deadline(request)):
+        try:
+            return await run_cancellable(
+                enhance_upload(request, file, subject_area, model),
+                wait_for_disconnect(request.receive)
+            )
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except ClientDisconnected:
+            # Nobody is listening; the status only labels the request in metrics
+            return Response(status_code=499)
+
+def select_model(request: Request, model: str = None) -> str:
+    """Model for this request, picked up front so an unknown override fails before any work"""
     try:
-        # Validate file
-        validate_file(file)
-        content = await file.read()
-        
-        # Handle PDF files
-        if file.filename.endswith('.pdf'):
-            try:
-                pdf_file = io.BytesIO(content)
-                pdf_reader = PdfReader(pdf_file)
-                document_text = ""
-                for page in pdf_reader.pages:
-                    document_text += page.extract_text() + "\n"
-            except Exception as e:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Error reading PDF file: {str(e)}"
-                )
-        # Handle DOCX files
-        elif file.filename.endswith('.docx'):
-            try:
-                document_text = content.decode('utf-8')
-            except UnicodeDecodeError:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Error reading DOCX file. Please ensure it's a valid document."
-                )
-        else:
+        routing_key = request.client.host if request.client else None
+        return document_enhancer.select_model(model, routing_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def read_document_text(file: UploadFile) -> str:
+    """Validate an upload and return its text"""
+    # Validate file
+    validate_file(file)
+    content = await file.read()
+    
+    # Handle PDF files
+    if file.filename.endswith('.pdf'):
+        try:
+            # Off the event loop, so other requests (and disconnects) are still seen
+            return await asyncio.to_thread(profiled(extract_pdf_text), content)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
             raise HTTPException(
                 status_code=400,
-                detail="Unsupported file format. Please upload a PDF or DOCX file."
+                detail=f"Error reading PDF file: {str(e)}"
             )
+    # Handle DOCX files
+    elif file.filename.endswith('.docx'):
+        try:
+            return content.decode('utf-8')
+        except UnicodeDecodeError:
+            raise HTTPException(
+                status_code=400,
+                detail="Error reading DOCX file. Please ensure it's a valid document."
+            )
+    else:
+        raise HTTPException(
+            status_code=400,
+            detail="Unsupported file format. Please upload a PDF or DOCX file."
+        )
+
+async def enhance_upload(request: Request, file: UploadFile, subject_area: str, model: str = None) -> dict:
+    try:
+        model = select_model(request, model)
+        document_text = await read_document_text(file)
         
         # Process with RAG
         try:
-            enhanced_content = document_enhancer.enhance_document(
+            enhanced_content = await document_enhancer.enhance_document_async(
                 document_text,
-                subject_area
+                subject_area,
+                model=model
             )
-            return {"enhanced_content": enhanced_content}
+            # Saved so downloads can ask for it by id instead of posting it back
+            document_id = artifact_store.put(enhanced_content, {"model": model, "filename": file.filename})
+            return {
+                "enhanced_content": enhanced_content,
+                "model": model,
+                "document_id": document_id,
+                "pdf_url": f"/api/documents/{document_id}.pdf"
+            }
         except Exception as e:
+            # An upstream timeout caused by the deadline is a 504, not a 500
+            check_deadline("completion")
             raise HTTPException(
                 status_code=500,
                 detail=f"Error enhancing document: {str(e)}"
             )
             
-    except HTTPException:
+    except (HTTPException, DeadlineExceeded):
         raise
     except Exception as e:
         raise HTTPException(
@@ -200,8 +236,82 @@ async def enhance_document(
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+@app.post("/api/enhance-document/pdf")
+async def enhance_document_pdf(
+    request: Request,
+    file: UploadFile = File(...),
+    subject_area: str = "biology",
+    model: str = None
+):
+    """enhance-document and download-pdf in one request, answered with the PDF.
+    
+    Sections are laid out while later ones are still being generated, so once
+    the last token arrives only the PDF itself is left to write. The result is
+    stored as for enhance-document; its id is in the X-Document-Id header."""
+    with deadline_scope(request_deadline(request)):
+        try:
+            return await run_cancellable(
+                enhance_and_render(request, file, subject_area, model),
+                wait_for_disconnect(request.receive)
+            )
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except ClientDisconnected:
+            return Response(status_code=499)
+
+async def enhance_and_render(request: Request, file: UploadFile, subject_area: str, model: str = None) -> Response:
+    try:
+        model = select_model(request, model)
+        document_text = await read_document_text(file)
+        
+        try:
+            layout = PDFLayout()
+            lines, blocks = [], []
+            async for batch in document_enhancer.enhance_document_lines(document_text, subject_area, model=model):
+                # Laying out a line takes microseconds, so each batch is done in place as it arrives
+                batch_blocks = [parse_line(line) for line in batch]
+                layout.add_all(batch_blocks)
+                lines.extend(batch)
+                blocks.extend(batch_blocks)
+            with track_stage("render_pdf"):
+                pdf_content = await asyncio.to_thread(profiled(layout.finish))
+        except Exception as e:
+            check_deadline("completion")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error enhancing document: {str(e)}"
+            )
+        
+        # Laid out as it streamed it's the same PDF render_pdf() makes, so later downloads hit the cache
+        enhanced_content = "\n".join(lines)
+        key = pdf_cache.key(enhanced_content)
+        pdf_cache.put(key, pdf_content)
+        pdf_cache.put_document(key, tuple(blocks))
+        document_id = artifact_store.put(enhanced_content, {"model": model, "filename": file.filename})
+        return Response(
+            pdf_content,
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": "attachment; filename=enhanced_worksheet.pdf",
+                "X-Document-Id": document_id,
+                "ETag": pdf_cache.etag(enhanced_content),
+                "Cache-Control": "private, no-cache"
+            }
+        )
+    except (HTTPException, DeadlineExceeded):
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+def render_pdf(content: str) -> bytes:
+    with track_stage("render_pdf"):
+        return create_pdf(content)
+
 @app.post("/api/download-pdf")
-async def download_pdf(content: str = Body(...)):
+async def download_pdf(request: Request, content: str = Body(...)):
     if not content or len(content.strip()) == 0:
         raise HTTPException(
             status_code=400,
@@ -209,14 +319,23 @@ async def download_pdf(content: str = Body(...)):
         )
         
     try:
-        pdf_content = create_pdf(content)
+        # The ETag is derived from the content, so a client that already has
+        # this PDF needs neither a render nor a cache lookup
+        etag = pdf_cache.etag(content)
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=cache_headers)
         
-        return StreamingResponse(
-            io.BytesIO(pdf_content),
+        pdf_content, _ = pdf_cache.get_or_render(content, render_pdf)
+        
+        # Sent whole: a StreamingResponse over BytesIO goes out a line at a time,
+        # which costs more than the cache saves
+        return Response(
+            pdf_content,
             media_type="application/pdf",
             headers={
                 "Content-Disposition": "attachment; filename=enhanced_worksheet.pdf",
-                "Content-Type": "application/pdf"
+                **cache_headers
             }
         )
     except HTTPException:
@@ -227,5 +346,83 @@ async def download_pdf(content: str = Body(...)):
             detail=f"Error generating PDF: {str(e)}"
         )
 
+@app.get("/api/documents/{document_id}.pdf")
+async def download_document_pdf(request: Request, document_id: str):
+    """PDF of a stored enhancement, rendered on first request and cached after"""
+    artifact = artifact_store.get(document_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Document not found or expired")
+    content, _ = artifact
+    
+    # Same ETag as /api/download-pdf for the same content
+    etag = pdf_cache.etag(content)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    try:
+        pdf_content, _ = pdf_cache.get_or_render(content, render_pdf)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating PDF: {str(e)}"
+        )
+    
+    return Response(
+        pdf_content,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": "attachment; filename=enhanced_worksheet.pdf",
+            **cache_headers
+        }
+    )
+
+@app.post("/api/download-docx")
+async def download_docx(content: str = Body(...)):
+    if not content or len(content.strip()) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="No content provided for DOCX generation"
+        )
+    
+    try:
+        with track_stage("render_docx"):
+            docx_content = render_docx(pdf_cache.document(content, parse_worksheet))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating DOCX: {str(e)}"
+        )
+    
+    return Response(
+        docx_content,
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={"Content-Disposition": "attachment; filename=enhanced_worksheet.docx"}
+    )
+
+@app.post("/api/download-html")
+async def download_html(content: str = Body(...)):
+    if not content or len(content.strip()) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="No content provided for HTML generation"
+        )
+    
+    with track_stage("render_html"):
+        html_content = render_html(pdf_cache.document(content, parse_worksheet))
+    
+    return Response(
+        html_content,
+        media_type="text/html; charset=utf-8",
+        headers={"Content-Disposition": "attachment; filename=enhanced_worksheet.html"}
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
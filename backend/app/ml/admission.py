@@ -0,0 +1,183 @@
+"""Admission control for the enhancement endpoints: bounded work, a short queue, and shedding.
+
+An enhancement holds its request for tens of seconds. Under a spike (a whole
+school uploading at 8am), accepting everything just makes every request slow
+until they all time out. Instead, each worker:
+
+- runs at most ADMISSION_MAX_CONCURRENT enhancements at once (default 8);
+- queues up to ADMISSION_QUEUE_SIZE more (default 16), each for at most
+  ADMISSION_MAX_WAIT_SECONDS (default 10) or whatever is left of the
+  request's deadline, if that is less;
+- sheds the rest at once, with a Retry-After estimated from recent service
+  times.
+
+A request that couldn't start in time even at the back of the queue is shed
+on arrival rather than after waiting.
+
+Requests are interactive unless they send X-Request-Priority: bulk (batch
+uploads, scripts). Interactive requests are always dequeued first, may take
+a queued bulk request's place when the queue is full, and bulk requests may
+hold at most ADMISSION_BULK_SHARE (default 0.5) of the slots. A backlog of
+bulk work therefore can't stall people waiting on a page.
+
+Shed interactive requests get 503 (the service is overloaded). Shed bulk
+requests get 429, telling batch clients to back off. ADMISSION_MAX_CONCURRENT=0
+turns admission control off.
+
+State is per process and touched only from the event loop, so it needs no
+locking.
+"""
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+
+from .metrics import record_admission
+
+PRIORITY_HEADER = "X-Request-Priority"
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+# Queue order: lower first
+RANKS = {INTERACTIVE: 0, BULK: 1}
+
+# Service time assumed for Retry-After until an enhancement has finished
+DEFAULT_SERVICE_SECONDS = 10.0
+# Weight of the latest enhancement in the moving average of service time
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class Shed(Exception):
+    """Request refused by admission control: respond with status and Retry-After"""
+
+    def __init__(self, status: int, message: str, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def request_priority(value: str = None) -> str:
+    """Priority class from a priority header value; anything but "bulk" is interactive"""
+    return BULK if (value or "").strip().lower() == BULK else INTERACTIVE
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = None, queue_size: int = None, max_wait: float = None,
+                 bulk_share: float = None):
+        self.max_concurrent = max_concurrent if max_concurrent is not None else int(os.getenv('ADMISSION_MAX_CONCURRENT', '8'))
+        self.queue_size = queue_size if queue_size is not None else int(os.getenv('ADMISSION_QUEUE_SIZE', '16'))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('ADMISSION_MAX_WAIT_SECONDS', '10'))
+        bulk_share = bulk_share if bulk_share is not None else float(os.getenv('ADMISSION_BULK_SHARE', '0.5'))
+        self.bulk_limit = max(1, int(self.max_concurrent * bulk_share))
+        self.running = {INTERACTIVE: 0, BULK: 0}
+        self.queued = {INTERACTIVE: 0, BULK: 0}
+        # (rank, arrival, priority, future); futures of requests no longer waiting are skipped
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._service_time = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def _can_start(self, priority: str) -> bool:
+        if sum(self.running.values()) >= self.max_concurrent:
+            return False
+        return priority == INTERACTIVE or self.running[BULK] < self.bulk_limit
+
+    def _ahead(self, priority: str) -> int:
+        """Requests queued that would start before a new one of this priority"""
+        return self.queued[INTERACTIVE] if priority == INTERACTIVE else sum(self.queued.values())
+
+    def _expected_wait(self, ahead: int) -> float:
+        """Seconds until a request with ahead others in front of it could start"""
+        service = self._service_time or DEFAULT_SERVICE_SECONDS
+        return service * (ahead + 1) / self.max_concurrent
+
+    def _shed(self, priority: str, outcome: str, message: str) -> Shed:
+        record_admission(priority, outcome)
+        retry_after = max(1, math.ceil(self._expected_wait(sum(self.queued.values()))))
+        if priority == BULK:
+            return Shed(429, f"{message}; bulk requests should retry later", retry_after)
+        return Shed(503, f"{message}; please try again in a few seconds", retry_after)
+
+    def _evict_bulk(self) -> bool:
+        """Shed the most recently queued bulk request to make room; False if none is queued"""
+        waiting = [w for w in self._waiters if w[2] == BULK and not w[3].done()]
+        if not waiting:
+            return False
+        newest = max(waiting, key=lambda w: w[1])
+        self.queued[BULK] -= 1
+        newest[3].set_exception(self._shed(BULK, "evicted", "Queue full of interactive requests"))
+        return True
+
+    def _dispatch(self):
+        """Start queued requests, best first, while there are slots for them"""
+        while self._waiters:
+            _, _, priority, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            # The head is the best waiter, so if it can't start nothing behind it can
+            if not self._can_start(priority):
+                return
+            heapq.heappop(self._waiters)
+            self.queued[priority] -= 1
+            # The slot is taken on the waiter's behalf, so nobody arriving meanwhile gets it
+            self.running[priority] += 1
+            future.set_result(None)
+
+    def _release(self, priority: str, service_time: float = None):
+        self.running[priority] -= 1
+        if service_time is not None:
+            self._service_time = service_time if self._service_time is None else (
+                SERVICE_TIME_WEIGHT * service_time + (1 - SERVICE_TIME_WEIGHT) * self._service_time
+            )
+        self._dispatch()
+
+    async def _acquire(self, priority: str, max_wait: float):
+        if self._can_start(priority):
+            self.running[priority] += 1
+            return
+
+        ahead = self._ahead(priority)
+        if self._service_time is not None and self._expected_wait(ahead) > max_wait:
+            raise self._shed(priority, "wait_too_long", "Too busy to start this request in time")
+        if sum(self.queued.values()) >= self.queue_size:
+            if priority == BULK or not self._evict_bulk():
+                raise self._shed(priority, "queue_full", "Too many requests queued")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (RANKS[priority], next(self._arrivals), priority, future))
+        self.queued[priority] += 1
+        try:
+            await asyncio.wait_for(future, timeout=max(max_wait, 0))
+        except asyncio.TimeoutError:
+            self.queued[priority] -= 1
+            raise self._shed(priority, "timed_out", "Waited too long for a free slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the request went away: hand the slot on
+                self._release(priority)
+            elif not future.done() or future.cancelled():
+                self.queued[priority] -= 1
+            raise
+
+    @asynccontextmanager
+    async def admit(self, priority: str = INTERACTIVE, deadline=None):
+        """Hold an enhancement slot for the body of the block; raises Shed if one can't be had in time"""
+        if not self.enabled:
+            yield
+            return
+        arrived = time.monotonic()
+        max_wait = min(self.max_wait, deadline.remaining()) if deadline is not None else self.max_wait
+        await self._acquire(priority, max_wait)
+        started = time.monotonic()
+        record_admission(priority, "admitted", started - arrived)
+        try:
+            yield
+        finally:
+            self._release(priority, time.monotonic() - started)
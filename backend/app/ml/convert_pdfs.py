@@ -1,45 +1,204 @@
+"""Convert the worksheet library to text.
+
+Every ``worksheets/<collection>/<subject>/*.pdf`` (and ``.docx``) is converted
+to ``<subject>/text/<name>.pdf.txt`` (``.docx.txt``) using a process pool. A
+manifest records the content hash of each converted file, so re-runs only
+convert new or changed documents. It is saved every MANIFEST_SAVE_EVERY
+conversions and when the run ends, even if it ends early, so an interrupted run
+picks up where it stopped:
+
+    python app/ml/convert_pdfs.py                 # all collections and subjects
+    python app/ml/convert_pdfs.py --workers 8 --force
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from pypdf import PdfReader
+import argparse
+import hashlib
+import json
 import os
+import tempfile
+import time
+
+MANIFEST_NAME = ".convert_manifest.json"
+EXTENSIONS = (".pdf", ".docx")
+
+# Conversions between manifest saves during a run
+MANIFEST_SAVE_EVERY = 50
+
+
+def extract_text(path: Path) -> str:
+    """Extract the text of a PDF or DOCX file"""
+    if path.suffix.lower() == ".docx":
+        import docx2txt
+        return docx2txt.process(str(path))
+
+    # Read PDF and extract text from each page
+    reader = PdfReader(path)
+    return "".join(page.extract_text() + "\n" for page in reader.pages)
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
-def convert_pdf_to_text(pdf_path: Path, output_dir: Path) -> None:
-    """Convert a PDF file to text and save it"""
+def atomic_write(path: Path, content: str) -> None:
+    """Write via a temp file and rename, so readers never see a partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
     try:
-        # Read PDF
-        reader = PdfReader(pdf_path)
-        content = ""
-        
-        # Extract text from each page
-        for page in reader.pages:
-            content += page.extract_text() + "\n"
-            
-        if not content.strip():
-            print(f"Warning: No text content extracted from {pdf_path}")
-            return
-            
-        # Create output filename
-        output_path = output_dir / f"{pdf_path.stem}.txt"
-        
-        # Save text content
-        with open(output_path, "w", encoding="utf-8") as f:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
             f.write(content)
-            
-        print(f"Successfully converted {pdf_path} to {output_path}")
-            
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def output_path_for(source: Path) -> Path:
+    # The source extension is kept, so foo.pdf and foo.docx don't share an output
+    return source.parent / "text" / f"{source.name}.txt"
+
+
+def find_documents(root: Path) -> list[Path]:
+    """Every convertible file in <root>/<collection>/<subject>/"""
+    return sorted(
+        path for path in root.glob("*/*/*")
+        if path.suffix.lower() in EXTENSIONS and path.is_file()
+    )
+
+
+def convert_document(source: Path, output_path: Path) -> dict:
+    """Convert one document; runs in a worker process"""
+    start = time.perf_counter()
+    try:
+        # Hash and stat before extracting, so an edit mid-run is picked up next time
+        stat = source.stat()
+        sha256 = file_hash(source)
+        content = extract_text(source)
+        if not content.strip():
+            return {"status": "empty", "seconds": time.perf_counter() - start}
+        atomic_write(output_path, content)
+        return {
+            "status": "converted",
+            "seconds": time.perf_counter() - start,
+            "chars": len(content),
+            "sha256": sha256,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
     except Exception as e:
-        print(f"Error converting {pdf_path}: {str(e)}")
+        return {"status": "error", "seconds": time.perf_counter() - start, "error": str(e)}
+
+
+def load_manifest(path: Path) -> dict:
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(path: Path, manifest: dict, documents: list[Path], root: Path) -> dict:
+    """Write the manifest, dropping entries for documents that no longer exist"""
+    existing = {source.relative_to(root).as_posix() for source in documents}
+    manifest = {key: entry for key, entry in sorted(manifest.items()) if key in existing}
+    atomic_write(path, json.dumps(manifest, indent=2))
+    return manifest
+
+
+def is_current(source: Path, entry: dict, root: Path) -> bool:
+    """True if source was converted before and hasn't changed since"""
+    if not entry or not (root / entry["output"]).exists():
+        return False
+    stat = source.stat()
+    # Unchanged size and mtime means unchanged content; skip hashing
+    if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        return True
+    if entry.get("sha256") == file_hash(source):
+        # Touched but identical; remember the new mtime
+        entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+        return True
+    return False
+
+
+def convert_library(root: Path, workers: int = None, force: bool = False) -> dict:
+    """Convert new or changed documents under root; returns a summary"""
+    manifest_path = root / MANIFEST_NAME
+    manifest = {} if force else load_manifest(manifest_path)
+    documents = find_documents(root)
+
+    pending = []
+    for source in documents:
+        key = source.relative_to(root).as_posix()
+        if not is_current(source, manifest.get(key), root):
+            pending.append(source)
+
+    summary = {"total": len(documents), "skipped": len(documents) - len(pending),
+               "converted": 0, "empty": 0, "error": 0}
+    start = time.perf_counter()
+
+    try:
+        if pending:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(convert_document, source, output_path_for(source)): source
+                    for source in pending
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    source = futures[future]
+                    key = source.relative_to(root).as_posix()
+                    result = future.result()
+                    summary[result["status"]] += 1
+
+                    if result["status"] == "converted":
+                        manifest[key] = {
+                            "sha256": result["sha256"],
+                            "size": result["size"],
+                            "mtime": result["mtime"],
+                            "output": output_path_for(source).relative_to(root).as_posix(),
+                            "chars": result["chars"],
+                            "seconds": round(result["seconds"], 3),
+                        }
+                        print(f"Converted {key} in {result['seconds']:.2f}s")
+                    elif result["status"] == "empty":
+                        manifest.pop(key, None)
+                        print(f"Warning: No text content extracted from {key}")
+                    else:
+                        manifest.pop(key, None)
+                        print(f"Error converting {key}: {result['error']}")
+
+                    if done % MANIFEST_SAVE_EVERY == 0:
+                        manifest = save_manifest(manifest_path, manifest, documents, root)
+    finally:
+        # Also on an interrupted run, so finished conversions aren't redone
+        save_manifest(manifest_path, manifest, documents, root)
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
 
 def main():
-    # Define directories
-    pdf_dir = Path("worksheets/climate_integrated/biology")
-    txt_dir = Path("worksheets/climate_integrated/biology/text")
-    
-    # Create text directory if it doesn't exist
-    txt_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Convert all PDFs
-    for pdf_path in pdf_dir.glob("*.pdf"):
-        convert_pdf_to_text(pdf_path, txt_dir)
+    parser = argparse.ArgumentParser(description="Convert worksheet PDFs/DOCX files to text")
+    parser.add_argument("--root", type=Path, default=Path("worksheets"),
+                        help="library root containing <collection>/<subject>/ directories")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="ignore the manifest and convert everything")
+    args = parser.parse_args()
+
+    if not args.root.exists():
+        print(f"Warning: {args.root} does not exist")
+        return
+
+    summary = convert_library(args.root, workers=args.workers, force=args.force)
+    print(
+        f"{summary['converted']} converted, {summary['skipped']} unchanged, "
+        f"{summary['empty']} empty, {summary['error']} failed "
+        f"of {summary['total']} documents in {summary['seconds']:.2f}s"
+    )
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,122 @@
+"""Delta-output enhancement: the model returns only its additions, merged in locally.
+
+In the default (full) mode the model writes the whole worksheet back with
+its climate extensions added, so output tokens, the slow and expensive part
+of a completion, grow with the worksheet. With ENHANCE_OUTPUT_MODE=delta it
+is shown the worksheet with numbered lines (number_lines()) and replies with
+JSON only:
+
+    {"headings": [1, 4],
+     "additions": {"5": "(How might warming change this?)"},
+     "closing_questions": ["How could ...?"]}
+
+merge() applies that to the original text: heading lines are wrapped in
+**double asterisks**, each addition is appended to its line, and closing
+questions are numbered on from the worksheet's last question. Every original
+line is kept, in order and with at most formatting around it, because the
+reply can only name lines to decorate. A reply that isn't valid raises
+DeltaError, and the caller regenerates that part in full mode.
+
+Compare the modes end to end with:
+
+    python benchmarks/e2e.py --targets backend --output full.json
+    ENHANCE_OUTPUT_MODE=delta python benchmarks/e2e.py --targets backend --output delta.json
+    python benchmarks/e2e.py --compare full.json delta.json
+"""
+import json
+import os
+import re
+
+from .text_compaction import PLACEHOLDER
+
+QUESTION_NUMBER = re.compile(r"\s*(\d+)[.)]\s")
+
+# Most closing questions merged from one reply
+MAX_CLOSING_QUESTIONS = 2
+
+
+class DeltaError(ValueError):
+    pass
+
+
+def delta_mode() -> bool:
+    return os.getenv('ENHANCE_OUTPUT_MODE', 'full') == 'delta'
+
+
+def number_lines(text: str) -> str:
+    """text with each non-empty line prefixed by its number, e.g. ``[3] 1. What is ...``"""
+    numbered, number = [], 0
+    for line in text.split("\n"):
+        if line.strip():
+            number += 1
+            line = f"[{number}] {line}"
+        numbered.append(line)
+    return "\n".join(numbered)
+
+
+def parse_delta(content: str, line_count: int) -> dict:
+    """The model's reply as {"headings": set, "additions": {line: text}, "closing_questions": list}"""
+    try:
+        delta = json.loads(content)
+    except (TypeError, ValueError) as e:
+        raise DeltaError(f"Reply is not JSON: {str(e)}")
+    if not isinstance(delta, dict):
+        raise DeltaError("Reply is not a JSON object")
+
+    def line_number(value) -> int:
+        number = int(value) if isinstance(value, str) and value.isdigit() else value
+        if isinstance(number, bool) or not isinstance(number, int) or not 1 <= number <= line_count:
+            raise DeltaError(f"No line {value!r} in a worksheet of {line_count} lines")
+        return number
+
+    headings = {line_number(n) for n in delta.get("headings") or []}
+    additions = {}
+    if not isinstance(delta.get("additions") or {}, dict):
+        raise DeltaError("additions is not an object of line number to text")
+    for line, text in (delta.get("additions") or {}).items():
+        if not isinstance(text, str):
+            raise DeltaError(f"Malformed addition for line {line!r}")
+        text = " ".join(text.split())
+        # Additions extend the worksheet; they must not answer it
+        if not text or PLACEHOLDER.search(text):
+            continue
+        if not text.startswith("("):
+            text = f"({text})"
+        additions[line_number(line)] = text
+    closing = [
+        " ".join(q.split()) for q in delta.get("closing_questions") or [] if isinstance(q, str) and q.strip()
+    ]
+    return {"headings": headings, "additions": additions, "closing_questions": closing[:MAX_CLOSING_QUESTIONS]}
+
+
+def merge(text: str, delta: dict, closing: bool = True) -> str:
+    """Apply a parsed delta to the original text; closing=False ignores closing questions"""
+    original = text.split("\n")
+    merged, number = [], 0
+    for line in original:
+        if line.strip():
+            number += 1
+            # Questions keep their numbering rather than becoming headings
+            if number in delta["headings"] and not line.lstrip().startswith("*") and not QUESTION_NUMBER.match(line):
+                line = f"**{line.strip()}**"
+            if number in delta["additions"]:
+                line = f"{line} {delta['additions'][number]}"
+        merged.append(line)
+
+    if closing and delta["closing_questions"]:
+        last = max((int(m.group(1)) for m in map(QUESTION_NUMBER.match, original) if m), default=0)
+        while merged and not merged[-1].strip():
+            merged.pop()
+        merged.append("")
+        for offset, question in enumerate(delta["closing_questions"], 1):
+            numbered = QUESTION_NUMBER.match(question)
+            if numbered:
+                question = question[numbered.end():]
+            merged.extend([f"{last + offset}. {question}", ""])
+    return "\n".join(merged).rstrip("\n") + "\n"
+
+
+def apply_delta(text: str, content: str, closing: bool = True) -> str:
+    """Merge the model's JSON reply for text into it"""
+    line_count = sum(1 for line in text.split("\n") if line.strip())
+    return merge(text, parse_delta(content, line_count), closing)
@@ -0,0 +1,184 @@
+"""Embedding backends for DocumentStore.
+
+Every backend turns a batch of texts into a float32 matrix, one row per text:
+
+    openai   text-embedding-ada-002 over the network (default)
+    hashing  local feature-hashed bag of words/bigrams, no model or network
+    onnx     local sentence encoder run with onnxruntime
+
+Pick one with RAG_EMBEDDING_BACKEND. Stores built with one backend can't be
+searched with another, since the vector spaces differ.
+"""
+import math
+import os
+import re
+import zlib
+import numpy as np
+
+from .deadlines import timeout_kwargs
+from .metrics import record_token_usage
+
+
+class EmbeddingBackend:
+    """Base class; subclasses implement embed()"""
+
+    name = None
+    dim = None
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    name = "openai"
+    dim = 1536
+
+    def __init__(self, client=None, model: str = "text-embedding-ada-002", batch_size: int = 64):
+        if client is None:
+            from .openai_client import get_openai_client
+            client = get_openai_client()
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        rows = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(
+                model=self.model,
+                input=texts[start:start + self.batch_size],
+                **timeout_kwargs()
+            )
+            record_token_usage(self.model, response.usage)
+            # The API doesn't promise to return items in input order
+            rows.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return np.asarray(rows, dtype=np.float32)
+
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+STOP_WORDS = frozenset("""
+a an and are as at be by for from how in is it of on or that the this to was what which why with
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens without stop words, plurals folded onto the singular.
+
+    Hyphenated terms are kept whole and also split, so "hardy-weinberg" matches
+    both "Hardy-Weinberg" and "Hardy Weinberg".
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+        if "-" in token:
+            tokens.extend(part for part in token.split("-") if part not in STOP_WORDS)
+    return tokens
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Feature-hashed unigrams and bigrams with sublinear term frequency.
+
+    Deterministic across processes (crc32 rather than Python's salted hash),
+    so saved stores stay valid. Exact domain terms like "hardy-weinberg" are
+    kept as single tokens.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 4096, bigram_weight: float = 0.5):
+        self.dim = dim
+        self.bigram_weight = bigram_weight
+
+    def _features(self, text: str) -> dict:
+        """Map each unigram/bigram to its weighted, sublinear term frequency"""
+        tokens = tokenize(text)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        bigram_counts = {}
+        if self.bigram_weight:
+            for a, b in zip(tokens, tokens[1:]):
+                bigram_counts[f"{a} {b}"] = bigram_counts.get(f"{a} {b}", 0) + 1
+
+        features = {token: 1.0 + math.log(count) for token, count in counts.items()}
+        for bigram, count in bigram_counts.items():
+            features[bigram] = self.bigram_weight * (1.0 + math.log(count))
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                # The top bit picks the sign so collisions don't all add up
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * weight
+        return matrix
+
+
+class ONNXEmbeddingBackend(EmbeddingBackend):
+    """Sentence encoder (e.g. all-MiniLM-L6-v2 exported to ONNX) run on CPU.
+
+    Needs onnxruntime and the tokenizers package, plus the model and its
+    tokenizer.json (RAG_ONNX_MODEL / RAG_ONNX_TOKENIZER).
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, tokenizer_path: str, batch_size: int = 32, max_length: int = 256):
+        if not model_path or not tokenizer_path:
+            raise ValueError(
+                "The onnx embedding backend needs RAG_ONNX_MODEL (the .onnx model) and "
+                "RAG_ONNX_TOKENIZER (its tokenizer.json)"
+            )
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError(
+                f"The onnx embedding backend needs onnxruntime and tokenizers (see requirements.txt): {str(e)}"
+            ) from e
+
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.batch_size = batch_size
+        self.dim = self.session.get_outputs()[0].shape[-1]
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                inputs["token_type_ids"] = np.zeros_like(input_ids)
+
+            token_embeddings = self.session.run(None, inputs)[0]
+            # Mean-pool over real (unpadded) tokens
+            mask = attention_mask[..., None].astype(np.float32)
+            batches.append((token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+        return np.concatenate(batches).astype(np.float32) if batches else np.empty((0, self.dim), np.float32)
+
+
+def make_embedding_backend(name: str = None) -> EmbeddingBackend:
+    """Build the backend named by ``name`` or RAG_EMBEDDING_BACKEND"""
+    name = name or os.getenv('RAG_EMBEDDING_BACKEND', 'openai')
+    if name == "openai":
+        return OpenAIEmbeddingBackend()
+    if name == "hashing":
+        return HashingEmbeddingBackend(dim=int(os.getenv('RAG_HASHING_DIM', '4096')))
+    if name == "onnx":
+        return ONNXEmbeddingBackend(os.getenv('RAG_ONNX_MODEL'), os.getenv('RAG_ONNX_TOKENIZER'))
+    raise ValueError(f"Unknown embedding backend {name}")
@@ -0,0 +1,167 @@
+"""Track fine-tuning jobs until they finish, surviving restarts.
+
+Job ids and progress are persisted to a JSON file (FINETUNE_JOBS_PATH, default
+finetune_jobs.json), so a restarted process resumes where it left off. Each
+job is checked through the events API: new events reset its check interval
+to ``min_interval`` and fetch the job's status; quiet periods back off
+exponentially up to ``max_interval``. One monitor tracks any number of jobs.
+
+``sleep`` and ``clock`` are injectable, and the client can point at
+benchmarks/mock_openai.py, so polling can be exercised locally.
+"""
+from pathlib import Path
+import json
+import os
+import random
+import tempfile
+import time
+
+TERMINAL_STATUSES = {"succeeded", "failed", "cancelled"}
+
+
+class JobStore:
+    """Fine-tuning jobs being tracked, persisted atomically to a JSON file"""
+
+    def __init__(self, path=None):
+        self.path = Path(path or os.getenv('FINETUNE_JOBS_PATH', 'finetune_jobs.json'))
+        self.jobs = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                self.jobs = json.load(f)
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.jobs, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def active(self) -> list[str]:
+        """Jobs still running, or finished but not yet handed to the callbacks"""
+        return [job_id for job_id, job in self.jobs.items() if not job.get("handled")]
+
+
+def backoff_delays(min_interval: float, max_interval: float, factor: float = 2.0):
+    """Exponential delays with +-10% jitter, capped at max_interval"""
+    delay = min_interval
+    while True:
+        yield delay * random.uniform(0.9, 1.1)
+        delay = min(delay * factor, max_interval)
+
+
+def wait_for_file(client, file_id: str, timeout: float = 600.0, sleep=time.sleep, clock=time.monotonic):
+    """Wait for an uploaded file to be processed, backing off between checks"""
+    deadline = clock() + timeout
+    for delay in backoff_delays(0.5, 15.0):
+        file_status = client.files.retrieve(file_id)
+        if file_status.status == "processed":
+            return file_status
+        if file_status.status == "error":
+            raise RuntimeError(f"File {file_id} failed processing: {getattr(file_status, 'status_details', '')}")
+        if clock() + delay > deadline:
+            raise TimeoutError(f"File {file_id} was not processed within {timeout}s")
+        sleep(delay)
+
+
+class FineTuneMonitor:
+    def __init__(self, client, store: JobStore = None, on_success=None, on_failure=None,
+                 min_interval: float = 5.0, max_interval: float = 300.0, backoff: float = 2.0,
+                 events_page_size: int = 50, sleep=time.sleep, clock=time.time, log=print):
+        self.client = client
+        self.store = store or JobStore()
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.events_page_size = events_page_size
+        self.sleep = sleep
+        self.clock = clock
+        self.log = log
+
+    def track(self, job_id: str, **metadata):
+        """Start tracking a job (no-op if it's already tracked)"""
+        if job_id not in self.store.jobs:
+            self.store.jobs[job_id] = {
+                "status": "unknown",
+                "last_event_id": None,
+                "interval": self.min_interval,
+                "next_check": self.clock(),
+                "fine_tuned_model": None,
+                **metadata,
+            }
+            self.store.save()
+
+    def _new_events(self, job_id: str, last_event_id: str) -> list:
+        """Events since last_event_id, oldest first; pages back through the newest-first API"""
+        events = []
+        after = None
+        while True:
+            kwargs = {"limit": self.events_page_size}
+            if after:
+                kwargs["after"] = after
+            page = self.client.fine_tuning.jobs.list_events(fine_tuning_job_id=job_id, **kwargs)
+            for event in page.data:
+                if event.id == last_event_id:
+                    return events[::-1]
+                events.append(event)
+            if not page.data or not page.has_more:
+                return events[::-1]
+            after = page.data[-1].id
+
+    def check(self, job_id: str) -> bool:
+        """Check one job now; returns True once it has finished"""
+        job = self.store.jobs[job_id]
+        try:
+            events = self._new_events(job_id, job["last_event_id"])
+            for event in events:
+                self.log(f"[{job_id}] {event.message}")
+            if events:
+                job["last_event_id"] = events[-1].id
+
+            # Events mark every status change, so the job itself only needs fetching when
+            # something happened (or on the slowest interval, in case events are missed)
+            if events or job["status"] == "unknown" or job["interval"] >= self.max_interval:
+                status = self.client.fine_tuning.jobs.retrieve(job_id)
+                if status.status != job["status"]:
+                    self.log(f"[{job_id}] Status: {status.status}")
+                job["status"] = status.status
+                job["fine_tuned_model"] = status.fine_tuned_model
+                if status.status == "failed":
+                    job["error"] = str(status.error)
+
+            job["interval"] = self.min_interval if events else min(job["interval"] * self.backoff, self.max_interval)
+        except Exception as e:
+            # Transient API trouble: back off and try again later
+            self.log(f"[{job_id}] Error checking job: {str(e)}")
+            job["interval"] = min(job["interval"] * self.backoff, self.max_interval)
+
+        job["next_check"] = self.clock() + job["interval"] * random.uniform(0.9, 1.1)
+        self.store.save()
+
+        if job["status"] in TERMINAL_STATUSES:
+            # Marked handled only after the callback, so a crash in between retries it on resume
+            if job["status"] == "succeeded" and self.on_success:
+                self.on_success(job_id, job)
+            elif job["status"] != "succeeded" and self.on_failure:
+                self.on_failure(job_id, job)
+            job["handled"] = True
+            self.store.save()
+            return True
+        return False
+
+    def run(self) -> dict:
+        """Check tracked jobs as they come due until none are left running"""
+        while True:
+            active = self.store.active()
+            if not active:
+                return self.store.jobs
+            next_job = min(active, key=lambda job_id: self.store.jobs[job_id]["next_check"])
+            delay = self.store.jobs[next_job]["next_check"] - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            self.check(next_job)
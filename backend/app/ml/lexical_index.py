@@ -0,0 +1,138 @@
+"""BM25 inverted index for DocumentStore.
+
+Dense embeddings blur exact domain terms ("allele frequency", "Hardy-Weinberg",
+"chloroplast") together; BM25 scores documents on the terms they share with
+the query, weighted by how rare each term is. It runs locally, so a confident
+lexical match can skip the embedding call entirely.
+"""
+from pathlib import Path
+import bisect
+import math
+import numpy as np
+
+from .embeddings import tokenize
+from .shared_store import MappedTexts, save_array, save_texts
+
+
+class BM25Index:
+    """Incrementally built Okapi BM25 index; document ids are store positions"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        # term -> ([doc ids], [term frequencies]), appended to as documents arrive
+        self.postings = {}
+        self.doc_lengths = []
+        self._total_length = 0
+        # Postings and lengths as arrays, rebuilt lazily after documents are added
+        self._frozen = {}
+        self._lengths = None
+        # Set by load(): sorted terms (MappedTexts) with CSR postings, term i owning ids[offsets[i]:offsets[i + 1]]
+        self._terms = None
+        self._offsets = None
+        self._ids = None
+        self._tfs = None
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, texts: list[str]):
+        """Index texts as the next document ids"""
+        if self._terms is not None:
+            self._thaw()
+        for text in texts:
+            doc_id = len(self.doc_lengths)
+            tokens = tokenize(text)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for term, count in counts.items():
+                ids, tfs = self.postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(count)
+            self.doc_lengths.append(len(tokens))
+            self._total_length += len(tokens)
+        self._frozen = {}
+        self._lengths = None
+
+    def _postings(self, term: str):
+        """(doc ids, term frequencies) arrays for a term, or None if no document has it"""
+        if self._terms is not None:
+            i = bisect.bisect_left(self._terms, term)
+            if i == len(self._terms) or self._terms[i] != term:
+                return None
+            start, stop = self._offsets[i], self._offsets[i + 1]
+            return self._ids[start:stop], self._tfs[start:stop]
+        if term not in self.postings:
+            return None
+        if term not in self._frozen:
+            ids, tfs = self.postings[term]
+            self._frozen[term] = (np.asarray(ids, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+        return self._frozen[term]
+
+    def save(self, directory):
+        """Write the postings as flat arrays that load() can memory-map"""
+        directory = Path(directory)
+        if self._terms is not None:
+            # Still as loaded; write the arrays back unchanged
+            terms, offsets, ids, tfs = self._terms, self._offsets, self._ids, self._tfs
+        else:
+            terms = sorted(self.postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum([len(self.postings[term][0]) for term in terms], out=offsets[1:])
+            ids = np.fromiter((i for term in terms for i in self.postings[term][0]), dtype=np.int64, count=offsets[-1])
+            tfs = np.fromiter((tf for term in terms for tf in self.postings[term][1]), dtype=np.float32, count=offsets[-1])
+        # UTF-8 bytes plus offsets like the contents, rather than a fixed-width array padded to the longest term
+        save_texts(directory, list(terms), name="bm25_terms")
+        save_array(directory / "bm25_offsets.npy", offsets)
+        save_array(directory / "bm25_ids.npy", ids)
+        save_array(directory / "bm25_tfs.npy", tfs)
+        save_array(directory / "bm25_lengths.npy", np.asarray(self.doc_lengths, dtype=np.float32))
+
+    @classmethod
+    def load(cls, directory, mmap_mode: str = None, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Index written by save(); read-only until the next add()"""
+        directory = Path(directory)
+        index = cls(k1, b)
+        index._terms = MappedTexts(directory, name="bm25_terms", mmap_mode=mmap_mode)
+        index._offsets = np.load(directory / "bm25_offsets.npy", mmap_mode=mmap_mode)
+        index._ids = np.load(directory / "bm25_ids.npy", mmap_mode=mmap_mode)
+        index._tfs = np.load(directory / "bm25_tfs.npy", mmap_mode=mmap_mode)
+        index._lengths = np.load(directory / "bm25_lengths.npy", mmap_mode=mmap_mode)
+        index.doc_lengths = index._lengths
+        index._total_length = float(index._lengths.sum())
+        return index
+
+    @staticmethod
+    def exists(directory) -> bool:
+        # Stores whose terms were written as a fixed-width array have their postings rebuilt
+        return (Path(directory) / "bm25_lengths.npy").exists() and MappedTexts.exists(directory, name="bm25_terms")
+
+    def _thaw(self):
+        """Copy loaded postings back into growable lists"""
+        for i, term in enumerate(self._terms):
+            start, stop = self._offsets[i], self._offsets[i + 1]
+            self.postings[term] = (self._ids[start:stop].tolist(), self._tfs[start:stop].astype(int).tolist())
+        self.doc_lengths = self._lengths.astype(int).tolist()
+        self._terms = self._offsets = self._ids = self._tfs = None
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query (0 where no term matches)"""
+        n = len(self.doc_lengths)
+        scores = np.zeros(n, dtype=np.float32)
+        if n == 0:
+            return scores
+        if self._lengths is None:
+            self._lengths = np.asarray(self.doc_lengths, dtype=np.float32)
+        avg_length = self._total_length / n or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self._lengths / avg_length)
+
+        # Each distinct query term counts once; long worksheet queries repeat terms a lot
+        for term in set(tokenize(query)):
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            ids, tfs = postings
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + norm[ids])
+        return scores
@@ -0,0 +1,427 @@
+"""Lightweight Prometheus-style metrics for the enhancement pipeline.
+
+Stdlib only so it can be imported by the FastAPI apps and the serverless
+handlers alike without adding to cold-start time.
+"""
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, wide enough for both PDF parsing and LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+# Token-count buckets, from a short worksheet up to a context window
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, math.inf)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonically increasing value, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Yield (sample name, labels, value) tuples"""
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    _key = Counter._key
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def sum(self, **labels) -> float:
+        state = self._values.get(self._key(labels))
+        return state[-2] if state else 0.0
+
+    def samples(self):
+        """Yield (sample name, labels, value) tuples in exposition order"""
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, bucket_count
+            yield f"{self.name}_sum", labels, state[-2]
+            yield f"{self.name}_count", labels, state[-1]
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Return all samples as a JSON-serialisable dict"""
+        return {
+            metric.name: [
+                {"name": sample_name, "labels": labels, "value": value if value != math.inf else "+Inf"}
+                for sample_name, labels, value in metric.samples()
+            ]
+            for metric in list(self._metrics.values())
+        }
+
+    def reset(self):
+        for metric in list(self._metrics.values()):
+            metric.reset()
+
+
+# Process-wide registry
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "enhancer_stage_duration_seconds",
+    "Time spent in each stage of the enhancement pipeline",
+    ("stage",),
+)
+STAGE_ERRORS = registry.counter(
+    "enhancer_stage_errors_total",
+    "Number of times a pipeline stage raised",
+    ("stage",),
+)
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total",
+    "HTTP requests served",
+    ("method", "path", "status"),
+)
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds",
+    "End-to-end HTTP request latency",
+    ("method", "path"),
+)
+TOKENS = registry.counter(
+    "openai_tokens_total",
+    "Tokens reported by the OpenAI API",
+    ("model", "kind"),
+)
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total",
+    "Cache lookups by result",
+    ("cache", "result"),
+)
+RETRIEVALS = registry.counter(
+    "rag_retrievals_total",
+    "Example retrievals by how they were ranked (lexical, vector or hybrid)",
+    ("mode",),
+)
+OPENAI_HTTP_REQUESTS = registry.counter(
+    "openai_http_requests_total",
+    "HTTP requests sent to the OpenAI API, by protocol version",
+    ("http_version",),
+)
+OPENAI_CONNECTIONS = registry.counter(
+    "openai_connections_opened_total",
+    "Connections opened to the OpenAI API; requests not opening one reused a pooled connection",
+)
+CANCELLATIONS = registry.counter(
+    "request_cancellations_total",
+    "Requests whose in-flight work was cancelled, by reason (disconnect or deadline)",
+    ("reason",),
+)
+PROMPT_TOKENS_SAVED = registry.histogram(
+    "prompt_tokens_saved",
+    "Input tokens removed from each worksheet by compaction before the completion",
+    buckets=TOKEN_BUCKETS,
+)
+PROMPT_ROUTES = registry.counter(
+    "prompt_routes_total",
+    "Enhancements by how the context-window guard planned them (single request or map_reduce)",
+    ("route",),
+)
+PROMPT_EXAMPLES = registry.counter(
+    "prompt_examples_total",
+    "Retrieved examples by what the context-window guard did with them (kept, trimmed or dropped)",
+    ("outcome",),
+)
+DELTA_MERGES = registry.counter(
+    "delta_merges_total",
+    "Delta-mode replies by whether they merged or the part was regenerated in full (fallback)",
+    ("result",),
+)
+ADMISSIONS = registry.counter(
+    "admission_decisions_total",
+    "Requests to enhancement endpoints by priority and admission outcome (admitted, or why shed)",
+    ("priority", "outcome"),
+)
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    "admission_wait_seconds",
+    "Time admitted requests spent queued for an enhancement slot",
+    ("priority",),
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Time a pipeline stage, e.g. ``with track_stage("completion"): ...``"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_token_usage(model: str, usage) -> None:
+    """Count prompt/completion tokens from an OpenAI ``usage`` object"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            TOKENS.inc(tokens, model=model, kind=kind.replace("_tokens", ""))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Count a cache lookup; hit rate is hits / (hits + misses)"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_retrieval(mode: str) -> None:
+    """Count a retrieval answered by the given ranking mode"""
+    RETRIEVALS.inc(mode=mode)
+
+
+def record_openai_request(http_version: str) -> None:
+    """Count an HTTP request sent to the OpenAI API"""
+    OPENAI_HTTP_REQUESTS.inc(http_version=http_version)
+
+
+def record_openai_connection() -> None:
+    """Count a new connection opened to the OpenAI API"""
+    OPENAI_CONNECTIONS.inc()
+
+
+def record_cancellation(reason: str) -> None:
+    """Count a request whose in-flight work was cancelled"""
+    CANCELLATIONS.inc(reason=reason)
+
+
+def record_tokens_saved(tokens: int) -> None:
+    """Record the input tokens compaction saved on one request"""
+    PROMPT_TOKENS_SAVED.observe(tokens)
+
+
+def record_prompt_route(route: str) -> None:
+    """Count an enhancement planned as one request or split into parts"""
+    PROMPT_ROUTES.inc(route=route)
+
+
+def record_prompt_examples(kept: int, trimmed: int, dropped: int) -> None:
+    """Count what the context-window guard did with a prompt's examples"""
+    for outcome, count in (("kept", kept), ("trimmed", trimmed), ("dropped", dropped)):
+        if count:
+            PROMPT_EXAMPLES.inc(count, outcome=outcome)
+
+
+def record_delta_merge(merged: bool) -> None:
+    """Count a delta-mode reply that merged, or fell back to full output"""
+    DELTA_MERGES.inc(result="merged" if merged else "fallback")
+
+
+def record_admission(priority: str, outcome: str, waited: float = None) -> None:
+    """Count an admission decision, and how long an admitted request queued"""
+    ADMISSIONS.inc(priority=priority, outcome=outcome)
+    if waited is not None:
+        ADMISSION_WAIT_SECONDS.observe(waited, priority=priority)
+
+
+def record_request(method: str, path: str, status: int, duration: float) -> None:
+    """Count an HTTP request and its latency"""
+    HTTP_REQUESTS.inc(method=method, path=path, status=status)
+    HTTP_REQUEST_SECONDS.observe(duration, method=method, path=path)
+
+
+class Exporter:
+    """Base class for pushing metrics somewhere other than /metrics"""
+
+    def export(self, registry: MetricsRegistry) -> None:
+        raise NotImplementedError
+
+
+class LogExporter(Exporter):
+    """Write a JSON snapshot to the log, for platforms that scrape logs"""
+
+    def export(self, registry: MetricsRegistry) -> None:
+        logger.info("metrics %s", json.dumps(registry.snapshot()))
+
+
+class PrometheusFileExporter(Exporter):
+    """Write the text exposition to a file, e.g. for node_exporter's textfile collector"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, registry: MetricsRegistry) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(registry.render())
+        os.replace(tmp_path, self.path)
+
+
+EXPORTERS = {
+    "log": LogExporter,
+}
+
+_exporter = None
+
+
+def set_exporter(exporter) -> None:
+    """Install the exporter used by ``flush``; pass None to disable"""
+    global _exporter
+    _exporter = exporter
+
+
+def get_exporter():
+    """Return the configured exporter, honouring METRICS_EXPORTER on first use"""
+    global _exporter
+    if _exporter is None:
+        name = os.getenv("METRICS_EXPORTER", "")
+        if name in EXPORTERS:
+            _exporter = EXPORTERS[name]()
+        elif name.startswith("file:"):
+            _exporter = PrometheusFileExporter(name[len("file:"):])
+    return _exporter
+
+
+def flush() -> None:
+    """Push metrics through the configured exporter, if any"""
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.export(registry)
+    except Exception as e:
+        logger.error(f"Error exporting metrics: {str(e)}")
+
+
+def instrument_handler(path: str):
+    """Decorate a serverless ``handler(request)`` to record the request and flush metrics"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(request):
+            start = time.perf_counter()
+            status = 500
+            try:
+                result = fn(request)
+                status = result.get("statusCode", 200)
+                return result
+            finally:
+                record_request(getattr(request, "method", "UNKNOWN"), path, status, time.perf_counter() - start)
+                flush()
+        return wrapper
+    return decorator
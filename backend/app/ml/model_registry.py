@@ -0,0 +1,174 @@
+"""Which completion model the enhancer uses, swappable without a restart.
+
+The registry is a JSON file (MODEL_REGISTRY_PATH, default backend/app/model_registry.json,
+so the server and the scripts that update it agree whatever directory they run from):
+
+    {
+      "default": "gpt-3.5-turbo",
+      "candidate": "ft:gpt-3.5-turbo:org::abc123",
+      "rollout_percent": 10,
+      "models": {"ft:gpt-3.5-turbo:org::abc123": {"job_id": "ftjob-...", "registered_at": ...}}
+    }
+
+``candidate`` serves ``rollout_percent`` of requests (sticky per routing key)
+and ``default`` the rest. Running processes notice a changed file within
+MODEL_REGISTRY_CHECK_SECONDS and swap to it; writes go through a temp file
+and rename so readers never see half a file.
+
+    python app/ml/model_registry.py show
+    python app/ml/model_registry.py rollout ft:gpt-3.5-turbo:org::abc123 25
+    python app/ml/model_registry.py promote ft:gpt-3.5-turbo:org::abc123
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+DEFAULT_REGISTRY_PATH = Path(__file__).resolve().parent.parent / "model_registry.json"
+
+
+def empty_registry() -> dict:
+    return {"default": DEFAULT_MODEL, "candidate": None, "rollout_percent": 0, "models": {}}
+
+
+class ModelRegistry:
+    """Hot-reloading view of the registry file"""
+
+    def __init__(self, path=None, check_seconds: float = None):
+        self.path = Path(path or os.getenv('MODEL_REGISTRY_PATH') or DEFAULT_REGISTRY_PATH)
+        self.check_seconds = check_seconds if check_seconds is not None else float(
+            os.getenv('MODEL_REGISTRY_CHECK_SECONDS', '2')
+        )
+        self._lock = threading.Lock()
+        self._state = empty_registry()
+        self._signature = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def reload(self) -> dict:
+        """Re-read the file if it changed; a bad file keeps the previous state"""
+        try:
+            stat = self.path.stat()
+            # Size too, for filesystems with coarse timestamps
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature != self._signature:
+            state = empty_registry()
+            if signature is not None:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        state.update(json.load(f))
+                except (OSError, ValueError) as e:
+                    print(f"Warning: keeping previous model registry, could not read {self.path}: {str(e)}")
+                    return self._state
+            # Swap the whole dict so readers see either the old or the new state
+            self._state = state
+            self._signature = signature
+            print(f"Model registry: default={state['default']} candidate={state['candidate']} "
+                  f"({state['rollout_percent']}%)")
+        return self._state
+
+    def current(self) -> dict:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_seconds:
+            with self._lock:
+                if now - self._checked_at >= self.check_seconds:
+                    self._checked_at = now
+                    self.reload()
+        return self._state
+
+    def known_models(self) -> set:
+        state = self.current()
+        return {state["default"], state["candidate"], *state["models"]} - {None}
+
+    def select(self, override: str = None, routing_key: str = None) -> str:
+        """Model for one request: an explicit override, the rollout candidate or the default"""
+        state = self.current()
+        if override:
+            if override not in self.known_models():
+                raise ValueError(f"Unknown model {override}")
+            return override
+        if state["candidate"] and state["rollout_percent"] > 0:
+            # Hash the routing key so a given user consistently sees one model
+            bucket = zlib.crc32(routing_key.encode()) % 100 if routing_key else random.randrange(100)
+            if bucket < state["rollout_percent"]:
+                return state["candidate"]
+        return state["default"]
+
+    def _update(self, change) -> dict:
+        """Apply change(state) to the file contents and write them back atomically"""
+        with self._lock:
+            state = empty_registry()
+            if self.path.exists():
+                with open(self.path, encoding="utf-8") as f:
+                    state.update(json.load(f))
+            change(state)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._checked_at = 0.0
+        return self.current()
+
+    def register(self, model_id: str, rollout_percent: int = None, **metadata) -> dict:
+        """Record a new model, optionally starting a rollout to it"""
+        def change(state):
+            state["models"][model_id] = {"registered_at": time.time(), **metadata}
+            if rollout_percent is not None:
+                state["candidate"] = model_id
+                state["rollout_percent"] = rollout_percent
+        return self._update(change)
+
+    def rollout(self, model_id: str, percent: int) -> dict:
+        if not 0 <= percent <= 100:
+            raise ValueError("Rollout percent must be between 0 and 100")
+        def change(state):
+            state["models"].setdefault(model_id, {"registered_at": time.time()})
+            state["candidate"] = model_id
+            state["rollout_percent"] = percent
+        return self._update(change)
+
+    def promote(self, model_id: str) -> dict:
+        """Make a model the default for all traffic and end any rollout"""
+        def change(state):
+            state["models"].setdefault(model_id, {"registered_at": time.time()})
+            state["default"] = model_id
+            state["candidate"] = None
+            state["rollout_percent"] = 0
+        return self._update(change)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or change the model registry")
+    parser.add_argument("--path", default=None)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("show")
+    rollout = commands.add_parser("rollout")
+    rollout.add_argument("model")
+    rollout.add_argument("percent", type=int)
+    promote = commands.add_parser("promote")
+    promote.add_argument("model")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.path)
+    if args.command == "rollout":
+        registry.rollout(args.model, args.percent)
+    elif args.command == "promote":
+        registry.promote(args.model)
+    print(json.dumps(registry.current(), indent=2))
+
+if __name__ == "__main__":
+    main()
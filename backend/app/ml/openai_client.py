@@ -0,0 +1,166 @@
+"""Shared, pooled clients for all OpenAI traffic.
+
+Every module gets its OpenAI client from here instead of constructing its
+own, so the process keeps one connection pool with keep-alive (and HTTP/2
+where the ``h2`` package is installed) rather than paying a TLS handshake per
+client. get_async_openai_client() returns the async equivalent, one per
+event loop.
+
+Pool limits and timeouts come from the environment:
+
+    OPENAI_MAX_CONNECTIONS     pool size (default 100)
+    OPENAI_MAX_KEEPALIVE       idle connections kept open (default 20)
+    OPENAI_KEEPALIVE_EXPIRY    seconds an idle connection is kept (default 30)
+    OPENAI_HTTP2               1 to negotiate HTTP/2 (default), 0 for HTTP/1.1
+    OPENAI_CONNECT_TIMEOUT     seconds (default 5)
+    OPENAI_READ_TIMEOUT        seconds between bytes received (default 60)
+    OPENAI_WRITE_TIMEOUT       seconds (default 10)
+    OPENAI_POOL_TIMEOUT        seconds waiting for a free connection (default 10)
+    OPENAI_MAX_RETRIES         retries on connection errors and 429/5xx (default 2)
+
+Requests and newly opened connections are counted in the metrics registry;
+connection_stats() summarises how often connections were reused.
+
+openai and httpx are imported on first use to keep cold starts cheap.
+"""
+import importlib.util
+import logging
+import os
+import threading
+import weakref
+
+from .metrics import record_openai_request, record_openai_connection, OPENAI_HTTP_REQUESTS, OPENAI_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_client = None
+# Async clients hold connections bound to their event loop, so there's one per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+def _http2_enabled() -> bool:
+    if os.getenv('OPENAI_HTTP2', '1') != '1':
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("OPENAI_HTTP2 is on but the h2 package is not installed; using HTTP/1.1")
+        return False
+    return True
+
+
+def _pool_options() -> dict:
+    """Keyword arguments shared by httpx.Client and httpx.AsyncClient"""
+    import httpx
+
+    return {
+        "limits": httpx.Limits(
+            max_connections=int(os.getenv('OPENAI_MAX_CONNECTIONS', '100')),
+            max_keepalive_connections=int(os.getenv('OPENAI_MAX_KEEPALIVE', '20')),
+            keepalive_expiry=_env_float('OPENAI_KEEPALIVE_EXPIRY', 30.0),
+        ),
+        "timeout": httpx.Timeout(
+            connect=_env_float('OPENAI_CONNECT_TIMEOUT', 5.0),
+            read=_env_float('OPENAI_READ_TIMEOUT', 60.0),
+            write=_env_float('OPENAI_WRITE_TIMEOUT', 10.0),
+            pool=_env_float('OPENAI_POOL_TIMEOUT', 10.0),
+        ),
+        "http2": _http2_enabled(),
+    }
+
+
+def _trace(event_name: str, info: dict):
+    """httpcore trace hook; connect_tcp only fires when the pool opens a new connection"""
+    if event_name == "connection.connect_tcp.complete":
+        record_openai_connection()
+
+
+async def _async_trace(event_name: str, info: dict):
+    _trace(event_name, info)
+
+
+def _on_request(request):
+    request.extensions["trace"] = _trace
+
+
+def _on_response(response):
+    record_openai_request(response.http_version)
+
+
+async def _on_async_request(request):
+    request.extensions["trace"] = _async_trace
+
+
+async def _on_async_response(response):
+    record_openai_request(response.http_version)
+
+
+def get_openai_client():
+    """The process-wide OpenAI client, created on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+
+                http_client = httpx.Client(
+                    event_hooks={"request": [_on_request], "response": [_on_response]},
+                    **_pool_options(),
+                )
+                _client = OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    max_retries=int(os.getenv('OPENAI_MAX_RETRIES', '2')),
+                    http_client=http_client,
+                )
+    return _client
+
+
+def get_async_openai_client():
+    """The AsyncOpenAI client for the running event loop, created on first use"""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        import httpx
+        from openai import AsyncOpenAI
+
+        http_client = httpx.AsyncClient(
+            event_hooks={"request": [_on_async_request], "response": [_on_async_response]},
+            **_pool_options(),
+        )
+        client = _async_clients[loop] = AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            max_retries=int(os.getenv('OPENAI_MAX_RETRIES', '2')),
+            http_client=http_client,
+        )
+    return client
+
+
+def connection_stats() -> dict:
+    """Requests sent, connections opened and the share of requests that reused a connection"""
+    by_version = {labels["http_version"]: value for _, labels, value in OPENAI_HTTP_REQUESTS.samples()}
+    requests = sum(by_version.values())
+    opened = OPENAI_CONNECTIONS.value()
+    return {
+        "requests": requests,
+        "requests_by_http_version": by_version,
+        "connections_opened": opened,
+        "reuse_ratio": max(requests - opened, 0) / requests if requests else None,
+    }
+
+
+def _forget_clients():
+    # A forked worker must not share the parent's sockets; it builds its own pool
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock()
+    _async_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients)
@@ -0,0 +1,172 @@
+"""Cache of rendered worksheet PDFs, keyed by content hash and renderer version.
+
+Users download the same enhanced worksheet repeatedly; each repeat is served
+from an in-memory LRU (PDF_CACHE_ENTRIES, default 64; 0 disables it), then a
+disk tier (PDF_CACHE_DIR, default a directory under the system temp dir; set
+it to an empty string to disable), and only rendered on a miss. Benchmarks
+turn both off, so they measure rendering rather than cache hits.
+
+The worksheet's parsed Blocks are kept in memory next to its PDF, under the
+same key (document()), so rendering it to another format, or again once the
+PDF was evicted, doesn't parse it again. The key doubles as a strong ETag, so
+a client that already has the PDF gets a 304 without touching the cache at all.
+
+Bump the renderer version passed to PDFCache whenever the layout changes,
+otherwise stale PDFs keep being served.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+from .metrics import record_cache
+
+# Disk tier size before the least recently used files are pruned
+DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+
+# Prune the disk tier once every this many writes rather than on each one
+PRUNE_EVERY = 32
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an If-None-Match header matches an ETag (weak comparison, per RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class PDFCache:
+    def __init__(self, renderer_version: str, max_entries: int = None, max_bytes: int = None,
+                 directory: str = None, disk_max_bytes: int = None):
+        self.renderer_version = renderer_version
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv('PDF_CACHE_ENTRIES', '64'))
+        self.max_bytes = max_bytes or int(os.getenv('PDF_CACHE_MAX_MB', '64')) * 1024 * 1024
+        if directory is None:
+            directory = os.getenv('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), "worksheet-pdf-cache"))
+        self.directory = directory or None
+        self.disk_max_bytes = disk_max_bytes or DEFAULT_DISK_MAX_BYTES
+        self._entries = OrderedDict()
+        # key -> parsed Blocks, bounded by max_entries like the PDFs
+        self._documents = OrderedDict()
+        self._bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def key(self, content: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.renderer_version.encode())
+        digest.update(b"\0")
+        digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def etag(self, content: str) -> str:
+        return f'"{self.key(content)}"'
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _remember(self, key: str, pdf: bytes):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            if len(pdf) > self.max_bytes:
+                return
+            self._entries[key] = pdf
+            self._bytes += len(pdf)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            pdf = self._entries.get(key)
+            if pdf is not None:
+                self._entries.move_to_end(key)
+        record_cache("pdf_memory", pdf is not None)
+        if pdf is not None or not self.directory:
+            return pdf
+
+        try:
+            with open(self._path(key), "rb") as f:
+                pdf = f.read()
+            # Touch so disk pruning sees it as recently used
+            os.utime(self._path(key))
+        except OSError:
+            pdf = None
+        record_cache("pdf_disk", pdf is not None)
+        if pdf is not None:
+            self._remember(key, pdf)
+        return pdf
+
+    def document(self, content: str, parse) -> tuple:
+        """parse(content), from memory if this worksheet was parsed before"""
+        key = self.key(content)
+        with self._lock:
+            blocks = self._documents.get(key)
+            if blocks is not None:
+                self._documents.move_to_end(key)
+        record_cache("document", blocks is not None)
+        if blocks is None:
+            blocks = parse(content)
+            self.put_document(key, blocks)
+        return blocks
+
+    def put_document(self, key: str, blocks: tuple):
+        with self._lock:
+            self._documents[key] = blocks
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_entries:
+                self._documents.popitem(last=False)
+
+    def put(self, key: str, pdf: bytes):
+        self._remember(key, pdf)
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(pdf)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only or full disk just means no disk tier
+            return
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete least recently used files until the disk tier fits its budget"""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def get_or_render(self, content: str, render) -> tuple:
+        """Return (pdf bytes, etag), calling render(content) only on a cache miss"""
+        key = self.key(content)
+        pdf = self.get(key)
+        if pdf is None:
+            pdf = render(content)
+            self.put(key, pdf)
+        return pdf, f'"{key}"'
@@ -0,0 +1,133 @@
+"""Text extraction for uploaded PDFs, split across processes for large documents.
+
+pypdf extracts pages one at a time in a single thread, so a 400-page upload
+takes seconds however many cores there are. extract_pdf_text() splits
+documents of at least PDF_PARALLEL_MIN_PAGES pages (default 24) into
+contiguous page ranges, extracts them in a process pool of
+PDF_EXTRACT_WORKERS processes (default: one per core) and joins the ranges
+back in page order. Smaller documents, or a pool of one, are extracted in
+process, where the pool's overhead would dominate.
+
+The PDF is written once to a temp file that every worker maps read-only, so
+the bytes aren't pickled to each worker and the page cache holds one copy.
+Each worker parses the cross-reference table itself; that is cheap next to
+extracting text, but it is why a range has at least MIN_RANGE_PAGES pages.
+
+When the request is being profiled each worker profiles its range and sends
+the stats back with the text, so the request's profile covers the workers.
+
+See benchmarks/pdf_extraction.py.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+from .deadlines import check_deadline, current_deadline, DeadlineExceeded
+from .profiling import add_stats, collect_stats, profiling_active
+from .text_compaction import PAGE_BREAK
+
+# Ranges shorter than this spend more time parsing the document than extracting
+MIN_RANGE_PAGES = 8
+
+# Ranges per worker; more than one evens out pages that take longer than others
+RANGES_PER_WORKER = 2
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def extract_workers() -> int:
+    return int(os.getenv('PDF_EXTRACT_WORKERS', '0')) or os.cpu_count() or 1
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared extraction pool, (re)started when it is missing or sized differently"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_workers = workers
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def page_ranges(page_count: int, workers: int) -> list[tuple]:
+    """Split pages into contiguous (start, stop) ranges, a few per worker"""
+    count = min(workers * RANGES_PER_WORKER, max(page_count // MIN_RANGE_PAGES, 1))
+    bounds = [page_count * i // count for i in range(count + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _extract_pages(reader, start: int, stop: int) -> str:
+    text = ""
+    for page in reader.pages[start:stop]:
+        check_deadline("extract")
+        text += page.extract_text() + "\n" + PAGE_BREAK
+    return text
+
+
+def _extract_range(path: str, start: int, stop: int, profile: bool = False):
+    """Worker: extract pages start:stop from the PDF mapped from path, as (text, stats) if profile"""
+    if profile:
+        return collect_stats(_extract_range, path, start, stop)
+
+    from pypdf import PdfReader
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return _extract_pages(PdfReader(mapped), start, stop)
+
+
+def extract_pdf_text(data: bytes, workers: int = None, min_pages: int = None) -> str:
+    """Text of every page, each newline-terminated and followed by PAGE_BREAK, extracted in parallel for large PDFs"""
+    from pypdf import PdfReader
+
+    workers = workers or extract_workers()
+    min_pages = min_pages or int(os.getenv('PDF_PARALLEL_MIN_PAGES', '24'))
+    reader = PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    if workers <= 1 or page_count < min_pages:
+        return _extract_pages(reader, 0, page_count)
+
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    futures = []
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        pool = _get_pool(workers)
+        profile = profiling_active()
+        futures = [pool.submit(_extract_range, path, start, stop, profile) for start, stop in page_ranges(page_count, workers)]
+        # Workers can't see the request deadline, so it's enforced while waiting on them
+        deadline = current_deadline()
+        parts = []
+        for future in futures:
+            timeout = max(deadline.remaining(), 0) if deadline is not None else None
+            try:
+                part = future.result(timeout=timeout)
+            except FutureTimeoutError:
+                raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded during extract")
+            if profile:
+                part, stats = part
+                add_stats(stats)
+            parts.append(part)
+        return "".join(parts)
+    except BrokenProcessPool:
+        # A worker died (e.g. out of memory); start a fresh pool next time
+        _discard_pool()
+        return _extract_pages(reader, 0, page_count)
+    finally:
+        for future in futures:
+            future.cancel()
+        # Ranges still running keep their mapping alive; unlinking only drops the name
+        os.unlink(path)
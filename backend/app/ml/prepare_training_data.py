@@ -1,77 +1,162 @@
+"""Build training_data.jsonl from paired regular/climate-integrated worksheets.
+
+Directory structure:
+worksheets/
+  regular/
+    biology/        # Regular biology worksheets
+  climate_integrated/
+    biology/        # Climate-integrated biology worksheets
+
+Documents are converted once by convert_pdfs (cached by content hash, in
+parallel). Each regular worksheet is paired with its climate-integrated
+version by filename (``bio_allele_frequency_01`` <->
+``bio_climate_allele_frequency_01``), falling back to the climate worksheet in
+the same subject whose name shares the most topic words (numbers and the
+subject, e.g. "bio", don't count). A fallback must share at least
+MIN_TOPIC_OVERLAP of the two names' topic words, so ``cell_division`` is not
+paired with ``cell_respiration``; worksheets without one are skipped and
+logged. Examples are streamed to disk one at a time.
+
+    python app/ml/prepare_training_data.py --max-tokens 12000
+"""
+from pathlib import Path
+import argparse
 import json
-import docx2txt
-from pypdf import PdfReader
+import math
 import os
+import re
+import tempfile
+
+from convert_pdfs import convert_library, load_manifest, MANIFEST_NAME
+from validate_training_data import example_tokens
+
+SYSTEM_PROMPT = "You are an expert at enhancing biology worksheets by integrating climate change concepts. Analyze this biology worksheet without climate integration, and the example of a climate-integrated biology worksheet to learn the pattern of integration."
+
+# Name words that mark the climate-integrated version rather than the topic
+CLIMATE_MARKERS = {"climate", "integrated", "enhanced"}
+
+# Share of the two names' topic words (together) a fallback match must have in common
+MIN_TOPIC_OVERLAP = 0.5
+
+
+def pairing_key(path: str) -> tuple:
+    """Name words of a document, minus climate markers, e.g. ('bio', 'allele', 'frequency', '01')"""
+    words = re.split(r"[^a-z0-9]+", Path(path).stem.lower())
+    return tuple(word for word in words if word and word not in CLIMATE_MARKERS)
+
+
+def topic_words(key: tuple, subject: str) -> set:
+    """Name words that say what a worksheet covers: not numbers, the subject or its abbreviation"""
+    subject = subject.lower()
+    return {word for word in key if not word.isdigit() and not subject.startswith(word)}
+
+
+def collect_documents(manifest: dict, collection: str) -> dict:
+    """subject -> {source path: text path} for one collection in the manifest"""
+    documents = {}
+    for source, entry in manifest.items():
+        parts = source.split("/")
+        if len(parts) == 3 and parts[0] == collection:
+            documents.setdefault(parts[1], {})[source] = entry["output"]
+    return documents
+
+
+def pair_documents(regular: dict, climate: dict) -> list[tuple]:
+    """(subject, regular source, climate source) pairs, one per regular worksheet at most"""
+    pairs = []
+    for subject, regular_docs in sorted(regular.items()):
+        climate_docs = climate.get(subject, {})
+        by_key = {pairing_key(source): source for source in climate_docs}
+        for source in sorted(regular_docs):
+            key = pairing_key(source)
+            match = by_key.get(key)
+            if match is None and climate_docs:
+                # No exact name match: take the climate worksheet sharing the most topic words
+                topic = topic_words(key, subject)
+                # Most words in common, then fewest words between them
+                overlap, combined, closest = max(
+                    (len(topic & other_topic), -len(topic | other_topic), other)
+                    for other, other_topic in (
+                        (other, topic_words(pairing_key(other), subject)) for other in sorted(climate_docs)
+                    )
+                )
+                if overlap and overlap >= math.ceil(MIN_TOPIC_OVERLAP * -combined):
+                    match = closest
+                else:
+                    print(
+                        f"Warning: skipping {source}; the closest climate-integrated name, {closest}, "
+                        f"shares {overlap} of {-combined} topic words"
+                    )
+                    continue
+            if match is None:
+                print(f"Warning: no climate-integrated match for {source}")
+                continue
+            pairs.append((subject, source, match))
+    return pairs
+
+
+def make_example(regular_text: str, climate_text: str) -> dict:
+    return {
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Regular worksheet:\n{regular_text}\n\nNow enhance this worksheet with climate concepts:"},
+            {"role": "assistant", "content": climate_text}
+        ]
+    }
+
+
+def create_training_data(root: Path = Path("worksheets"), output: Path = Path("training_data.jsonl"),
+                         max_tokens: int = 12000, workers: int = None) -> dict:
+    """Stream one example per paired worksheet to output; returns counts"""
+    convert_library(root, workers=workers)
+    manifest = load_manifest(root / MANIFEST_NAME)
+    pairs = pair_documents(collect_documents(manifest, "regular"), collect_documents(manifest, "climate_integrated"))
+
+    counts = {"written": 0, "duplicate": 0, "too_long": 0}
+    seen = set()
+    fd, tmp_path = tempfile.mkstemp(dir=output.resolve().parent, prefix=f".{output.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for _, regular_source, climate_source in pairs:
+                # Identical source files would produce identical examples
+                digest = (manifest[regular_source]["sha256"], manifest[climate_source]["sha256"])
+                if digest in seen:
+                    counts["duplicate"] += 1
+                    continue
+                seen.add(digest)
+
+                regular_text = (root / manifest[regular_source]["output"]).read_text(encoding="utf-8")
+                climate_text = (root / manifest[climate_source]["output"]).read_text(encoding="utf-8")
+                example = make_example(regular_text, climate_text)
+                # Counted as validate_training_data counts them, so what passes here passes there
+                tokens = example_tokens(example["messages"])
+                if tokens > max_tokens:
+                    counts["too_long"] += 1
+                    print(f"Skipping {regular_source}: {tokens} tokens exceeds the {max_tokens} cap")
+                    continue
+
+                f.write(json.dumps(example) + '\n')
+                counts["written"] += 1
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build fine-tuning data from paired worksheets")
+    parser.add_argument("--root", type=Path, default=Path("worksheets"))
+    parser.add_argument("--output", type=Path, default=Path("training_data.jsonl"))
+    parser.add_argument("--max-tokens", type=int, default=12000, help="skip examples with more tokens than this")
+    parser.add_argument("--workers", type=int, default=None, help="extraction processes (default: CPU count)")
+    args = parser.parse_args()
 
-def convert_document_to_text(file_path):
-    if file_path.endswith('.pdf'):
-        reader = PdfReader(file_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    elif file_path.endswith('.docx'):
-        return docx2txt.process(file_path)
-    return None
-
-def create_training_data():
-    training_examples = []
-    
-    # Directory structure:
-    # worksheets/
-    #   regular/          
-    #     biology/        # Regular biology worksheets
-    #   climate_integrated/    
-    #     biology/        # Climate-integrated biology worksheets
-    
-    base_dir = "worksheets"
-    regular_dir = os.path.join(base_dir, "regular", "biology")
-    climate_dir = os.path.join(base_dir, "climate_integrated", "biology")
-    
-    # Get examples from each directory
-    regular_examples = []
-    climate_examples = []
-    
-    # Get regular worksheets
-    if os.path.exists(regular_dir):
-        for file in os.listdir(regular_dir):
-            if file.endswith(('.pdf', '.docx')):
-                text = convert_document_to_text(os.path.join(regular_dir, file))
-                if text:
-                    regular_examples.append(text)
-    
-    # Get climate-integrated worksheets
-    if os.path.exists(climate_dir):
-        for file in os.listdir(climate_dir):
-            if file.endswith(('.pdf', '.docx')):
-                text = convert_document_to_text(os.path.join(climate_dir, file))
-                if text:
-                    climate_examples.append(text)
-    
-    # Create training pairs
-    for reg_text in regular_examples:
-        for climate_text in climate_examples:
-            training_examples.append({
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an expert at enhancing biology worksheets by integrating climate change concepts. Analyze this biology worksheet without climate integration, and the example of a climate-integrated biology worksheet to learn the pattern of integration."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Regular worksheet:\n{reg_text}\n\nExample of climate integration:\n{climate_text}\n\nNow enhance this worksheet with climate concepts:"
-                    },
-                    {
-                        "role": "assistant",
-                        "content": climate_text
-                    }
-                ]
-            })
-    
-    # Write to JSONL file
-    with open('training_data.jsonl', 'w') as f:
-        for example in training_examples:
-            f.write(json.dumps(example) + '\n')
+    counts = create_training_data(args.root, args.output, args.max_tokens, args.workers)
+    print(
+        f"Wrote {counts['written']} examples to {args.output} "
+        f"({counts['duplicate']} duplicates, {counts['too_long']} over the token cap skipped)"
+    )
 
 if __name__ == "__main__":
-    create_training_data() 
\ No newline at end of file
+    main()
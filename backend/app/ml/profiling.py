@@ -0,0 +1,167 @@
+"""Opt-in cProfile profiling of individual requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILE_ADMIN_TOKEN>`` or
+is picked by ``PROFILE_SAMPLE_RATE`` (0.0-1.0, default off). The pstats dump
+and a plain-text summary are written to ``PROFILE_DIR`` and the id is returned
+in the ``X-Profile-Id`` response header. Inspect a dump with e.g.
+``python -m pstats profiles/<id>.prof`` or ``snakeviz profiles/<id>.prof``.
+
+cProfile only sees the thread it is enabled in, here the event loop's, and
+that includes whatever other requests run on the loop meanwhile. Work a
+request hands to a thread pool is profiled where it runs if the callable is
+wrapped with profiled() (asyncio.to_thread carries the request's context
+over), and work done in worker processes can be profiled there with
+collect_stats() and merged back with add_stats(). Those parts are the
+request's own, so PDF extraction and rendering show up however they are
+offloaded.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import contextvars
+import cProfile
+import functools
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Profiles from other threads and processes to merge into the profiled request's; None when not profiling
+_offloaded = contextvars.ContextVar("offloaded_profiles", default=None)
+
+
+class _CollectedStats:
+    """Stats gathered by collect_stats(), in the form pstats.Stats accepts"""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profiling_active() -> bool:
+    """Whether the current request is being profiled"""
+    return _offloaded.get() is not None
+
+
+def profiled(fn):
+    """fn, profiled in the thread that runs it and merged into the request's profile if there is one"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        offloaded = _offloaded.get()
+        if offloaded is None:
+            return fn(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler owns this thread
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            offloaded.append(profiler)
+    return wrapper
+
+
+def collect_stats(fn, *args) -> tuple:
+    """(fn(*args), its profile stats) for work in another process; pass the stats to add_stats()"""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args)
+    profiler.create_stats()
+    return result, profiler.stats
+
+
+def add_stats(stats: dict):
+    """Merge stats from collect_stats() into the current request's profile"""
+    offloaded = _offloaded.get()
+    if offloaded is not None:
+        offloaded.append(_CollectedStats(stats))
+
+
+class ProfileResult:
+    """Handle for a running profile; ``id`` is set once it has been saved"""
+
+    def __init__(self):
+        self.id = None
+
+
+class RequestProfiler:
+    def __init__(self, directory: str = "profiles", sample_rate: float = 0.0,
+                 admin_token: str = None, summary_lines: int = 40):
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.summary_lines = summary_lines
+        # cProfile can't nest, so only one request is profiled at a time
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        return cls(
+            directory=os.getenv("PROFILE_DIR", "profiles"),
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0") or 0),
+            admin_token=os.getenv("PROFILE_ADMIN_TOKEN") or None,
+        )
+
+    def should_profile(self, headers) -> bool:
+        """Decide whether a request with these headers should be profiled"""
+        requested = headers.get(PROFILE_HEADER)
+        if requested and self.admin_token and hmac.compare_digest(requested, self.admin_token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, label: str = ""):
+        """Profile the enclosed block; yields a ProfileResult whose id is set on exit"""
+        result = ProfileResult()
+        if not self._lock.acquire(blocking=False):
+            logger.info("Skipping profile, another request is already being profiled")
+            yield result
+            return
+
+        profiler = cProfile.Profile()
+        offloaded = []
+        token = _offloaded.set(offloaded)
+        try:
+            profiler.enable()
+            try:
+                yield result
+            finally:
+                profiler.disable()
+                result.id = self._save(profiler, label, offloaded)
+        finally:
+            _offloaded.reset(token)
+            self._lock.release()
+
+    def _save(self, profiler: cProfile.Profile, label: str, offloaded: list = ()) -> str:
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            summary = io.StringIO()
+            summary.write(f"{label}\n\n")
+            stats = pstats.Stats(profiler, *offloaded, stream=summary)
+            stats.dump_stats(str(self.directory / f"{profile_id}.prof"))
+            stats.sort_stats("cumulative").print_stats(self.summary_lines)
+            (self.directory / f"{profile_id}.txt").write_text(summary.getvalue())
+        except Exception as e:
+            logger.error(f"Error saving profile: {str(e)}")
+            return None
+
+        logger.info(f"Saved profile {profile_id} for {label}")
+        return profile_id
+
+
+# Shared profiler configured from the environment
+request_profiler = RequestProfiler.from_env()
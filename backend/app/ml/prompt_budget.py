@@ -0,0 +1,179 @@
+"""Pre-flight token accounting that keeps enhancement prompts inside the model's window.
+
+Every component of a prompt (instructions, each retrieved example, the
+worksheet) is counted locally before any completion is requested, and room
+is reserved for the output, which for an enhancement is the whole worksheet
+again plus its additions (ENHANCE_OUTPUT_RATIO times the worksheet, plus
+OUTPUT_EXTRA_TOKENS for the closing questions). Then:
+
+- a worksheet that fits goes in one request, with as many examples as the
+  remaining budget allows: whole in rank order, the first that doesn't fit
+  trimmed at a line boundary, the rest dropped (fit_examples());
+- a worksheet that doesn't is split at paragraph boundaries into parts that
+  do (split_document()), each part is enhanced on its own (map) and the
+  enhanced parts are joined in order (join_parts(), the reduce).
+
+Every request also carries max_tokens, so the API can't reject it for
+asking more than the window holds. Parts are sized for full output even in
+delta mode, so a delta reply that can't be merged can be regenerated in full.
+
+Limits of known models are in MODEL_LIMITS; fine-tuned models use their base
+model's, and MODEL_CONTEXT_WINDOW / MODEL_MAX_OUTPUT_TOKENS override both.
+Tokens are counted with cl100k_base (see text_compaction.count_tokens()),
+which over-counts for models on o200k_base, so the guard errs on the safe
+side.
+"""
+from functools import lru_cache
+from typing import NamedTuple
+import math
+import os
+
+from .metrics import record_prompt_examples
+from .text_compaction import count_tokens
+
+# (context window, maximum output tokens); looked up by longest matching prefix
+MODEL_LIMITS = {
+    "gpt-3.5-turbo": (16385, 4096),
+    "gpt-4": (8192, 8192),
+    "gpt-4-turbo": (128000, 4096),
+    "gpt-4o": (128000, 16384),
+    "gpt-4o-mini": (128000, 16384),
+}
+DEFAULT_LIMITS = MODEL_LIMITS["gpt-3.5-turbo"]
+
+# Chat format overhead: tokens framing each message, and priming the reply
+TOKENS_PER_MESSAGE = 3
+REPLY_TOKENS = 3
+
+OUTPUT_EXTRA_TOKENS = 300
+
+# A trimmed example shorter than this isn't worth its place in the prompt
+MIN_EXAMPLE_TOKENS = 200
+
+# Separator between examples in the prompt, and between enhanced parts
+EXAMPLE_SEPARATOR = "\n\n---\n\n"
+PART_SEPARATOR = "\n\n"
+
+
+class ModelLimits(NamedTuple):
+    context_window: int
+    max_output: int
+
+
+class PlannedPrompt(NamedTuple):
+    messages: list
+    max_tokens: int
+    # Delta mode only (see delta_output.py): the part the reply is merged into,
+    # whether it ends the worksheet, and the full-output prompt to fall back on
+    source: str = None
+    final: bool = True
+    fallback: "PlannedPrompt" = None
+
+
+def model_limits(model: str) -> ModelLimits:
+    """Context window and output limit for a model name, fine-tuned ones included"""
+    # ft:gpt-3.5-turbo-0125:org::id -> gpt-3.5-turbo-0125
+    base = model.split(":")[1] if model.startswith("ft:") else model
+    matches = [name for name in MODEL_LIMITS if base.startswith(name)]
+    window, max_output = MODEL_LIMITS[max(matches, key=len)] if matches else DEFAULT_LIMITS
+    return ModelLimits(
+        int(os.getenv('MODEL_CONTEXT_WINDOW', '0')) or window,
+        int(os.getenv('MODEL_MAX_OUTPUT_TOKENS', '0')) or max_output,
+    )
+
+
+def message_tokens(messages: list[dict]) -> int:
+    """Prompt tokens for a list of chat messages"""
+    return REPLY_TOKENS + sum(
+        TOKENS_PER_MESSAGE + count_tokens(m["role"]) + count_tokens(m["content"]) for m in messages
+    )
+
+
+@lru_cache(maxsize=1024)
+def example_tokens(example: str) -> int:
+    # Examples come from a fixed store, so their counts are worth keeping
+    return count_tokens(example) + count_tokens(EXAMPLE_SEPARATOR)
+
+
+def output_tokens(document_tokens: int) -> int:
+    """Output to reserve for enhancing a worksheet of document_tokens"""
+    return math.ceil(document_tokens * float(os.getenv('ENHANCE_OUTPUT_RATIO', '1.5'))) + OUTPUT_EXTRA_TOKENS
+
+
+def fits(limits: ModelLimits, instruction_tokens: int, document_tokens: int) -> bool:
+    """Whether the worksheet and its enhancement fit one request (without examples)"""
+    reserved = output_tokens(document_tokens)
+    return reserved <= limits.max_output and instruction_tokens + document_tokens + reserved <= limits.context_window
+
+
+def max_part_tokens(limits: ModelLimits, instruction_tokens: int) -> int:
+    """Largest part, in tokens, for which fits() holds"""
+    ratio = float(os.getenv('ENHANCE_OUTPUT_RATIO', '1.5'))
+    by_window = (limits.context_window - instruction_tokens - OUTPUT_EXTRA_TOKENS - 1) / (1 + ratio)
+    by_output = (limits.max_output - OUTPUT_EXTRA_TOKENS - 1) / ratio
+    return max(int(min(by_window, by_output)), 1)
+
+
+def example_budget(limits: ModelLimits, instruction_tokens: int, document_tokens: int) -> int:
+    """Tokens left for examples once the instructions, worksheet and output are accounted for"""
+    used = instruction_tokens + document_tokens + output_tokens(document_tokens)
+    return max(limits.context_window - used, 0)
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest run of text's leading lines within max_tokens"""
+    kept, used = [], 0
+    for line in text.split("\n"):
+        used += count_tokens(line + "\n")
+        if used > max_tokens:
+            break
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def fit_examples(examples: list[str], budget: int) -> list[str]:
+    """Examples, best first, that fit in budget tokens: whole, then one trimmed, then none"""
+    fitted, kept, trimmed = [], 0, 0
+    for example in examples:
+        cost = example_tokens(example)
+        if cost <= budget:
+            fitted.append(example)
+            kept += 1
+            budget -= cost
+            continue
+        if budget >= MIN_EXAMPLE_TOKENS:
+            fitted.append(trim_to_tokens(example, budget - count_tokens(EXAMPLE_SEPARATOR)))
+            trimmed += 1
+        break
+    record_prompt_examples(kept, trimmed, len(examples) - kept - trimmed)
+    return fitted
+
+
+def _pack(text: str, max_tokens: int, separators: tuple) -> list[str]:
+    """Greedily pack the pieces of text between separators[0] into parts of at most max_tokens,
+    splitting any piece too long on its own at the next, finer separator"""
+    separator, finer = separators[0], separators[1:]
+    parts, current, used = [], [], 0
+    for piece in text.split(separator):
+        tokens = count_tokens(piece + separator)
+        if current and used + tokens > max_tokens:
+            parts.append(separator.join(current))
+            current, used = [], 0
+        if tokens > max_tokens and finer:
+            parts.extend(_pack(piece, max_tokens, finer))
+            continue
+        current.append(piece)
+        used += tokens
+    if current:
+        parts.append(separator.join(current))
+    return parts
+
+
+def split_document(text: str, max_tokens: int) -> list[str]:
+    """Split text into parts of at most max_tokens, at blank lines where possible, else lines, else words"""
+    return [part.strip("\n") for part in _pack(text, max_tokens, ("\n\n", "\n", " ")) if part.strip()]
+
+
+def join_parts(outputs: list[str]) -> str:
+    """Reduce: the enhanced parts, in document order"""
+    return PART_SEPARATOR.join(output.strip("\n") for output in outputs)
@@ -0,0 +1,184 @@
+"""Compact storage for normalised embeddings.
+
+EmbeddingMatrix keeps embeddings in one contiguous array instead of a list of
+boxed Python floats (~50KB per ada-002 vector). ``float16`` halves that again
+and ``int8`` (one scale per vector) quarters it. Scoring walks the matrix in
+blocks, so the full float32 matrix is never materialised.
+
+int8 is usually the better choice: NumPy's float16 -> float32 conversion is
+slow on most CPUs, so float16 saves memory but scores several times slower.
+See benchmarks/quantization.py.
+"""
+from pathlib import Path
+import numpy as np
+
+from .shared_store import save_array
+
+DTYPES = ("float32", "float16", "int8")
+
+# Rows converted to float32 at a time when scoring a quantized matrix
+SCORE_BLOCK_ROWS = 1024
+
+
+def normalize(vectors) -> np.ndarray:
+    """Scale rows to unit length so dot product equals cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple:
+    """Symmetric per-vector int8 quantization; returns (codes, scales)"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class EmbeddingMatrix:
+    """Growable matrix of unit-length embeddings stored as float32, float16 or int8"""
+
+    def __init__(self, dtype: str = "float32", dim: int = None):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype}, expected one of {DTYPES}")
+        self.dtype = dtype
+        self.dim = dim
+        self._size = 0
+        self._data = None
+        self._scales = None
+
+    @classmethod
+    def from_array(cls, vectors, dtype: str = "float32") -> "EmbeddingMatrix":
+        matrix = cls(dtype)
+        matrix.extend(vectors)
+        return matrix
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def data(self) -> np.ndarray:
+        return self._data[:self._size] if self._data is not None else np.empty((0, self.dim or 0), dtype=self.dtype)
+
+    @property
+    def scales(self) -> np.ndarray:
+        return self._scales[:self._size] if self._scales is not None else None
+
+    @property
+    def nbytes(self) -> int:
+        total = self.data.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        return total
+
+    def _reserve(self, rows: int):
+        capacity = 0 if self._data is None else len(self._data)
+        if self._size + rows <= capacity:
+            return
+        # Grow geometrically so repeated appends stay amortised O(1)
+        new_capacity = max(self._size + rows, capacity * 2, 16)
+        data = np.empty((new_capacity, self.dim), dtype=self.dtype)
+        if self._data is not None:
+            data[:self._size] = self._data[:self._size]
+        self._data = data
+        if self.dtype == "int8":
+            scales = np.empty(new_capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def append(self, vector) -> int:
+        """Add one embedding and return its row"""
+        self.extend([vector])
+        return self._size - 1
+
+    def extend(self, vectors):
+        vectors = normalize(vectors)
+        if vectors.ndim != 2 or len(vectors) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional embeddings, got {vectors.shape[1]}")
+
+        self._reserve(len(vectors))
+        rows = slice(self._size, self._size + len(vectors))
+        if self.dtype == "int8":
+            self._data[rows], self._scales[rows] = quantize_int8(vectors)
+        else:
+            self._data[rows] = vectors
+        self._size += len(vectors)
+
+    def to_float32(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """Dequantize a range of rows"""
+        block = self.data[start:stop].astype(np.float32)
+        if self.dtype == "int8":
+            block *= self.scales[start:stop, None]
+        return block
+
+    def rows_float32(self, rows: np.ndarray) -> np.ndarray:
+        """Dequantize an arbitrary set of rows"""
+        block = self.data[rows].astype(np.float32)
+        if self.dtype == "int8":
+            block *= self.scales[rows, None]
+        return block
+
+    def _score_block(self, block: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if self.dtype == "float32":
+            return block @ query
+        scores = block.astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def scores(self, query, start: int = 0, stop: int = None) -> np.ndarray:
+        """Cosine similarity of the query against rows start:stop"""
+        query = normalize(query)
+        stop = self._size if stop is None else min(stop, self._size)
+        if stop <= start:
+            # Also covers an empty matrix, which has no width to multiply against
+            return np.empty(0, dtype=np.float32)
+        if self.dtype == "float32":
+            return self.data[start:stop] @ query
+
+        scores = np.empty(max(stop - start, 0), dtype=np.float32)
+        for block_start in range(start, stop, SCORE_BLOCK_ROWS):
+            block_stop = min(block_start + SCORE_BLOCK_ROWS, stop)
+            scales = self.scales[block_start:block_stop] if self.scales is not None else None
+            scores[block_start - start:block_stop - start] = self._score_block(
+                self.data[block_start:block_stop], scales, query
+            )
+        return scores
+
+    def scores_rows(self, query, rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against an arbitrary set of rows"""
+        query = normalize(query)
+        scales = self.scales[rows] if self.scales is not None else None
+        return self._score_block(self.data[rows], scales, query)
+
+    def save(self, directory, name: str = "embeddings"):
+        """Write ``<name>.npy`` (and ``<name>_scales.npy`` for int8) to a directory"""
+        directory = Path(directory)
+        save_array(directory / f"{name}.npy", self.data)
+        if self.scales is not None:
+            save_array(directory / f"{name}_scales.npy", self.scales)
+
+    @classmethod
+    def load(cls, directory, name: str = "embeddings", mmap_mode: str = None) -> "EmbeddingMatrix":
+        directory = Path(directory)
+        data = np.load(directory / f"{name}.npy", mmap_mode=mmap_mode)
+        matrix = cls(str(data.dtype), data.shape[1] if data.ndim == 2 else None)
+        matrix._data = data
+        matrix._size = len(data)
+        scales_path = directory / f"{name}_scales.npy"
+        if matrix.dtype == "int8":
+            matrix._scales = np.load(scales_path, mmap_mode=mmap_mode)
+        return matrix
+
+    def astype(self, dtype: str) -> "EmbeddingMatrix":
+        """Copy into another storage dtype, converting in blocks"""
+        converted = EmbeddingMatrix(dtype, self.dim)
+        for start in range(0, self._size, SCORE_BLOCK_ROWS):
+            converted.extend(self.to_float32(start, start + SCORE_BLOCK_ROWS))
+        return converted
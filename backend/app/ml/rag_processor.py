@@ -1,80 +1,356 @@
-from openai import OpenAI
 from dotenv import load_dotenv
+from openai.types import CompletionUsage
+import asyncio
 import os
 import numpy as np
 from pathlib import Path
 import json
 from pypdf import PdfReader
 from io import BytesIO
+from .deadlines import timeout_kwargs
+from .metrics import track_stage, record_token_usage, record_retrieval, record_prompt_route, record_delta_merge
+from .embeddings import EmbeddingBackend, make_embedding_backend
+from .lexical_index import BM25Index
+from .model_registry import ModelRegistry
+from .openai_client import get_openai_client, get_async_openai_client
+from .profiling import profiled
+from . import delta_output, prompt_budget
+from .quantization import EmbeddingMatrix
+from .shared_store import MappedTexts, save_texts, store_lock
+from .text_compaction import compact_text, count_tokens
+from .vector_index import IVFFlatIndex, top_k
 
 load_dotenv()
 
+# Rebuild the ANN index once this fraction of documents has been added since the last build
+INDEX_REBUILD_RATIO = 0.1
+
+# Reciprocal rank fusion constant: a document's fused score is sum(1 / (RRF_K + rank))
+RRF_K = 60
+
+EXAMPLES_DIR = Path("worksheets/climate_integrated/biology")
+
+# Where RAG_SHARED_STORE=1 keeps the store when RAG_STORE_DIR isn't set
+DEFAULT_SHARED_STORE_DIR = "rag_store"
+
 class DocumentStore:
-    def __init__(self):
-        self.embeddings = []  # List of (embedding, content) tuples
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, index_type: str = None, ann_threshold: int = None, nprobe: int = None,
+                 embedding_dtype: str = None, embedding_backend: EmbeddingBackend = None,
+                 retrieval: str = None, lexical_confidence: float = None):
+        # Row i of embeddings is the normalised embedding of contents[i]. float16 and
+        # int8 storage cut memory 2x and 4x over float32 at a small cost in recall
+        self.embedding_dtype = embedding_dtype or os.getenv('RAG_EMBEDDING_DTYPE', 'float32')
+        self.embeddings = EmbeddingMatrix(self.embedding_dtype)
+        self.contents = []
+        # OpenAI by default; RAG_EMBEDDING_BACKEND=hashing or onnx embeds locally
+        # so retrieval needs no network call
+        self.embedding_backend = embedding_backend or make_embedding_backend()
+        
+        # "exact" always scans every embedding, "ivf" always uses the ANN index and
+        # "auto" switches to the index once the store reaches ann_threshold documents
+        self.index_type = index_type or os.getenv('RAG_INDEX', 'auto')
+        self.ann_threshold = ann_threshold or int(os.getenv('RAG_ANN_THRESHOLD', '10000'))
+        self.nprobe = nprobe or int(os.getenv('RAG_IVF_NPROBE', '8'))
+        self.nlist = int(os.getenv('RAG_IVF_NLIST', '0')) or None
+        self.index = None
+        
+        # "vector" ranks by embeddings only, "lexical" by BM25 only and "hybrid" fuses
+        # both, skipping the embedding call when BM25 alone is confident: its n-th
+        # result outscores the next by at least lexical_confidence times
+        self.lexical = BM25Index()
+        self.retrieval = retrieval or os.getenv('RAG_RETRIEVAL', 'hybrid')
+        self.lexical_confidence = lexical_confidence or float(os.getenv('RAG_LEXICAL_CONFIDENCE', '2.0'))
+        self.hybrid_candidates = int(os.getenv('RAG_HYBRID_CANDIDATES', '20'))
     
     def add_document(self, content: str):
         """Add a document to the store with its embedding"""
-        embedding = self.client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=content
-        ).data[0].embedding
-        self.embeddings.append((embedding, content))
+        self.add_documents([content])
+    
+    def add_documents(self, contents: list[str]):
+        """Add several documents, embedding them in batches"""
+        if not contents:
+            return
+        if not isinstance(self.contents, list):
+            # Loaded read-only from a shared store; this process gets its own copy
+            self.contents = list(self.contents)
+        self.embeddings.extend(self._embed_batch(contents, stage="embed_document"))
+        self.contents.extend(contents)
+        self.lexical.add(contents)
     
     def find_similar(self, query: str, n: int = 3) -> list[str]:
         """Find n most similar documents to the query"""
-        query_embedding = self.client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=query
-        ).data[0].embedding
-        
-        # Calculate cosine similarity
-        similarities = []
-        for doc_embedding, content in self.embeddings:
-            similarity = np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
+        if self.retrieval == "vector":
+            positions = self._vector_search(query, n)
+        else:
+            with track_stage("lexical_search"):
+                lexical_scores = self.lexical.scores(query)
+                lexical_ranking = top_k(lexical_scores, max(n + 1, self.hybrid_candidates))
+            
+            if self.retrieval == "lexical" or self._lexical_confident(lexical_scores, lexical_ranking, n):
+                record_retrieval("lexical")
+                return [self.contents[i] for i in lexical_ranking[:n]]
+            
+            vector_ranking = self._vector_search(query, self.hybrid_candidates)
+            positions = self._fuse([lexical_ranking, vector_ranking], n)
+        
+        record_retrieval(self.retrieval if self.retrieval == "vector" else "hybrid")
+        return [self.contents[i] for i in positions]
+    
+    def _lexical_confident(self, scores: np.ndarray, ranking: np.ndarray, n: int) -> bool:
+        """True when BM25's top n clearly separate from every other document"""
+        if len(self.contents) <= n:
+            # Every document is returned whatever the ranking
+            return True
+        nth, runner_up = scores[ranking[n - 1]], scores[ranking[n]]
+        return nth > 0 and nth >= self.lexical_confidence * runner_up
+    
+    @staticmethod
+    def _fuse(rankings: list, n: int) -> list[int]:
+        """Reciprocal rank fusion of several best-first rankings"""
+        fused = {}
+        for ranking in rankings:
+            for rank, position in enumerate(ranking):
+                fused[int(position)] = fused.get(int(position), 0.0) + 1.0 / (RRF_K + rank + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:n]
+    
+    def _vector_search(self, query: str, n: int) -> list[int]:
+        """Store positions of the n documents closest to the query embedding"""
+        query_embedding = self._embed(query, stage="embed_query")
+        
+        with track_stage("similarity_search"):
+            if self._use_index():
+                return self._search_index(query_embedding, n)
+            
+            # Cosine similarity against every stored embedding
+            similarities = self.embeddings.scores(query_embedding)
+            return top_k(similarities, n).tolist()
+    
+    def _use_index(self) -> bool:
+        if not self.contents or self.index_type == "exact":
+            return False
+        return self.index_type == "ivf" or len(self.contents) >= self.ann_threshold
+    
+    def build_index(self):
+        """(Re)build the ANN index over every stored embedding"""
+        self.index = IVFFlatIndex(nlist=self.nlist, nprobe=self.nprobe).build(self.embeddings)
+    
+    def _search_index(self, query_embedding: np.ndarray, n: int) -> list[int]:
+        """Approximate top-n search, plus an exact scan of documents added since the last build"""
+        pending = len(self.contents) - (self.index.size if self.index else 0)
+        if self.index is None or pending > INDEX_REBUILD_RATIO * self.index.size:
+            self.build_index()
+            pending = 0
+        
+        positions, scores = self.index.search(query_embedding, n)
+        results = list(zip(scores.tolist(), positions.tolist()))
+        if pending:
+            pending_scores = self.embeddings.scores(query_embedding, start=self.index.size)
+            results += [(score, self.index.size + i) for i, score in enumerate(pending_scores.tolist())]
+        
+        results.sort(reverse=True)
+        return [position for _, position in results[:n]]
+    
+    def save(self, directory):
+        """Persist embeddings, contents, BM25 postings and the ANN index (if built) to a directory"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.embeddings.save(directory)
+        # Contents and postings are written so load(mmap=True) can map them
+        save_texts(directory, self.contents)
+        self.lexical.save(directory)
+        with open(directory / "store.json", "w", encoding="utf-8") as f:
+            json.dump({"embedding_backend": self.embedding_backend.name, "dim": self.embeddings.dim}, f)
+        if self.index is not None:
+            self.index.save(directory / "index.npz")
+    
+    def load(self, directory, mmap: bool = False):
+        """Load a store written by save(), replacing the current contents.
+
+        With mmap the embeddings, contents and postings stay in the files and are
+        mapped read-only, so processes loading the same store share one copy.
+        """
+        directory = Path(directory)
+        # Stores saved before store.json existed were always embedded with OpenAI
+        meta = {"embedding_backend": "openai"}
+        if (directory / "store.json").exists():
+            with open(directory / "store.json", encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta["embedding_backend"] != self.embedding_backend.name:
+            raise ValueError(
+                f"Store at {directory} was embedded with {meta['embedding_backend']}, "
+                f"not {self.embedding_backend.name}"
             )
-            similarities.append((similarity, content))
+        embeddings = EmbeddingMatrix.load(directory, mmap_mode="r" if mmap else None)
+        if self.embedding_backend.dim and embeddings.dim and embeddings.dim != self.embedding_backend.dim:
+            raise ValueError(
+                f"Store at {directory} has {embeddings.dim}-dimensional embeddings, "
+                f"expected {self.embedding_backend.dim}"
+            )
+        if embeddings.dtype != self.embedding_dtype:
+            if mmap:
+                # Converting would give every process a private copy
+                print(f"Warning: using the store's {embeddings.dtype} embeddings, not {self.embedding_dtype}")
+                self.embedding_dtype = embeddings.dtype
+            else:
+                embeddings = embeddings.astype(self.embedding_dtype)
+        self.embeddings = embeddings
+        if MappedTexts.exists(directory):
+            contents = MappedTexts(directory, mmap_mode="r" if mmap else None)
+            self.contents = contents if mmap else list(contents)
+        else:
+            # Saved before the contents were written as UTF-8 arrays
+            with open(directory / "contents.json", encoding="utf-8") as f:
+                self.contents = json.load(f)
+        if BM25Index.exists(directory):
+            self.lexical = BM25Index.load(directory, mmap_mode="r" if mmap else None)
+        else:
+            # Saved before the postings were persisted
+            self.lexical = BM25Index()
+            self.lexical.add(self.contents)
         
-        # Return top n most similar documents
-        similarities.sort(reverse=True)
-        return [content for _, content in similarities[:n]]
+        index_path = directory / "index.npz"
+        self.index = None
+        if index_path.exists():
+            try:
+                self.index = IVFFlatIndex.load(index_path, self.embeddings)
+            except (KeyError, TypeError):
+                # Written by an older version; rebuilt on the next search
+                print(f"Warning: ignoring incompatible index at {index_path}")
+    
+    def _embed(self, text: str, stage: str) -> np.ndarray:
+        """Embed text, recording latency under the given stage"""
+        return self._embed_batch([text], stage)[0]
+    
+    def _embed_batch(self, texts: list[str], stage: str) -> np.ndarray:
+        """Embed several texts with the configured backend"""
+        with track_stage(stage):
+            return self.embedding_backend.embed(texts)
+
+def load_example_texts(examples_dir: Path = EXAMPLES_DIR) -> list[str]:
+    """Extract the text of every example PDF"""
+    examples_dir = Path(examples_dir)
+    if not examples_dir.exists():
+        print("Warning: No examples directory found")
+        return []
+        
+    examples = []
+    for file_path in examples_dir.glob("*.pdf"):
+        try:
+            # Read PDF and extract text
+            reader = PdfReader(file_path)
+            content = ""
+            for page in reader.pages:
+                content += page.extract_text() + "\n"
+            
+            if content.strip():  # Only add if we got some content
+                examples.append(content)
+                print(f"Loaded example from {file_path}")
+            else:
+                print(f"Warning: No text content extracted from {file_path}")
+        except Exception as e:
+            print(f"Error loading {file_path}: {str(e)}")
+    return examples
+
+def build_store(doc_store: DocumentStore, store_dir: str = None):
+    """Embed the examples into doc_store, saving it to store_dir if given"""
+    try:
+        # Extract every example first so they can be embedded in batches
+        doc_store.add_documents(load_example_texts())
+    except Exception as e:
+        print(f"Error embedding examples: {str(e)}")
+    
+    if store_dir and doc_store.contents:
+        if doc_store._use_index():
+            doc_store.build_index()
+        doc_store.save(store_dir)
+
+def open_shared_store(store_dir: str = None, doc_store: DocumentStore = None) -> DocumentStore:
+    """Map the shared example store read-only, building it first if no process has yet.
+
+    Run it in a pre-fork master (see backend/gunicorn.conf.py) so workers only
+    ever map the files; without one, the first worker to take the lock builds.
+    """
+    store_dir = store_dir or os.getenv('RAG_STORE_DIR') or DEFAULT_SHARED_STORE_DIR
+    doc_store = doc_store or DocumentStore()
+    with store_lock(store_dir):
+        if (Path(store_dir) / "embeddings.npy").exists():
+            try:
+                doc_store.load(store_dir, mmap=True)
+                print(f"Mapped {len(doc_store.contents)} examples from {store_dir} (pid {os.getpid()})")
+                return doc_store
+            except ValueError as e:
+                print(f"Warning: {str(e)}, rebuilding")
+        
+        build_store(doc_store, store_dir)
+        if doc_store.contents:
+            # Remap what was just written so this process shares pages with the rest
+            doc_store.load(store_dir, mmap=True)
+    return doc_store
+
+def _stream_deltas(events: str, usage: dict = None) -> tuple:
+    """(content, usage) of complete server-sent chat completion events; usage is kept if none carries it"""
+    payloads = [
+        line[len("data:"):].strip() for line in events.split("\n")
+        if line.startswith("data:") and line[len("data:"):].strip() != "[DONE]"
+    ]
+    # Decoded as one array: a json.loads() per token-sized chunk costs more than the rest of the path
+    content = []
+    for chunk in json.loads(f"[{','.join(payloads)}]"):
+        if chunk.get("error"):
+            raise RuntimeError(f"Streamed completion failed: {chunk['error'].get('message', chunk['error'])}")
+        usage = chunk.get("usage") or usage
+        if chunk.get("choices"):
+            content.append(chunk["choices"][0].get("delta", {}).get("content") or "")
+    return "".join(content), usage
 
 class DocumentEnhancer:
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-        self.model_name = "gpt-3.5-turbo"
+        self.client = get_openai_client()
+        # Completion model comes from the registry file, which fine-tuning updates
+        # and which is re-read while running; see model_registry.py
+        self.models = ModelRegistry()
         self.doc_store = DocumentStore()
         self._load_examples()
     
+    def _chat_completion(self, stage: str = "completion", **kwargs):
+        """Run a chat completion, recording latency under the given stage and token usage"""
+        with track_stage(stage):
+            response = self.client.chat.completions.create(**kwargs, **timeout_kwargs())
+        record_token_usage(kwargs["model"], response.usage)
+        return response
+    
+    async def _chat_completion_async(self, stage: str = "completion", **kwargs):
+        """_chat_completion() on the async client; cancelling it closes the upstream request"""
+        with track_stage(stage):
+            response = await get_async_openai_client().chat.completions.create(**kwargs, **timeout_kwargs())
+        record_token_usage(kwargs["model"], response.usage)
+        return response
+    
     def _load_examples(self):
         """Load climate-integrated examples into the document store"""
-        examples_dir = Path("worksheets/climate_integrated/biology")
-        if not examples_dir.exists():
-            print("Warning: No examples directory found")
+        store_dir = os.getenv('RAG_STORE_DIR')
+        if os.getenv('RAG_SHARED_STORE', '0') == '1':
+            # Pre-fork mode: every worker maps the one store built by the first
+            open_shared_store(store_dir, self.doc_store)
             return
-            
-        # Load and store each example
-        for file_path in examples_dir.glob("*.pdf"):
+        
+        # A store saved by a previous run skips re-extracting and re-embedding
+        # every example; delete the directory to rebuild it
+        if store_dir and (Path(store_dir) / "embeddings.npy").exists():
             try:
-                # Read PDF and extract text
-                reader = PdfReader(file_path)
-                content = ""
-                for page in reader.pages:
-                    content += page.extract_text() + "\n"
-                
-                if content.strip():  # Only add if we got some content
-                    self.doc_store.add_document(content)
-                    print(f"Loaded example from {file_path}")
-                else:
-                    print(f"Warning: No text content extracted from {file_path}")
-            except Exception as e:
-                print(f"Error loading {file_path}: {str(e)}")
+                self.doc_store.load(store_dir)
+                print(f"Loaded {len(self.doc_store.contents)} examples from {store_dir}")
+                return
+            except ValueError as e:
+                # Saved with a different embedding backend; rebuild it below
+                print(f"Warning: {str(e)}, rebuilding")
+        
+        build_store(self.doc_store, store_dir)
     
     def analyze_document(self, document_text: str) -> dict:
         """Analyze the document to determine subject and content type"""
-        response = self.client.chat.completions.create(
+        response = self._chat_completion(
+            stage="analysis",
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an expert at identifying educational content and its subject area. Be very specific about the topic (e.g., 'Plant Biology - Chloroplast Structure and Function' rather than just 'Biology')."},
@@ -86,16 +362,32 @@ class DocumentEnhancer:
             "document_type": "worksheet"
         }
     
-    def enhance_document(self, document_text: str, subject_area: str = None) -> str:
-        # Find similar climate-integrated examples
-        similar_examples = self.doc_store.find_similar(document_text)
-        examples_text = "\n\n---\n\n".join(similar_examples)
+    @property
+    def model_name(self) -> str:
+        return self.models.current()["default"]
+    
+    def select_model(self, override: str = None, routing_key: str = None) -> str:
+        """Model for one request; raises ValueError for an unregistered override"""
+        return self.models.select(override, routing_key)
+    
+    def enhancement_messages(self, document_text: str, examples: list[str] = None, part: tuple = None) -> list[dict]:
+        """Prompt for enhancing document_text, or part (index, count) of a longer worksheet,
+        including similar climate-integrated examples (retrieved when not given)"""
+        if examples is None:
+            # Find similar climate-integrated examples
+            examples = self.doc_store.find_similar(document_text)
+        examples_text = prompt_budget.EXAMPLE_SEPARATOR.join(examples)
         
-        # Execute enhancement using the model with examples
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": """You are an expert educator enhancing worksheets with climate change concepts.
+        closing = "4. Add 1-2 climate-related questions at the end"
+        if part is not None:
+            index, count = part
+            if index < count - 1:
+                closing = f"4. This is part {index + 1} of {count} of a longer worksheet; do not add questions at the end"
+            else:
+                closing = "4. This is the last part of a longer worksheet; add 1-2 climate-related questions at the end"
+        
+        return [
+            {"role": "system", "content": """You are an expert educator enhancing worksheets with climate change concepts.
                 FORMATTING REQUIREMENTS:
                 1. Use double asterisks for all headers:
                    - Main headers/titles: Wrap in double asterisks **like this**
@@ -127,16 +419,221 @@ class DocumentEnhancer:
                 1. What is photosynthesis? (How does this process help regulate atmospheric CO2?)
                 
                 2. Describe cell structure. (How do cellular adaptations help plants cope with climate change?)"""},
-                {"role": "user", "content": f"Example climate-integrated worksheets:\n\n{examples_text}"},
-                {"role": "system", "content": """Now enhance the following worksheet using similar patterns of climate integration.
+            {"role": "user", "content": f"Example climate-integrated worksheets:\n\n{examples_text}"},
+            {"role": "system", "content": """Now enhance the following worksheet using similar patterns of climate integration.
                 REQUIREMENTS:
                 1. Keep the original content and structure
                 2. Add climate connections in parentheses
                 3. Maintain the academic rigor
-                4. Add 1-2 climate-related questions at the end
+                """ + closing + """
                 5. Remember: Use **double asterisks** for ALL headers"""},
-                {"role": "user", "content": f"Enhance this worksheet:\n\n{document_text}"}
-            ]
+            {"role": "user", "content": f"Enhance this worksheet:\n\n{document_text}"}
+        ]
+    
+    def delta_messages(self, document_text: str, examples: list[str], part: tuple = None) -> list[dict]:
+        """Prompt asking only for additions to document_text, as JSON; see delta_output.py"""
+        examples_text = prompt_budget.EXAMPLE_SEPARATOR.join(examples)
+        closing = "1-2 climate-related questions to add at the end of the worksheet"
+        if part is not None and part[0] < part[1] - 1:
+            closing = "always empty: this is only part of a longer worksheet"
+        
+        return [
+            {"role": "system", "content": f"""You are an expert educator enhancing worksheets with climate change concepts.
+                The worksheet's lines are numbered like [3]. Do not rewrite the worksheet. Reply with a JSON object only:
+                {{"headings": [numbers of lines that are titles or section headers],
+                  "additions": {{"number of a question line": "(climate connection in parentheses)"}},
+                  "closing_questions": [{closing}]}}
+                
+                REQUIREMENTS:
+                1. At most one addition per question, in simple parentheses, following the examples' patterns
+                2. Maintain the academic rigor
+                3. Never answer questions or fill in blanks such as [blank 2]"""},
+            {"role": "user", "content": f"Example climate-integrated worksheets:\n\n{examples_text}"},
+            {"role": "user", "content": f"Worksheet:\n\n{delta_output.number_lines(document_text)}"}
+        ]
+    
+    def plan_enhancement(self, document_text: str, model: str, delta: bool = None) -> list:
+        """Prompts to send for document_text, sized to the model's context window before any is sent"""
+        delta = delta_output.delta_mode() if delta is None else delta
+        limits = prompt_budget.model_limits(model)
+        instruction_tokens = prompt_budget.message_tokens(self.enhancement_messages("", examples=[]))
+        document_tokens = count_tokens(document_text)
+        
+        parts = [document_text]
+        if not prompt_budget.fits(limits, instruction_tokens, document_tokens):
+            # Too long for one request: enhance it part by part and join the results
+            parts = prompt_budget.split_document(document_text, prompt_budget.max_part_tokens(limits, instruction_tokens))
+            print(f"Worksheet of {document_tokens} tokens is too long for one {model} request; "
+                  f"enhancing it in {len(parts)} parts")
+        record_prompt_route("map_reduce" if len(parts) > 1 else "single")
+        
+        # Retrieval is by the opening part, which carries the title and topic
+        examples = self.doc_store.find_similar(parts[0])
+        prompts = []
+        for index, part in enumerate(parts):
+            part_tokens = count_tokens(part)
+            budget = prompt_budget.example_budget(limits, instruction_tokens, part_tokens)
+            fitted = prompt_budget.fit_examples(examples, budget)
+            position = (index, len(parts)) if len(parts) > 1 else None
+            messages = self.enhancement_messages(part, fitted, position)
+            max_tokens = min(limits.max_output, limits.context_window - prompt_budget.message_tokens(messages))
+            prompt = prompt_budget.PlannedPrompt(messages, max_tokens)
+            if delta:
+                # Only the additions come back; the full prompt stays ready in case they can't be merged
+                messages = self.delta_messages(part, fitted, position)
+                max_tokens = min(limits.max_output, limits.context_window - prompt_budget.message_tokens(messages))
+                prompt = prompt_budget.PlannedPrompt(messages, max_tokens, part, index == len(parts) - 1, prompt)
+            prompts.append(prompt)
+        return prompts
+    
+    def _merge_delta(self, prompt, content: str) -> str:
+        """Merge a delta-mode reply into its part; None when it can't be, to regenerate the part in full"""
+        try:
+            merged = delta_output.apply_delta(prompt.source, content, closing=prompt.final)
+        except delta_output.DeltaError as e:
+            print(f"Warning: could not merge delta reply ({str(e)}), regenerating the part in full")
+            record_delta_merge(False)
+            return None
+        record_delta_merge(True)
+        return merged
+    
+    def _complete(self, model: str, prompt) -> str:
+        """Enhanced text for one planned prompt"""
+        delta = prompt.source is not None
+        response = self._chat_completion(
+            model=model, messages=prompt.messages, max_tokens=prompt.max_tokens,
+            **({"response_format": {"type": "json_object"}} if delta else {})
         )
+        content = response.choices[0].message.content
+        if delta:
+            content = self._merge_delta(prompt, content)
+            if content is None:
+                return self._complete(model, prompt.fallback)
+        return content
+    
+    def enhance_document(self, document_text: str, subject_area: str = None, model: str = None) -> str:
+        # Strip extraction noise first; blanks come back exactly in the output
+        compacted = compact_text(document_text)
+        model = model or self.select_model()
+        # Execute enhancement using the model with examples, one request per part
+        outputs = [self._complete(model, prompt) for prompt in self.plan_enhancement(compacted.text, model)]
+        
+        return compacted.restore(prompt_budget.join_parts(outputs))
+    
+    async def enhance_document_async(self, document_text: str, subject_area: str = None, model: str = None) -> str:
+        """enhance_document() for async routes, cancellable while the completions run"""
+        compacted = compact_text(document_text)
+        model = model or self.select_model()
+        # Retrieval may call the embeddings API, so it runs off the event loop
+        prompts = await asyncio.to_thread(profiled(self.plan_enhancement), compacted.text, model)
+        outputs = await self._complete_parts(model, prompts)
+        return compacted.restore(prompt_budget.join_parts(outputs))
+    
+    async def _complete_async(self, model: str, prompt, limit: asyncio.Semaphore) -> str:
+        """_complete() on the async client, holding limit while the request runs"""
+        delta = prompt.source is not None
+        async with limit:
+            response = await self._chat_completion_async(
+                model=model, messages=prompt.messages, max_tokens=prompt.max_tokens,
+                **({"response_format": {"type": "json_object"}} if delta else {})
+            )
+        content = response.choices[0].message.content
+        if delta:
+            content = self._merge_delta(prompt, content)
+            if content is None:
+                return await self._complete_async(model, prompt.fallback, limit)
+        return content
+    
+    async def _complete_parts(self, model: str, prompts: list) -> list[str]:
+        """Completions for every planned prompt, ENHANCE_PART_CONCURRENCY (default 4) at a time"""
+        limit = asyncio.Semaphore(int(os.getenv('ENHANCE_PART_CONCURRENCY', '4')))
+        tasks = [asyncio.ensure_future(self._complete_async(model, prompt, limit)) for prompt in prompts]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            # One part failing (or the request being cancelled) stops the rest
+            for task in tasks:
+                task.cancel()
+    
+    async def _stream_part(self, model: str, prompt, limit: asyncio.Semaphore, lines: asyncio.Queue):
+        """Put lists of one part's enhanced lines on lines as they complete, then None"""
+        try:
+            if prompt.source is not None:
+                # A delta reply is only usable once merged, so it arrives all at once
+                lines.put_nowait((await self._complete_async(model, prompt, limit)).split("\n"))
+                return
+            
+            pending, usage = "", None
+            async with limit:
+                with track_stage("completion"):
+                    # Read as raw server-sent events: the SDK builds a pydantic model per
+                    # chunk, which costs more CPU than everything else on this path
+                    async with get_async_openai_client().chat.completions.with_streaming_response.create(
+                        model=model, messages=prompt.messages, max_tokens=prompt.max_tokens, stream=True,
+                        # Usage comes in a final chunk; passed raw as this client predates stream_options
+                        extra_body={"stream_options": {"include_usage": True}}, **timeout_kwargs()
+                    ) as response:
+                        # Cancelled mid-stream, leaving the block closes the upstream request
+                        buffered, newline = [], False
+                        async for text in response.iter_text():
+                            buffered.append(text)
+                            # Events are buffered until a line can have ended: a newline (escaped
+                            # in the JSON) has arrived and so has the end of an event since
+                            newline = newline or "\\n" in text
+                            if not newline or "\n\n" not in text:
+                                continue
+                            events, _, rest = "".join(buffered).rpartition("\n\n")
+                            deltas, usage = _stream_deltas(events, usage)
+                            *complete, pending = (pending + deltas).split("\n")
+                            if complete:
+                                lines.put_nowait(complete)
+                            buffered, newline = [rest], "\\n" in rest
+                        deltas, usage = _stream_deltas("".join(buffered), usage)
+                        pending += deltas
+            record_token_usage(model, CompletionUsage(**usage) if usage else None)
+            lines.put_nowait([pending])
+        finally:
+            lines.put_nowait(None)
+    
+    async def enhance_document_lines(self, document_text: str, subject_area: str = None, model: str = None):
+        """enhance_document_async() as an async iterator over lists of the enhanced worksheet's lines.
+        
+        Completions are streamed, and lines are yielded once they and every line
+        before them have arrived, all that are ready together, so callers can work
+        on the start of the worksheet while the rest is generated. The lines joined
+        with newlines are exactly enhance_document_async()'s result."""
+        compacted = compact_text(document_text)
+        model = model or self.select_model()
+        prompts = await asyncio.to_thread(self.plan_enhancement, compacted.text, model)
         
-        return response.choices[0].message.content 
\ No newline at end of file
+        limit = asyncio.Semaphore(int(os.getenv('ENHANCE_PART_CONCURRENCY', '4')))
+        queues = [asyncio.Queue() for _ in prompts]
+        tasks = [
+            asyncio.ensure_future(self._stream_part(model, prompt, limit, queue))
+            for prompt, queue in zip(prompts, queues)
+        ]
+        try:
+            # Parts are yielded in order, as prompt_budget.join_parts() would join them:
+            # blank lines at either end of a part dropped and one between parts
+            started = False
+            for task, queue in zip(tasks, queues):
+                blanks = 1 if started else 0
+                first = True
+                while (batch := await queue.get()) is not None:
+                    ready = []
+                    for line in batch:
+                        if not line:
+                            blanks += 0 if first else 1
+                            continue
+                        ready.extend([""] * blanks)
+                        ready.append(line)
+                        blanks, first, started = 0, False, True
+                    if ready:
+                        # Placeholders never span lines, so a batch is restored in one pass
+                        yield compacted.restore("\n".join(ready)).split("\n")
+                # Raises if the part failed
+                await task
+        finally:
+            # One part failing (or the caller stopping early) stops the rest
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,86 @@
+"""Read-only, memory-mapped DocumentStore files shared by pre-forked workers.
+
+Each worker process used to build its own DocumentEnhancer: N copies of the
+embeddings, example texts and BM25 postings, and N rounds of startup
+embedding calls. With RAG_SHARED_STORE=1 the store is built once (by the
+gunicorn master, see backend/gunicorn.conf.py, or by whichever worker takes
+the store lock first) and every worker maps the saved arrays read-only.
+The pages then live once in the OS page cache however many workers there
+are, and a worker starts by mapping files instead of embedding examples.
+
+Arrays are written to a temp file and renamed into place, so a rebuild never
+truncates a file another process has mapped; it keeps the old inode until it
+reloads.
+"""
+from collections.abc import Sequence
+from contextlib import contextmanager
+from pathlib import Path
+import fcntl
+import os
+import tempfile
+import numpy as np
+
+LOCK_NAME = ".store.lock"
+
+
+def save_array(path, array: np.ndarray):
+    """np.save via a temp file and rename, safe while readers have the old file mapped"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        # mkstemp makes the file 0600; workers running as another user still need to map it
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def store_lock(directory):
+    """Exclusive lock on a store directory, held across processes while building or loading it"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_NAME, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def save_texts(directory, texts: list[str], name: str = "contents"):
+    """Write texts as one UTF-8 byte array plus offsets, so they can be mapped"""
+    directory = Path(directory)
+    encoded = [text.encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    save_array(directory / f"{name}_utf8.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    save_array(directory / f"{name}_offsets.npy", offsets)
+
+
+class MappedTexts(Sequence):
+    """Texts written by save_texts(), decoded from the mapped file on access"""
+
+    def __init__(self, directory, name: str = "contents", mmap_mode: str = "r"):
+        directory = Path(directory)
+        self._data = np.load(directory / f"{name}_utf8.npy", mmap_mode=mmap_mode)
+        self._offsets = np.load(directory / f"{name}_offsets.npy", mmap_mode=mmap_mode)
+
+    @staticmethod
+    def exists(directory, name: str = "contents") -> bool:
+        return (Path(directory) / f"{name}_offsets.npy").exists()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("text index out of range")
+        return self._data[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
@@ -1,8 +1,11 @@
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
-import json
-import time
+import argparse
+
+from finetune_monitor import FineTuneMonitor, wait_for_file
+from model_registry import ModelRegistry
+from validate_training_data import profile_file
 
 load_dotenv()
 
@@ -13,20 +16,17 @@ if not api_key:
 client = OpenAI(api_key=api_key)
 
 def validate_training_data(file_path: str):
-    """Validate that training data is properly formatted"""
-    with open(file_path, 'r') as f:
-        for i, line in enumerate(f, 1):
-            try:
-                entry = json.loads(line)
-                if not isinstance(entry, dict) or 'messages' not in entry:
-                    raise ValueError(f"Line {i}: Each entry must have a 'messages' field")
-                messages = entry['messages']
-                if not isinstance(messages, list) or len(messages) < 2:
-                    raise ValueError(f"Line {i}: 'messages' must be a list with at least 2 messages")
-                if not all(isinstance(m, dict) and 'role' in m and 'content' in m for m in messages):
-                    raise ValueError(f"Line {i}: Each message must have 'role' and 'content' fields")
-            except json.JSONDecodeError:
-                raise ValueError(f"Line {i}: Invalid JSON format")
+    """Validate that training data is properly formatted and report its token counts and cost"""
+    report = profile_file(file_path)
+    if report["errors"]:
+        line, problem = report["error_samples"][0]
+        raise ValueError(f"Line {line}: {problem} ({report['errors']} invalid lines in total)")
+    tokens = report["tokens"]
+    print(
+        f"{report['examples']} examples, {tokens['total']} tokens "
+        f"(p50 {tokens['p50']}, max {tokens['max']}), {report['duplicates']} duplicates, "
+        f"~${report['estimated_cost_usd']} for {report['epochs']} epochs"
+    )
     return True
 
 def start_finetuning():
@@ -45,11 +45,7 @@ def start_finetuning():
     
     # Wait for file to be processed
     print("Waiting for file processing...")
-    while True:
-        file_status = client.files.retrieve(training_file.id)
-        if file_status.status == "processed":
-            break
-        time.sleep(1)
+    wait_for_file(client, training_file.id)
     
     # Create fine-tuning job
     print("Starting fine-tuning job...")
@@ -65,35 +61,40 @@ def start_finetuning():
     
     print(f"Fine-tuning job created: {job.id}")
     
-    # Monitor job progress
-    while True:
-        job_status = client.fine_tuning.jobs.retrieve(job.id)
-        print(f"Status: {job_status.status}")
-        if job_status.status in ["succeeded", "failed"]:
-            if job_status.status == "succeeded":
-                print(f"Fine-tuning complete! New model ID: {job_status.fine_tuned_model}")
-                # Update the model name in rag_processor.py
-                update_model_name(job_status.fine_tuned_model)
-            else:
-                print(f"Fine-tuning failed: {job_status.error}")
-            break
-        time.sleep(30)  # Check every 30 seconds
+    # Monitor job progress; the job id is persisted, so if this process dies
+    # `python app/ml/start_finetuning.py --resume` picks up where it left off
+    monitor = make_monitor()
+    monitor.track(job.id, training_file=training_file.id)
+    monitor.run()
 
-def update_model_name(new_model_id: str):
-    """Update the model name in rag_processor.py"""
-    rag_file = "app/ml/rag_processor.py"
-    with open(rag_file, 'r') as f:
-        content = f.read()
-    
-    # Update the model name
-    updated_content = content.replace(
-        'self.model_name = "gpt-3.5-turbo"',
-        f'self.model_name = "{new_model_id}"'
-    )
-    
-    with open(rag_file, 'w') as f:
-        f.write(updated_content)
-    print(f"Updated model name in {rag_file}")
+def on_job_succeeded(job_id: str, job: dict):
+    print(f"Fine-tuning complete! New model ID: {job['fine_tuned_model']}")
+    # Point the enhancer at the new model via the model registry
+    update_model_name(job["fine_tuned_model"], job_id)
+
+def on_job_failed(job_id: str, job: dict):
+    print(f"Fine-tuning {job['status']}: {job.get('error')}")
+
+def make_monitor() -> FineTuneMonitor:
+    return FineTuneMonitor(client, on_success=on_job_succeeded, on_failure=on_job_failed)
+
+def update_model_name(new_model_id: str, job_id: str = None):
+    """Register the fine-tuned model; running enhancers pick it up without a restart"""
+    rollout_percent = int(os.getenv('FINETUNE_ROLLOUT_PERCENT', '100'))
+    registry = ModelRegistry()
+    if rollout_percent >= 100:
+        registry.register(new_model_id, job_id=job_id)
+        registry.promote(new_model_id)
+    else:
+        registry.register(new_model_id, rollout_percent=rollout_percent, job_id=job_id)
+    print(f"Registered {new_model_id} in {registry.path} ({rollout_percent}% of traffic)")
 
 if __name__ == "__main__":
-    start_finetuning() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fine-tune on training_data.jsonl")
+    parser.add_argument("--resume", action="store_true",
+                        help="only resume monitoring jobs started by earlier runs")
+    args = parser.parse_args()
+    if args.resume:
+        make_monitor().run()
+    else:
+        start_finetuning() 
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""Validate a fine-tuning JSONL file and profile its token counts and cost.
+
+The file is split into byte ranges on line boundaries and each range is
+parsed by a worker process (orjson where installed), so multi-GB files are
+streamed rather than loaded. Tokens are counted with tiktoken when it and its
+encoding are available, otherwise estimated at four characters per token;
+prepare_training_data caps examples with the same example_tokens().
+
+    python app/ml/validate_training_data.py training_data.jsonl --epochs 8
+    python app/ml/validate_training_data.py big.jsonl --per-example tokens.csv
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from array import array
+import argparse
+import hashlib
+import json
+import os
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    loads = json.loads
+    JSONDecodeError = json.JSONDecodeError
+
+ROLES = {"system", "user", "assistant"}
+
+# Largest example gpt-3.5-turbo fine-tuning accepts
+DEFAULT_MAX_TOKENS = 16385
+
+# USD per 1K training tokens for gpt-3.5-turbo fine-tuning
+DEFAULT_PRICE_PER_1K = 0.008
+
+# Chat formatting overhead per message and per conversation (see OpenAI's cookbook)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_CONVERSATION = 3
+
+# Errors kept per chunk; the count is still exact
+MAX_ERRORS = 100
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding couldn't be downloaded; don't retry per call
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def check_example(entry) -> str:
+    """Return a description of what's wrong with an example, or None"""
+    if not isinstance(entry, dict) or 'messages' not in entry:
+        return "Each entry must have a 'messages' field"
+    messages = entry['messages']
+    if not isinstance(messages, list) or len(messages) < 2:
+        return "'messages' must be a list with at least 2 messages"
+    if not all(isinstance(m, dict) and 'role' in m and 'content' in m for m in messages):
+        return "Each message must have 'role' and 'content' fields"
+    if not all(m['role'] in ROLES and isinstance(m['content'], str) for m in messages):
+        return "Each message needs a system/user/assistant role and string content"
+    if not any(m['role'] == 'assistant' for m in messages):
+        return "Each entry needs at least one assistant message"
+    return None
+
+
+def example_tokens(messages: list) -> int:
+    return TOKENS_PER_CONVERSATION + sum(
+        TOKENS_PER_MESSAGE + count_tokens(m['role']) + count_tokens(m['content']) for m in messages
+    )
+
+
+def chunk_ranges(path: Path, chunks: int) -> list[tuple]:
+    """Split a file into about ``chunks`` byte ranges that start at line starts"""
+    size = path.stat().st_size
+    step = max(size // max(chunks, 1), 1)
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + step < size:
+            f.seek(bounds[-1] + step)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def process_chunk(path: str, start: int, end: int, max_tokens: int) -> dict:
+    """Validate and count the lines in one byte range; runs in a worker process"""
+    lines = 0
+    tokens = array("I")
+    digests = []
+    errors = []
+    error_count = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            lines += 1
+            if not line.strip():
+                tokens.append(0)
+                digests.append(b"")
+                continue
+            try:
+                entry = loads(line)
+            except (JSONDecodeError, ValueError):
+                entry, problem = None, "Invalid JSON format"
+            else:
+                problem = check_example(entry)
+            if problem is None:
+                count = example_tokens(entry['messages'])
+                if count > max_tokens:
+                    problem = f"{count} tokens exceeds the {max_tokens} token limit"
+            else:
+                count = 0
+
+            if problem:
+                error_count += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append((lines, problem))
+            tokens.append(count)
+            digests.append(hashlib.blake2b(line.strip(), digest_size=8).digest())
+    return {"lines": lines, "tokens": tokens, "digests": digests,
+            "errors": errors, "error_count": error_count}
+
+
+def percentile(sorted_values: list, q: float) -> int:
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def profile_file(path, max_tokens: int = DEFAULT_MAX_TOKENS, epochs: int = 8,
+                 price_per_1k: float = DEFAULT_PRICE_PER_1K, workers: int = None,
+                 per_example=None) -> dict:
+    """Validate every line of a JSONL file and summarise its tokens and cost"""
+    path = Path(path)
+    workers = workers or os.cpu_count() or 1
+    ranges = chunk_ranges(path, workers * 4)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            process_chunk,
+            [str(path)] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+            [max_tokens] * len(ranges),
+        ))
+
+    errors = []
+    error_count = 0
+    duplicates = 0
+    first_seen = {}
+    all_tokens = array("I")
+    line_offset = 0
+    per_example_file = open(per_example, "w", encoding="utf-8") if per_example else None
+    try:
+        if per_example_file:
+            per_example_file.write("line,tokens\n")
+        for result in results:
+            error_count += result["error_count"]
+            errors += [(line_offset + i, problem) for i, problem in result["errors"]]
+            for i, (count, digest) in enumerate(zip(result["tokens"], result["digests"]), line_offset + 1):
+                if not digest:
+                    continue
+                if digest in first_seen:
+                    duplicates += 1
+                else:
+                    first_seen[digest] = i
+                if count:
+                    all_tokens.append(count)
+                    if per_example_file:
+                        per_example_file.write(f"{i},{count}\n")
+            line_offset += result["lines"]
+    finally:
+        if per_example_file:
+            per_example_file.close()
+
+    ordered = sorted(all_tokens)
+    total = sum(ordered)
+    return {
+        "lines": line_offset,
+        "examples": len(ordered),
+        "errors": error_count,
+        "error_samples": errors[:MAX_ERRORS],
+        "duplicates": duplicates,
+        "tokens": {
+            "total": total,
+            "min": ordered[0] if ordered else 0,
+            "mean": round(total / len(ordered), 1) if ordered else 0,
+            "p50": percentile(ordered, 0.5),
+            "p90": percentile(ordered, 0.9),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0,
+        },
+        "epochs": epochs,
+        "estimated_cost_usd": round(total * epochs / 1000 * price_per_1k, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate and profile fine-tuning JSONL")
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--price-per-1k", type=float, default=DEFAULT_PRICE_PER_1K,
+                        help="USD per 1K training tokens")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--per-example", type=Path, help="write line,tokens CSV here")
+    args = parser.parse_args()
+
+    report = profile_file(args.path, args.max_tokens, args.epochs, args.price_per_1k,
+                          args.workers, args.per_example)
+    for line, problem in report["error_samples"]:
+        print(f"Line {line}: {problem}")
+    print(json.dumps({k: v for k, v in report.items() if k != "error_samples"}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Approximate nearest-neighbour search for DocumentStore.
+
+IVFFlatIndex partitions normalised embeddings into ``nlist`` clusters with
+spherical k-means and only scans the ``nprobe`` clusters closest to the query.
+Raising ``nprobe`` trades speed for recall; ``nprobe == nlist`` is exact.
+
+The index only holds centroids and row ids; vectors are scored straight from
+the store's EmbeddingMatrix, so it adds no second copy of the embeddings.
+"""
+import json
+import numpy as np
+
+from .quantization import EmbeddingMatrix, normalize
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class IVFFlatIndex:
+    """Inverted-file index over an EmbeddingMatrix, searched by cosine similarity"""
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, niter: int = 10,
+                 train_points_per_list: int = 64, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.niter = niter
+        self.train_points_per_list = train_points_per_list
+        self.seed = seed
+        self.centroids = None
+        # Row ids grouped by cluster: cluster i owns ids[offsets[i]:offsets[i + 1]]
+        self.matrix = None
+        self.ids = None
+        self.offsets = None
+
+    @property
+    def size(self) -> int:
+        return 0 if self.ids is None else len(self.ids)
+
+    def build(self, matrix) -> "IVFFlatIndex":
+        """Cluster the rows of an EmbeddingMatrix (or array) and group their ids by cluster"""
+        if not isinstance(matrix, EmbeddingMatrix):
+            matrix = EmbeddingMatrix.from_array(matrix)
+        n = len(matrix)
+        if n == 0:
+            raise ValueError("Cannot build an index over zero vectors")
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        self.matrix = matrix
+        self.centroids = self._train(matrix, nlist)
+        assignments = self._assign(matrix)
+
+        self.ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        counts = np.bincount(assignments, minlength=nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.nlist = nlist
+        return self
+
+    def _train(self, matrix: EmbeddingMatrix, nlist: int) -> np.ndarray:
+        """Spherical k-means on a sample of the vectors"""
+        rng = np.random.default_rng(self.seed)
+        max_train_points = nlist * self.train_points_per_list
+        if len(matrix) > max_train_points:
+            rows = np.sort(rng.choice(len(matrix), max_train_points, replace=False))
+            sample = normalize(matrix.rows_float32(rows))
+        else:
+            sample = normalize(matrix.to_float32())
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(self.niter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            # Sum each cluster's members via one sorted pass instead of np.add.at
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            sums = np.zeros_like(centroids)
+            nonempty = counts > 0
+            sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+            # Re-seed empty clusters with random points so every list stays useful
+            sums[~nonempty] = sample[rng.choice(len(sample), int((~nonempty).sum()))]
+            centroids = normalize(sums)
+        return centroids
+
+    def _assign(self, matrix: EmbeddingMatrix, batch_size: int = 8192) -> np.ndarray:
+        """Nearest centroid of every vector, in batches to bound memory"""
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), batch_size):
+            batch = matrix.to_float32(start, start + batch_size)
+            assignments[start:start + batch_size] = np.argmax(batch @ self.centroids.T, axis=1)
+        return assignments
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = None) -> tuple:
+        """Return (store positions, cosine similarities) of the k best matches"""
+        if self.centroids is None:
+            raise ValueError("Index has not been built")
+        query = normalize(query)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        probe = top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([self.ids[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        scores = self.matrix.scores_rows(query, rows)
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, path) -> None:
+        """Write centroids and cluster lists; the vectors are saved with the store"""
+        np.savez(
+            path,
+            centroids=self.centroids,
+            ids=self.ids,
+            offsets=self.offsets,
+            params=np.frombuffer(json.dumps({
+                "nlist": self.nlist,
+                "nprobe": self.nprobe,
+                "niter": self.niter,
+                "train_points_per_list": self.train_points_per_list,
+                "seed": self.seed,
+            }).encode(), dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, path, matrix: EmbeddingMatrix) -> "IVFFlatIndex":
+        with np.load(path) as data:
+            index = cls(**json.loads(data["params"].tobytes().decode()))
+            index.centroids = data["centroids"]
+            index.ids = data["ids"]
+            index.offsets = data["offsets"]
+        index.matrix = matrix
+        return index
@@ -0,0 +1,22 @@
+"""Pre-fork deployment: one shared, memory-mapped example store for all workers.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The master builds (or validates) the store in RAG_STORE_DIR before forking,
+so workers only map its files: memory stays flat as workers are added and a
+worker starts without embedding anything. See app/ml/shared_store.py.
+"""
+import os
+
+pythonpath = "app"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Workers read this when they construct their DocumentEnhancer
+os.environ.setdefault('RAG_SHARED_STORE', '1')
+
+
+def on_starting(server):
+    from ml.rag_processor import open_shared_store
+    open_shared_store()
@@ -0,0 +1,5 @@
+"""Tests import the backend's ml package as the app does, from backend/app"""
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app"))
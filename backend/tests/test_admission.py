@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from ml.admission import BULK, INTERACTIVE, AdmissionController, Shed, request_priority
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def hold(controller, priority, entered, release):
+    async with controller.admit(priority):
+        entered.set()
+        await release.wait()
+
+
+def test_request_priority():
+    assert request_priority("Bulk ") == BULK
+    assert request_priority("urgent") == INTERACTIVE
+    assert request_priority(None) == INTERACTIVE
+
+
+def test_sheds_when_slots_and_queue_are_full():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_size=0, max_wait=1)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(controller, INTERACTIVE, entered, release))
+        await entered.wait()
+        with pytest.raises(Shed) as interactive:
+            async with controller.admit(INTERACTIVE):
+                pass
+        with pytest.raises(Shed) as bulk:
+            async with controller.admit(BULK):
+                pass
+        release.set()
+        await holder
+        return interactive.value, bulk.value, controller
+
+    interactive, bulk, controller = run(scenario())
+    assert interactive.status == 503 and interactive.retry_after >= 1
+    assert bulk.status == 429
+    assert controller.running == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_queued_request_times_out():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_size=4, max_wait=0.05)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(controller, INTERACTIVE, entered, release))
+        await entered.wait()
+        with pytest.raises(Shed) as shed:
+            async with controller.admit(INTERACTIVE):
+                pass
+        release.set()
+        await holder
+        return shed.value, controller
+
+    shed, controller = run(scenario())
+    assert shed.status == 503
+    assert controller.queued == {INTERACTIVE: 0, BULK: 0}
+
+
+def test_interactive_request_evicts_queued_bulk():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_size=1, max_wait=5)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(controller, INTERACTIVE, entered, release))
+        await entered.wait()
+        queued_bulk = asyncio.create_task(hold(controller, BULK, asyncio.Event(), asyncio.Event()))
+        await asyncio.sleep(0)
+        interactive_entered = asyncio.Event()
+        interactive = asyncio.create_task(hold(controller, INTERACTIVE, interactive_entered, release))
+        with pytest.raises(Shed) as evicted:
+            await queued_bulk
+        release.set()
+        await asyncio.gather(holder, interactive)
+        return evicted.value, interactive_entered.is_set()
+
+    evicted, interactive_ran = run(scenario())
+    assert evicted.status == 429
+    assert interactive_ran
+
+
+def test_disabled_controller_admits_everything():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=0)
+        async with controller.admit(BULK):
+            async with controller.admit(BULK):
+                return controller.enabled
+
+    assert run(scenario()) is False
@@ -0,0 +1,58 @@
+import pytest
+
+from ml.delta_output import DeltaError, apply_delta, merge, number_lines, parse_delta
+
+WORKSHEET = "Cells\n\n1. What is a cell?\n2. Name an organelle.\n"
+
+
+def test_number_lines_skips_blank_lines():
+    assert number_lines("a\n\nb") == "[1] a\n\n[2] b"
+
+
+def test_parse_delta_normalises_additions():
+    delta = parse_delta('{"headings": [1], "additions": {"2": "  How might  warming change cells? "}}', 3)
+    assert delta["headings"] == {1}
+    assert delta["additions"] == {2: "(How might warming change cells?)"}
+    assert delta["closing_questions"] == []
+
+
+def test_parse_delta_drops_additions_that_fill_blanks():
+    delta = parse_delta('{"additions": {"2": "[blank 1] is the answer", "3": ""}}', 3)
+    assert delta["additions"] == {}
+
+
+@pytest.mark.parametrize("content", [
+    "not json",
+    "[1, 2]",
+    '{"headings": [4]}',
+    '{"headings": [true]}',
+    '{"additions": ["(x)"]}',
+    '{"additions": {"1": 5}}',
+])
+def test_parse_delta_rejects_malformed_replies(content):
+    with pytest.raises(DeltaError):
+        parse_delta(content, 3)
+
+
+def test_merge_applies_headings_additions_and_closing_questions():
+    delta = {"headings": {1, 2}, "additions": {3: "(And in a warmer climate?)"},
+             "closing_questions": ["3. How does climate change affect cells?"]}
+    assert merge(WORKSHEET, delta) == (
+        "**Cells**\n"
+        "\n"
+        "1. What is a cell?\n"
+        "2. Name an organelle. (And in a warmer climate?)\n"
+        "\n"
+        "3. How does climate change affect cells?\n"
+    )
+
+
+def test_merge_without_closing_questions():
+    delta = {"headings": set(), "additions": {}, "closing_questions": ["Why?"]}
+    assert merge(WORKSHEET, delta, closing=False) == WORKSHEET
+
+
+def test_apply_delta_round_trip():
+    merged = apply_delta(WORKSHEET, '{"additions": {"2": "(Is it alive?)"}, "closing_questions": ["Why?"]}')
+    assert merged.splitlines()[2] == "1. What is a cell? (Is it alive?)"
+    assert merged.splitlines()[-1] == "3. Why?"
@@ -0,0 +1,93 @@
+from pathlib import Path
+import random
+import sys
+import time
+
+from openai import OpenAI
+import pytest
+
+from ml.finetune_monitor import FineTuneMonitor, JobStore
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "benchmarks"))
+from mock_openai import FINETUNE_TIMELINE, start_mock_server  # noqa: E402
+
+MESSAGES = [message for _, _, message in FINETUNE_TIMELINE]
+
+
+@pytest.fixture
+def mock_client():
+    servers = []
+
+    def start(finetune_seconds: float) -> OpenAI:
+        server, base_url = start_mock_server(finetune_seconds=finetune_seconds)
+        servers.append(server)
+        return OpenAI(api_key="test", base_url=base_url, max_retries=0)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def create_job(client: OpenAI) -> str:
+    return client.fine_tuning.jobs.create(training_file="file-1", model="gpt-3.5-turbo").id
+
+
+def test_events_are_paged_oldest_first(mock_client, tmp_path):
+    client = mock_client(finetune_seconds=0.1)
+    job_id = create_job(client)
+    time.sleep(0.2)
+
+    monitor = FineTuneMonitor(client, JobStore(tmp_path / "jobs.json"), events_page_size=1)
+    events = monitor._new_events(job_id, None)
+    assert [event.message for event in events] == MESSAGES
+    assert [event.message for event in monitor._new_events(job_id, events[1].id)] == MESSAGES[2:]
+    assert monitor._new_events(job_id, events[-1].id) == []
+
+
+def test_resumes_from_persisted_state(mock_client, tmp_path):
+    client = mock_client(finetune_seconds=0.5)
+    job_id = create_job(client)
+    path = tmp_path / "jobs.json"
+    logs = []
+
+    first = FineTuneMonitor(client, JobStore(path), min_interval=0.05, log=logs.append)
+    first.track(job_id, purpose="test")
+    assert not first.check(job_id)
+
+    # A new process picks the job up from the file and carries on from the last event it saw
+    succeeded = []
+    second = FineTuneMonitor(client, JobStore(path), min_interval=0.05, max_interval=0.2, log=logs.append,
+                             on_success=lambda job_id, job: succeeded.append(job["fine_tuned_model"]))
+    second.track(job_id)
+    second.run()
+
+    assert succeeded == [f"ft:gpt-3.5-turbo:mock::{job_id}"]
+    for message in MESSAGES:
+        assert sum(message in line for line in logs) == 1
+    saved = JobStore(path)
+    assert saved.active() == []
+    assert saved.jobs[job_id]["purpose"] == "test"
+
+
+def test_backs_off_while_quiet_and_on_errors(mock_client, tmp_path, monkeypatch):
+    # Only the first event arrives while the test runs
+    client = mock_client(finetune_seconds=1000)
+    job_id = create_job(client)
+    monkeypatch.setattr(random, "uniform", lambda low, high: 1.0)
+    monitor = FineTuneMonitor(client, JobStore(tmp_path / "jobs.json"), min_interval=1, max_interval=8,
+                              clock=lambda: 0.0, log=lambda message: None)
+
+    monitor.track(job_id)
+    intervals = []
+    for _ in range(5):
+        monitor.check(job_id)
+        intervals.append(monitor.store.jobs[job_id]["interval"])
+    assert intervals == [1, 2, 4, 8, 8]
+    assert monitor.store.jobs[job_id]["status"] == "validating_files"
+    assert monitor.store.jobs[job_id]["next_check"] == 8
+
+    # The API failing (here, an unknown job) backs off the same way
+    monitor.track("ftjob-missing")
+    for _ in range(3):
+        assert not monitor.check("ftjob-missing")
+    assert monitor.store.jobs["ftjob-missing"]["interval"] == 8
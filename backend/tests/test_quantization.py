@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from ml.quantization import DTYPES, EmbeddingMatrix, normalize
+from ml.vector_index import top_k
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_empty_matrix_scores_nothing(dtype):
+    matrix = EmbeddingMatrix(dtype)
+    scores = matrix.scores(np.ones(8, dtype=np.float32))
+    assert scores.shape == (0,)
+    assert top_k(scores, 3).tolist() == []
+
+
+@pytest.mark.parametrize("dtype", DTYPES)
+def test_scores_match_float32(dtype):
+    vectors = np.random.default_rng(0).standard_normal((50, 16)).astype(np.float32)
+    query = vectors[7]
+    matrix = EmbeddingMatrix.from_array(vectors, dtype)
+    expected = normalize(vectors) @ normalize(query)
+    np.testing.assert_allclose(matrix.scores(query), expected, atol=0.02)
+    np.testing.assert_allclose(matrix.scores(query, 10, 20), expected[10:20], atol=0.02)
+    assert top_k(matrix.scores(query), 1).tolist() == [7]
@@ -0,0 +1,53 @@
+import stat
+
+import numpy as np
+
+from ml.embeddings import HashingEmbeddingBackend
+from ml.lexical_index import BM25Index
+from ml.rag_processor import DocumentStore
+from ml.shared_store import MappedTexts, save_array, save_texts
+
+TEXTS = ["Photosynthesis in the chloroplast", "", "Hardy-Weinberg allele frequency", "naïve café — Zellatmung"]
+
+
+def test_save_array_round_trip_is_readable_by_others(tmp_path):
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    save_array(tmp_path / "a.npy", array)
+    np.testing.assert_array_equal(np.load(tmp_path / "a.npy", mmap_mode="r"), array)
+    assert stat.S_IMODE((tmp_path / "a.npy").stat().st_mode) & 0o044 == 0o044
+    assert [p.name for p in tmp_path.iterdir()] == ["a.npy"]
+
+
+def test_mapped_texts_round_trip(tmp_path):
+    save_texts(tmp_path, TEXTS, name="notes")
+    texts = MappedTexts(tmp_path, name="notes")
+    assert MappedTexts.exists(tmp_path, name="notes")
+    assert len(texts) == len(TEXTS)
+    assert list(texts) == TEXTS
+    assert texts[-1] == TEXTS[-1]
+    assert texts[1:3] == TEXTS[1:3]
+
+
+def test_bm25_round_trip(tmp_path):
+    index = BM25Index()
+    index.add(TEXTS)
+    index.save(tmp_path)
+    loaded = BM25Index.load(tmp_path, mmap_mode="r")
+    for query in ["allele frequency", "café", "chloroplast photosynthesis", "absent"]:
+        np.testing.assert_allclose(loaded.scores(query), index.scores(query))
+    # Adding to a loaded index copies its postings back into lists
+    loaded.add(["allele"])
+    assert len(loaded) == len(TEXTS) + 1
+    assert loaded.scores("allele")[-1] > 0
+
+
+def test_document_store_round_trip(tmp_path):
+    store = DocumentStore(embedding_backend=HashingEmbeddingBackend(dim=64))
+    store.add_documents([text for text in TEXTS if text])
+    store.save(tmp_path)
+    assert not (tmp_path / "contents.json").exists()
+    for mmap in (False, True):
+        loaded = DocumentStore(embedding_backend=HashingEmbeddingBackend(dim=64))
+        loaded.load(tmp_path, mmap=mmap)
+        assert list(loaded.contents) == list(store.contents)
+        assert loaded.find_similar("allele frequency", 1) == ["Hardy-Weinberg allele frequency"]
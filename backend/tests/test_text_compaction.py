@@ -0,0 +1,44 @@
+from ml.text_compaction import PAGE_BREAK, CompactedText, compact_text
+
+
+def test_restore_replaces_placeholders_with_original_runs():
+    compacted = CompactedText("Name: [blank 1] Date: [blank 2]", ["__________", ". . . . . . . ."], 10, 5)
+    assert compacted.restore(compacted.text) == "Name: __________ Date: . . . . . . . ."
+    assert compacted.tokens_saved == 5
+
+
+def test_restore_leaves_unknown_placeholders_and_plain_text():
+    compacted = CompactedText("", ["________"], 0, 0)
+    assert compacted.restore("[blank 0] [blank 2] [blank 1]") == "[blank 0] [blank 2] ________"
+    assert CompactedText("", [], 0, 0).restore("[blank 1]") == "[blank 1]"
+
+
+def test_compact_text_round_trips_blanks():
+    text = "1. The powerhouse of the cell is the ______________.\n2. Name: ..................\n"
+    compacted = compact_text(text)
+    assert compacted.text == "1. The powerhouse of the cell is the [blank 1].\n2. Name: [blank 2]\n"
+    assert compacted.restore(compacted.text) == text
+
+
+def test_compact_text_drops_repeated_headers():
+    pages = [f"Biology Worksheet\n{i}. Question {i}\nPage {i} of 3" for i in range(1, 4)]
+    compacted = compact_text(PAGE_BREAK.join(pages))
+    assert compacted.text.count("Biology Worksheet") == 1
+    assert "Page 2 of 3" not in compacted.text
+    for i in range(1, 4):
+        assert f"{i}. Question {i}" in compacted.text
+
+
+def test_rejoins_split_words_without_merging_lines():
+    compacted = compact_text("1. Describe inter-\nnational trade routes.\n2. Next question\n")
+    assert compacted.text == "1. Describe international\ntrade routes.\n2. Next question\n"
+
+
+def test_keeps_hyphen_of_words_hyphenated_elsewhere():
+    text = "A well-known result.\nIt is well-\nknown that\n"
+    assert compact_text(text).text == text
+
+
+def test_keeps_spacing_inside_lines():
+    text = "Name:    Date:\n    a)  12     b)  15\n"
+    assert compact_text(text + "  \n\n\n").text == text
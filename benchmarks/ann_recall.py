@@ -0,0 +1,84 @@
+"""Recall/speed benchmark of the IVF-flat index against exact search.
+
+Uses synthetic clustered embeddings shaped like ada-002 vectors, so no API
+calls are needed:
+
+    python benchmarks/ann_recall.py --size 100000 --nprobe 1 4 8 16 32
+"""
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend" / "app"))
+
+from ml.vector_index import IVFFlatIndex, normalize, top_k  # noqa: E402
+
+
+def synthetic_embeddings(n: int, dim: int, topics: int, noise: float, seed: int) -> np.ndarray:
+    """Vectors scattered around ``topics`` centres, like chunks from a handful of subjects"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(topics, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, n)]
+    vectors += noise * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IVF-flat recall and latency")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.size, args.dim, args.topics, args.noise, seed=0)
+    queries = synthetic_embeddings(args.queries, args.dim, args.topics, args.noise, seed=1)
+
+    start = time.perf_counter()
+    index = IVFFlatIndex(nlist=args.nlist).build(vectors)
+    build_seconds = time.perf_counter() - start
+
+    normalized = normalize(vectors)
+    start = time.perf_counter()
+    exact = [set(top_k(normalized @ normalize(q), args.k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    results = []
+    for nprobe in args.nprobe:
+        hits = 0
+        start = time.perf_counter()
+        for query, truth in zip(queries, exact):
+            ids, _ = index.search(query, args.k, nprobe=nprobe)
+            hits += len(truth & set(ids.tolist()))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "nprobe": nprobe,
+            f"recall_at_{args.k}": hits / (len(queries) * args.k),
+            "ms_per_query": elapsed / len(queries) * 1000,
+            "speedup_vs_exact": exact_ms / (elapsed / len(queries) * 1000),
+        })
+
+    report = {
+        "size": args.size,
+        "dim": args.dim,
+        "nlist": index.nlist,
+        "build_seconds": build_seconds,
+        "exact_ms_per_query": exact_ms,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Cold-start benchmark for the serverless handlers in api/.
+
+Each handler is imported in a fresh interpreter with ``-X importtime`` and then
+served a first OPTIONS preflight and a first POST, the way a freshly started
+function instance would be. Upstream OpenAI calls go to the local mock server.
+The PDF cache is off (no disk tier), so the first download really renders;
+``repeat_post_ms`` is a second, identical POST in the same interpreter, which
+for download is an in-memory cache hit. It is reported but not budgeted.
+
+Usage:
+    python benchmarks/cold_start.py              # print results as JSON
+    python benchmarks/cold_start.py --check      # also fail if over budget
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from fixtures import multipart_body
+from mock_openai import start_mock_server
+
+ROOT = Path(__file__).resolve().parent.parent
+API_DIR = ROOT / "api"
+BUDGET_FILE = Path(__file__).resolve().parent / "cold_start_budget.json"
+SAMPLE_PDF = ROOT / "backend" / "worksheets" / "regular" / "biology" / "bio_allele_frequency_01.pdf"
+
+# Runs inside a fresh interpreter. Kept to the bare minimum of imports so that
+# everything the handler pulls in is attributed to the handler.
+PROBE = r"""
+import sys, time, json
+start = time.perf_counter()
+import {module} as handler_module
+import_done = time.perf_counter()
+
+class Request:
+    def __init__(self, method, headers, body):
+        self.method = method
+        self.headers = headers
+        self.body = body
+
+response = handler_module.handler(Request("OPTIONS", {{}}, b""))
+options_done = time.perf_counter()
+preflight_modules = [m for m in {heavy_modules!r} if m in sys.modules]
+
+with open({body_path!r}, "rb") as f:
+    body = f.read()
+response = handler_module.handler(Request("POST", {{"content-type": {content_type!r}}}, body))
+post_done = time.perf_counter()
+repeat = handler_module.handler(Request("POST", {{"content-type": {content_type!r}}}, body))
+repeat_done = time.perf_counter()
+
+print(json.dumps({{
+    "import_ms": (import_done - start) * 1000,
+    "options_ms": (options_done - import_done) * 1000,
+    "post_ms": (post_done - options_done) * 1000,
+    "repeat_post_ms": (repeat_done - post_done) * 1000,
+    "post_status": response.get("statusCode"),
+    "preflight_modules": preflight_modules,
+}}))
+"""
+
+HEAVY_MODULES = ["openai", "pypdf", "reportlab", "dotenv", "httpx"]
+
+
+def build_request_bodies(work_dir: Path) -> dict:
+    """Write the POST bodies used for the first request of each handler"""
+    enhance_body, enhance_content_type = multipart_body(SAMPLE_PDF.name, SAMPLE_PDF.read_bytes())
+    download_body = json.dumps({
+        "content": "**Allele Frequency**\n\n1. What is an allele? (How might climate change shift allele frequencies?)\n"
+    }).encode()
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    (work_dir / "enhance.body").write_bytes(enhance_body)
+    (work_dir / "download.body").write_bytes(download_body)
+
+    return {
+        "enhance": (work_dir / "enhance.body", enhance_content_type),
+        "download": (work_dir / "download.body", "application/json"),
+    }
+
+
+def parse_importtime(stderr: str, module: str) -> float:
+    """Return the cumulative import time in ms of ``module`` from -X importtime output"""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    return 0.0
+
+
+def probe_handler(module: str, body_path: Path, content_type: str, base_url: str) -> dict:
+    """Cold-start one handler in a fresh interpreter and return its timings"""
+    code = PROBE.format(
+        module=module,
+        heavy_modules=HEAVY_MODULES,
+        body_path=str(body_path),
+        content_type=content_type,
+    )
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "sk-benchmark"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+        # No disk tier persisting between runs: the first download must render
+        "PDF_CACHE_DIR": "",
+    })
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=API_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Probe for {module} failed:\n{result.stderr[-2000:]}")
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["importtime_ms"] = parse_importtime(result.stderr, module)
+    return timings
+
+
+def run(runs: int) -> dict:
+    """Cold-start every handler ``runs`` times and return median timings"""
+    server, base_url = start_mock_server()
+    try:
+        bodies = build_request_bodies(ROOT / "benchmarks" / ".cold_start")
+        results = {}
+        for module, (body_path, content_type) in bodies.items():
+            samples = [probe_handler(module, body_path, content_type, base_url) for _ in range(runs)]
+            results[module] = {
+                key: statistics.median(sample[key] for sample in samples)
+                for key in ("import_ms", "importtime_ms", "options_ms", "post_ms", "repeat_post_ms")
+            }
+            results[module]["post_status"] = samples[-1]["post_status"]
+            results[module]["preflight_modules"] = sorted(
+                {m for sample in samples for m in sample["preflight_modules"]}
+            )
+        return results
+    finally:
+        server.shutdown()
+
+
+def check_budget(results: dict, budget: dict) -> list[str]:
+    """Return a list of budget violations"""
+    failures = []
+    for module, limits in budget.items():
+        measured = results.get(module)
+        if measured is None:
+            failures.append(f"{module}: no measurement")
+            continue
+        for key, limit in limits.items():
+            if key == "forbidden_on_preflight":
+                loaded = sorted(set(measured["preflight_modules"]) & set(limit))
+                if loaded:
+                    failures.append(f"{module}: OPTIONS preflight imported {', '.join(loaded)}")
+            elif measured[key] > limit:
+                failures.append(f"{module}: {key} {measured[key]:.1f} exceeds budget {limit}")
+        if measured["post_status"] != 200:
+            failures.append(f"{module}: first POST returned {measured['post_status']}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start cost of the api/ handlers")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per handler")
+    parser.add_argument("--check", action="store_true", help="Exit non-zero if the budget is exceeded")
+    parser.add_argument("--budget", type=Path, default=BUDGET_FILE)
+    parser.add_argument("--output", type=Path, help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.runs)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.check:
+        failures = check_budget(results, json.loads(args.budget.read_text()))
+        for failure in failures:
+            print(f"BUDGET EXCEEDED: {failure}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""End-to-end benchmark harness for the three server variants.
+
+Every target is started as a subprocess pointed at the local mock OpenAI
+server and driven over HTTP with synthetic worksheets:
+
+    backend           backend/app/main.py (FastAPI + RAG)
+    frontend-main     frontend/api/main.py (FastAPI)
+    frontend-enhance  frontend/api/enhance.py (FastAPI)
+    serverless        api/enhance.py + api/download.py handlers
+
+Each request uploads a worksheet to the enhance endpoint and then renders the
+result through the download endpoint; targets with a combined
+enhance-and-render endpoint are also timed through that ("combined").
+``--mode stages`` instead drives the backend pipeline in-process stage by
+stage (extraction, retrieval, enhancement, PDF generation).
+
+The PDF cache is off in every target (no memory or disk tier), so downloads
+measure rendering. ``--pdf-cache`` turns it on, with a fresh disk tier per run,
+and labels those targets ``<target>+pdf_cache`` so cache hits are never
+compared with renders.
+
+Results are written as JSON (p50/p95/p99 latency, throughput, peak RSS) so runs
+can be compared over time:
+
+    python benchmarks/e2e.py --targets backend serverless --concurrency 4 --requests 40
+    python benchmarks/e2e.py --mode stages --output stages.json
+    python benchmarks/e2e.py --compare old.json new.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from fixtures import ensure_fixtures, multipart_body, FIXTURE_SIZES
+from mock_openai import start_mock_server
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+@dataclass
+class Target:
+    cwd: Path
+    command: list
+    enhance_path: str
+    download_path: str
+    # How the download endpoint expects the enhanced text:
+    # json_string (Body(...) str), json_object ({"content": ...}), raw body or query parameter
+    download_encoding: str
+    # The serverless handlers run one function per port
+    separate_download_port: bool = False
+    # Upload in, PDF out, in one request
+    combined_path: str = None
+
+
+TARGETS = {
+    "backend": Target(
+        cwd=ROOT / "backend",
+        command=[sys.executable, "-m", "uvicorn", "main:app", "--app-dir", "app", "--port", "{port}", "--log-level", "warning"],
+        enhance_path="/api/enhance-document",
+        download_path="/api/download-pdf",
+        download_encoding="json_string",
+        combined_path="/api/enhance-document/pdf",
+    ),
+    "frontend-main": Target(
+        cwd=ROOT / "frontend" / "api",
+        command=[sys.executable, "-m", "uvicorn", "main:app", "--port", "{port}", "--log-level", "warning"],
+        enhance_path="/api/enhance-document",
+        download_path="/api/download-pdf",
+        download_encoding="raw",
+    ),
+    "frontend-enhance": Target(
+        cwd=ROOT / "frontend" / "api",
+        command=[sys.executable, "-m", "uvicorn", "enhance:app", "--port", "{port}", "--log-level", "warning"],
+        enhance_path="/api/enhance-document",
+        download_path="/api/download-pdf",
+        download_encoding="query",
+    ),
+    "serverless": Target(
+        cwd=ROOT / "api",
+        command=[sys.executable, str(Path(__file__).resolve().parent / "serve_handlers.py"),
+                 "--enhance-port", "{port}", "--download-port", "{download_port}"],
+        enhance_path="/api/enhance",
+        download_path="/api/download",
+        download_encoding="json_object",
+        separate_download_port=True,
+    ),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+def peak_rss_mb(pid: int = None) -> float:
+    """Peak resident set size in MB of a process (Linux) or of this process"""
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+        return None
+    # ru_maxrss is KB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Linear-interpolated percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "p50_ms": percentile(values, 50) * 1000 if values else None,
+        "p95_ms": percentile(values, 95) * 1000 if values else None,
+        "p99_ms": percentile(values, 99) * 1000 if values else None,
+        "mean_ms": sum(values) / len(values) * 1000 if values else None,
+        "throughput_rps": len(values) / elapsed if elapsed > 0 else None,
+    }
+
+
+def encode_download(content: str, encoding: str, url: str) -> tuple:
+    """Return (url, body, content type) for a download-pdf request"""
+    if encoding == "json_string":
+        return url, json.dumps(content).encode(), "application/json"
+    if encoding == "json_object":
+        return url, json.dumps({"content": content}).encode(), "application/json"
+    if encoding == "raw":
+        return url, content.encode(), "text/plain"
+    if encoding == "query":
+        return f"{url}?{urllib.parse.urlencode({'content': content})}", b"", "application/x-www-form-urlencoded"
+    raise ValueError(f"Unknown download encoding {encoding}")
+
+
+def post(url: str, body: bytes, content_type: str, timeout: float) -> bytes:
+    request = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def run_http_target(name: str, target: Target, fixtures: dict, args, base_url: str) -> list:
+    """Start one server variant and benchmark it against every fixture"""
+    port = free_port()
+    download_port = free_port() if target.separate_download_port else port
+    command = [part.format(port=port, download_port=download_port) for part in target.command]
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "sk-benchmark"))
+    if args.pdf_cache:
+        cache_dir = tempfile.mkdtemp(prefix="e2e-pdf-cache-")
+        env.update(PDF_CACHE_DIR=cache_dir, PDF_CACHE_ENTRIES="64")
+        name = f"{name}+pdf_cache"
+    else:
+        cache_dir = None
+        env.update(PDF_CACHE_DIR="", PDF_CACHE_ENTRIES="0")
+
+    process = subprocess.Popen(command, cwd=target.cwd, env=env)
+    results = []
+    try:
+        wait_for_port(port, process)
+        if download_port != port:
+            wait_for_port(download_port, process)
+
+        enhance_url = f"http://127.0.0.1:{port}{target.enhance_path}"
+        download_url = f"http://127.0.0.1:{download_port}{target.download_path}"
+        combined_url = f"http://127.0.0.1:{port}{target.combined_path}" if target.combined_path else None
+        operations = ("enhance", "download", "end_to_end") + (("combined",) if combined_url else ())
+
+        for fixture_name, pdf_path in fixtures.items():
+            body, content_type = multipart_body(pdf_path.name, pdf_path.read_bytes())
+
+            def one_request(_):
+                timings = {}
+                start = time.perf_counter()
+                enhanced = json.loads(post(enhance_url, body, content_type, args.timeout))["enhanced_content"]
+                timings["enhance"] = time.perf_counter() - start
+
+                url, download_body, download_type = encode_download(enhanced, target.download_encoding, download_url)
+                download_start = time.perf_counter()
+                post(url, download_body, download_type, args.timeout)
+                timings["download"] = time.perf_counter() - download_start
+                timings["end_to_end"] = time.perf_counter() - start
+
+                if combined_url:
+                    combined_start = time.perf_counter()
+                    post(combined_url, body, content_type, args.timeout)
+                    timings["combined"] = time.perf_counter() - combined_start
+                return timings
+
+            fixture_results = drive(name, fixture_name, one_request, args, operations)
+            for result in fixture_results:
+                result["peak_rss_mb"] = peak_rss_mb(process.pid)
+            results.extend(fixture_results)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def drive(target_name: str, fixture_name: str, request_fn, args, operations=("enhance", "download", "end_to_end")) -> list:
+    """Run warm-up plus ``args.requests`` calls of request_fn at ``args.concurrency``"""
+    for i in range(args.warmup):
+        try:
+            request_fn(i)
+        except Exception as e:
+            print(f"{target_name}/{fixture_name}: warm-up failed: {e}", file=sys.stderr)
+
+    latencies = {operation: [] for operation in operations}
+    errors = 0
+
+    def guarded(i):
+        try:
+            return request_fn(i)
+        except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+            print(f"{target_name}/{fixture_name}: request failed: {e}", file=sys.stderr)
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for timings in pool.map(guarded, range(args.requests)):
+            if timings is None:
+                errors += 1
+                continue
+            for operation, value in timings.items():
+                latencies[operation].append(value)
+    elapsed = time.perf_counter() - start
+
+    return [
+        {"target": target_name, "fixture": fixture_name, "operation": operation,
+         "concurrency": args.concurrency, **summarize(values, errors, elapsed)}
+        for operation, values in latencies.items()
+    ]
+
+
+def run_stages(fixtures: dict, args) -> list:
+    """Drive the backend pipeline in-process, one stage at a time"""
+    backend_dir = ROOT / "backend"
+    sys.path.insert(0, str(backend_dir / "app"))
+    os.chdir(backend_dir)
+
+    import main as backend_main
+    from pypdf import PdfReader
+    import io
+
+    enhancer = backend_main.document_enhancer
+    results = []
+    for fixture_name, pdf_path in fixtures.items():
+        pdf_bytes = pdf_path.read_bytes()
+
+        def extract():
+            reader = PdfReader(io.BytesIO(pdf_bytes))
+            return "".join(page.extract_text() + "\n" for page in reader.pages)
+
+        text = extract()
+        enhanced = enhancer.enhance_document(text)
+        stages = {
+            "extract": extract,
+            "retrieve": lambda: enhancer.doc_store.find_similar(text),
+            "enhance": lambda: enhancer.enhance_document(text),
+            "render_pdf": lambda: backend_main.create_pdf(enhanced),
+        }
+        for stage, fn in stages.items():
+            def timed(_, fn=fn, stage=stage):
+                start = time.perf_counter()
+                fn()
+                return {stage: time.perf_counter() - start}
+
+            stage_results = drive("stages", fixture_name, timed, args, operations=(stage,))
+            for result in stage_results:
+                result["peak_rss_mb"] = peak_rss_mb()
+            results.extend(stage_results)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_path: Path, new_path: Path):
+    """Print the relative change of each metric between two result files"""
+    def index(path):
+        data = json.loads(path.read_text())
+        return {(r["target"], r["fixture"], r["operation"]): r for r in data["results"]}
+
+    old, new = index(old_path), index(new_path)
+    for key in sorted(set(old) & set(new)):
+        changes = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"):
+            before, after = old[key].get(metric), new[key].get(metric)
+            if before and after is not None:
+                changes.append(f"{metric} {before:.1f} -> {after:.1f} ({(after - before) / before * 100:+.1f}%)")
+        print(f"{'/'.join(key)}: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks against a mock OpenAI server")
+    parser.add_argument("--mode", choices=["http", "stages"], default="http")
+    parser.add_argument("--targets", nargs="+", choices=sorted(TARGETS), default=sorted(TARGETS))
+    parser.add_argument("--fixtures", nargs="+", choices=sorted(FIXTURE_SIZES), default=list(FIXTURE_SIZES))
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="Measured requests per target and fixture")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock time to first token, seconds")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Mock completion tokens per second")
+    parser.add_argument("--pdf-cache", action="store_true",
+                        help="Keep the PDF cache on (results labelled <target>+pdf_cache)")
+    parser.add_argument("--output", type=Path, help="Result file (default: benchmarks/results/<mode>-<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    all_fixtures = ensure_fixtures()
+    fixtures = {name: all_fixtures[name] for name in args.fixtures}
+    server, base_url = start_mock_server(latency=args.latency, token_rate=args.token_rate)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+    try:
+        if args.mode == "stages":
+            results = run_stages(fixtures, args)
+        else:
+            results = []
+            for name in args.targets:
+                results.extend(run_http_target(name, TARGETS[name], fixtures, args, base_url))
+    finally:
+        server.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "mode": args.mode,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "mock_latency_s": args.latency,
+                "mock_token_rate": args.token_rate,
+                "pdf_cache": args.pdf_cache,
+                "fixtures": {name: FIXTURE_SIZES[name] for name in fixtures},
+            },
+        },
+        "results": results,
+    }
+
+    output = args.output or RESULTS_DIR / f"{args.mode}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(json.dumps(results, indent=2))
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Synthetic worksheet fixtures for the benchmarks.
+
+Worksheets are generated deterministically so results stay comparable across
+runs and machines without committing large binaries.
+"""
+from pathlib import Path
+import random
+
+FIXTURE_DIR = Path(__file__).resolve().parent / ".fixtures"
+
+# name -> number of questions; roughly 1, 10 and 50 pages once rendered
+FIXTURE_SIZES = {
+    "small": 12,
+    "medium": 120,
+    "large": 600,
+}
+
+TOPICS = [
+    "allele frequency", "Hardy-Weinberg equilibrium", "natural selection", "chloroplast structure",
+    "photosynthesis", "cellular respiration", "mitochondria", "enzyme activity", "osmosis",
+    "population growth", "carrying capacity", "food webs", "nitrogen cycle", "mutation rates",
+]
+
+STEMS = [
+    "Explain how {topic} relates to the data in the table above.",
+    "What would happen to {topic} if the population size doubled?",
+    "Draw and label a diagram showing {topic}.",
+    "Calculate the expected change in {topic} after five generations. ____________",
+    "Compare {topic} in two different ecosystems. ____________________",
+    "Describe one experiment that could be used to measure {topic}.",
+]
+
+
+def make_worksheet_text(questions: int, seed: int = 0) -> str:
+    """Build worksheet text in the format the enhancer and renderer expect"""
+    rng = random.Random(seed)
+    lines = ["**Biology Worksheet**", "", "Name: ____________________  Date: __________", ""]
+    for i in range(1, questions + 1):
+        if i % 10 == 1:
+            lines.append(f"**Part {i // 10 + 1}: {rng.choice(TOPICS).title()}**")
+            lines.append("")
+        lines.append(f"{i}. " + rng.choice(STEMS).format(topic=rng.choice(TOPICS)))
+        lines.append("")
+    lines.append("https://www.example.org/biology/resources")
+    return "\n".join(lines)
+
+
+def make_worksheet_pdf(path: Path, questions: int, seed: int = 0) -> Path:
+    """Render a synthetic worksheet to a text-extractable PDF"""
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import letter
+
+    c = canvas.Canvas(str(path), pagesize=letter)
+    width, height = letter
+    y = height - 40
+    for line in make_worksheet_text(questions, seed).split("\n"):
+        if y < 40:
+            c.showPage()
+            y = height - 40
+        c.setFont("Helvetica-Bold" if line.startswith("**") else "Helvetica", 12)
+        c.drawString(40, y, line.replace("**", ""))
+        y -= 15
+    c.save()
+    return path
+
+
+def ensure_fixtures(directory: Path = FIXTURE_DIR, sizes: dict = FIXTURE_SIZES) -> dict:
+    """Generate any missing fixture PDFs and return {name: path}"""
+    directory.mkdir(parents=True, exist_ok=True)
+    fixtures = {}
+    for seed, (name, questions) in enumerate(sizes.items()):
+        path = directory / f"worksheet_{name}.pdf"
+        if not path.exists():
+            make_worksheet_pdf(path, questions, seed)
+        fixtures[name] = path
+    return fixtures
+
+
+def multipart_body(filename: str, data: bytes, boundary: str = "benchmarkboundary") -> tuple:
+    """Encode a single file upload as multipart/form-data; returns (body, content type)"""
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
@@ -0,0 +1,322 @@
+"""Minimal local stand-in for the OpenAI API used by the benchmarks.
+
+Serves /v1/chat/completions (plain, streamed and JSON mode, as used by delta
+output) and /v1/embeddings with canned, deterministic responses so handlers
+can be exercised without network access or an API key. ``latency`` simulates time to first token and
+``token_rate`` the generation speed in tokens per second.
+
+/v1/files and /v1/fine_tuning/jobs (with events) simulate fine-tuning: uploads
+are processed after a moment and jobs succeed ``finetune_seconds`` after
+creation, emitting events along the way. Events are paged newest first with
+``limit`` and ``after`` like the real API.
+
+Run standalone with:
+    python benchmarks/mock_openai.py --port 8765 --latency 0.5 --token-rate 80
+then point a handler at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Rough characters-per-token ratio for English text
+CHARS_PER_TOKEN = 4
+
+# Shortest pause between writes of a paced stream; chunks due meanwhile are sent together
+STREAM_INTERVAL = 0.01
+
+
+def fake_embedding(text: str) -> list[float]:
+    """Deterministic pseudo-embedding so identical inputs map to identical vectors"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1.0, 1.0) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+def fake_enhancement(messages: list[dict]) -> str:
+    """Echo the last user message with a climate extension after each numbered line"""
+    text = messages[-1]["content"] if messages else ""
+    lines = []
+    for line in text.split("\n"):
+        if line.strip() and line.strip()[0].isdigit() and ". " in line:
+            line += " (How might climate change affect this?)"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def fake_delta(messages: list[dict]) -> str:
+    """fake_enhancement() as a delta-mode JSON reply, for a worksheet with [n]-numbered lines"""
+    text = messages[-1]["content"] if messages else ""
+    additions = {}
+    for line in text.split("\n"):
+        number, _, rest = line.partition("] ")
+        if number.startswith("[") and rest.strip()[:1].isdigit() and ". " in rest:
+            additions[number[1:]] = "(How might climate change affect this?)"
+    return json.dumps({
+        "headings": [],
+        "additions": additions,
+        "closing_questions": ["How might climate change affect the topics above?"],
+    })
+
+
+# (fraction of finetune_seconds, status from then on, event message)
+FINETUNE_TIMELINE = [
+    (0.0, "validating_files", "Validating training file"),
+    (0.1, "running", "Fine-tuning job started"),
+    (0.5, "running", "Step 50/100: training loss=0.42"),
+    (1.0, "succeeded", "The job has successfully completed"),
+]
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real API, so client connection pooling shows up in benchmarks
+    protocol_version = "HTTP/1.1"
+
+    # Set by start_mock_server
+    latency = 0.0
+    token_rate = 0.0
+    finetune_seconds = 2.0
+    # Shared state for the fine-tuning endpoints: id -> created timestamp
+    files = {}
+    jobs = {}
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_completion(self, content: str, model: str, usage: dict):
+        """Send the completion as server-sent events, one token-sized chunk at a time"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # No Content-Length, so the end of the stream is marked by closing the connection
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def event(delta: dict, finish_reason=None, chunk_usage=None) -> bytes:
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        # Content chunks are the template with the content filled in: the mock shares the
+        # CPU with the server being measured, so it should spend as little as it can
+        prefix, suffix = event({"content": ""}).split(b'"content": ""', 1)
+        prefix += b'"content": '
+
+        try:
+            self.wfile.write(event({"role": "assistant", "content": ""}))
+            start = time.perf_counter()
+            chunks = range(0, len(content), CHARS_PER_TOKEN)
+            sent = 0
+            while sent < len(chunks):
+                due = len(chunks)
+                if self.token_rate:
+                    # Paced against the start, so oversleeping doesn't accumulate over the stream;
+                    # woken at most every STREAM_INTERVAL so fast rates don't thrash the GIL
+                    wake = min(max(start + (sent + 1) / self.token_rate, time.perf_counter() + STREAM_INTERVAL),
+                               start + len(chunks) / self.token_rate)
+                    time.sleep(max(wake - time.perf_counter(), 0))
+                    due = min(max(int((time.perf_counter() - start) * self.token_rate), sent + 1), len(chunks))
+                # Chunks that are due together go out in one write, as TCP would coalesce them
+                self.wfile.write(b"".join(
+                    prefix + json.dumps(content[i:i + CHARS_PER_TOKEN]).encode() + suffix
+                    for i in chunks[sent:due]
+                ))
+                sent = due
+            self.wfile.write(event({}, finish_reason="stop", chunk_usage=usage) + b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream
+            pass
+
+    def _job_state(self, job_id: str) -> tuple:
+        """(job object, events newest first) as of now"""
+        created = self.jobs[job_id]
+        elapsed = time.time() - created
+        events = []
+        status = "validating_files"
+        for i, (at, event_status, message) in enumerate(FINETUNE_TIMELINE):
+            if elapsed >= at * self.finetune_seconds:
+                status = event_status
+                events.append({
+                    "object": "fine_tuning.job.event",
+                    "id": f"ftevent-{job_id}-{i}",
+                    "created_at": int(created + at * self.finetune_seconds),
+                    "level": "info",
+                    "message": message,
+                    "data": {},
+                    "type": "message",
+                })
+        job = {
+            "object": "fine_tuning.job",
+            "id": job_id,
+            "model": "gpt-3.5-turbo",
+            "created_at": int(created),
+            "finished_at": int(created + self.finetune_seconds) if status == "succeeded" else None,
+            "fine_tuned_model": f"ft:gpt-3.5-turbo:mock::{job_id}" if status == "succeeded" else None,
+            "organization_id": "org-mock",
+            "result_files": [],
+            "status": status,
+            "validation_file": None,
+            "training_file": "file-mock",
+            "hyperparameters": {"n_epochs": 8},
+            "trained_tokens": None,
+            "error": None,
+        }
+        return job, events[::-1]
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        parts = path.split("/")
+        if "/files/" in path and parts[-1] in self.files:
+            processed = time.time() - self.files[parts[-1]] >= 0.1 * self.finetune_seconds
+            self._send_json(200, {
+                "object": "file", "id": parts[-1], "bytes": 0, "created_at": int(self.files[parts[-1]]),
+                "filename": "training_data.jsonl", "purpose": "fine-tune",
+                "status": "processed" if processed else "uploaded",
+            })
+        elif path.endswith("/events") and parts[-2] in self.jobs:
+            _, events = self._job_state(parts[-2])
+            query = parse_qs(urlsplit(self.path).query)
+            limit = int(query.get("limit", ["20"])[0])
+            after = query.get("after", [None])[0]
+            ids = [event["id"] for event in events]
+            if after in ids:
+                events = events[ids.index(after) + 1:]
+            self._send_json(200, {"object": "list", "data": events[:limit], "has_more": len(events) > limit})
+        elif "/fine_tuning/jobs/" in path and parts[-1] in self.jobs:
+            job, _ = self._job_state(parts[-1])
+            self._send_json(200, job)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(content_length)
+
+        if self.path.endswith("/files"):
+            # Multipart upload; the contents don't matter here
+            file_id = f"file-{len(self.files) + 1}"
+            self.files[file_id] = time.time()
+            self._send_json(200, {
+                "object": "file", "id": file_id, "bytes": len(body), "created_at": int(time.time()),
+                "filename": "training_data.jsonl", "purpose": "fine-tune", "status": "uploaded",
+            })
+            return
+        if self.path.endswith("/fine_tuning/jobs"):
+            job_id = f"ftjob-{len(self.jobs) + 1}"
+            self.jobs[job_id] = time.time()
+            job, _ = self._job_state(job_id)
+            self._send_json(200, job)
+            return
+
+        request = json.loads(body or b"{}")
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.path.endswith("/chat/completions"):
+            if (request.get("response_format") or {}).get("type") == "json_object":
+                content = fake_delta(request.get("messages", []))
+            else:
+                content = fake_enhancement(request.get("messages", []))
+            prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // CHARS_PER_TOKEN
+            completion_tokens = len(content) // CHARS_PER_TOKEN
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            model = request.get("model", "gpt-3.5-turbo")
+            if request.get("stream"):
+                self._stream_completion(content, model, usage)
+                return
+            if self.token_rate:
+                time.sleep(completion_tokens / self.token_rate)
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+        elif self.path.endswith("/embeddings"):
+            inputs = request.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            tokens = sum(len(text) for text in inputs) // CHARS_PER_TOKEN
+            self._send_json(200, {
+                "object": "list",
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(text)}
+                    for i, text in enumerate(inputs)
+                ],
+                "model": request.get("model", "text-embedding-ada-002"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, token_rate: float = 0.0,
+                      finetune_seconds: float = 2.0):
+    """Start the mock server in a background thread and return (server, base_url)"""
+    handler = type(
+        "ConfiguredMockOpenAIHandler",
+        (MockOpenAIHandler,),
+        {"latency": latency, "token_rate": token_rate, "finetune_seconds": finetune_seconds,
+         "files": {}, "jobs": {}},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}/v1"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each response")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="Completion tokens per second (0 = instant)")
+    parser.add_argument("--finetune-seconds", type=float, default=2.0, help="How long mock fine-tuning jobs take")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.host, args.port, args.latency, args.token_rate, args.finetune_seconds)
+    print(f"Mock OpenAI API listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Wall-clock PDF text extraction, serial against page ranges in parallel workers.
+
+Generates a synthetic worksheet of about --pages pages, then times
+ml.pdf_extraction.extract_pdf_text with each worker count (1 = serial, in
+process) and checks every run returns exactly the serial text:
+
+    python benchmarks/pdf_extraction.py --pages 400 --workers 1 2 4 8
+
+Each pool is warmed up before timing, as it stays up in a running server.
+"""
+from pathlib import Path
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend" / "app"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fixtures import FIXTURE_DIR, make_worksheet_pdf  # noqa: E402
+from ml import pdf_extraction  # noqa: E402
+from pypdf import PdfReader  # noqa: E402
+
+# make_worksheet_pdf fits about this many questions on a page
+QUESTIONS_PER_PAGE = 22
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel PDF text extraction")
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    FIXTURE_DIR.mkdir(parents=True, exist_ok=True)
+    path = FIXTURE_DIR / f"worksheet_{args.pages}_pages.pdf"
+    if not path.exists():
+        make_worksheet_pdf(path, args.pages * QUESTIONS_PER_PAGE)
+    data = path.read_bytes()
+
+    expected = pdf_extraction.extract_pdf_text(data, workers=1)
+    results = []
+    for workers in args.workers:
+        # Warm up: start the pool and fault in pypdf in every worker
+        pdf_extraction.extract_pdf_text(data, workers=workers, min_pages=1)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            text = pdf_extraction.extract_pdf_text(data, workers=workers, min_pages=1)
+            timings.append(time.perf_counter() - start)
+            if text != expected:
+                raise SystemExit(f"Text extracted with {workers} workers differs from serial extraction")
+        results.append({"workers": workers, "median_s": statistics.median(timings), "min_s": min(timings)})
+
+    serial = next((r["median_s"] for r in results if r["workers"] == 1), None)
+    for result in results:
+        result["speedup"] = serial / result["median_s"] if serial else None
+
+    report = {
+        "pages": len(PdfReader(io.BytesIO(data)).pages),
+        "pdf_mb": len(data) / (1024 * 1024),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Memory and recall of float16/int8 embedding storage against float32.
+
+Also reports what the same embeddings cost as the Python lists DocumentStore
+used to keep, for reference:
+
+    python benchmarks/quantization.py --size 20000 --k 3
+"""
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend" / "app"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from ann_recall import synthetic_embeddings  # noqa: E402
+from ml.quantization import DTYPES, EmbeddingMatrix  # noqa: E402
+from ml.vector_index import top_k  # noqa: E402
+
+
+def python_list_bytes(dim: int) -> int:
+    """Bytes for one embedding held as a list of boxed floats"""
+    vector = [float(i) + 0.5 for i in range(dim)]
+    return sys.getsizeof(vector) + sum(sys.getsizeof(x) for x in vector)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized embedding storage")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    vectors = synthetic_embeddings(args.size, args.dim, args.topics, args.noise, seed=0)
+    queries = synthetic_embeddings(args.queries, args.dim, args.topics, args.noise, seed=1)
+
+    matrices = {dtype: EmbeddingMatrix.from_array(vectors, dtype) for dtype in DTYPES}
+    truth = [set(top_k(matrices["float32"].scores(q), args.k).tolist()) for q in queries]
+
+    list_bytes = python_list_bytes(args.dim) * args.size
+    results = []
+    for dtype, matrix in matrices.items():
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, truth):
+            hits += len(expected & set(top_k(matrix.scores(query), args.k).tolist()))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "dtype": dtype,
+            "bytes_per_vector": matrix.nbytes / args.size,
+            "total_mb": matrix.nbytes / (1024 * 1024),
+            "reduction_vs_float32": matrices["float32"].nbytes / matrix.nbytes,
+            "reduction_vs_python_lists": list_bytes / matrix.nbytes,
+            f"recall_at_{args.k}": hits / (len(queries) * args.k),
+            "ms_per_query": elapsed / len(queries) * 1000,
+        })
+
+    report = {
+        "size": args.size,
+        "dim": args.dim,
+        "python_list_bytes_per_vector": list_bytes / args.size,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
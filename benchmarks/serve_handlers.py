@@ -0,0 +1,37 @@
+"""Serve the api/ serverless handlers over plain HTTP for benchmarking.
+
+Each handler's ``Handler`` class is mounted on its own port, the way each
+file becomes its own function on Vercel. Run from the api/ directory.
+"""
+from http.server import ThreadingHTTPServer
+import argparse
+import importlib
+import sys
+import threading
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve api/ handlers locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--enhance-port", type=int, required=True)
+    parser.add_argument("--download-port", type=int, required=True)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ".")
+    servers = []
+    for module_name, port in (("enhance", args.enhance_port), ("download", args.download_port)):
+        module = importlib.import_module(module_name)
+        server = ThreadingHTTPServer((args.host, port), module.Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        print(f"Serving {module_name} on http://{args.host}:{port}", flush=True)
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
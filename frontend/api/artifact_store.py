@@ -0,0 +1,168 @@
+"""Server-side store of enhanced worksheets, so downloads can refer to them by id.
+
+The enhance endpoint saves its result and returns the id; downloads then
+ask for ``GET /api/documents/{id}.pdf`` instead of posting the whole
+worksheet (JSON-escaped) back. Ids are derived from the content, so saving
+the same result twice returns the same id and a repeat download also hits
+the PDF cache.
+
+ARTIFACT_STORE picks the backend:
+
+    sqlite:PATH            one SQLite file (default: artifacts.db under the temp dir)
+    file:DIRECTORY         one file per artifact
+    package.module:Class   any ArtifactStore subclass, e.g. for object storage,
+                           constructed with no arguments
+
+Artifacts expire ARTIFACT_TTL_SECONDS (default 7 days) after they were last
+saved; get() ignores expired ones and they are pruned now and then.
+"""
+from pathlib import Path
+import hashlib
+import importlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from metrics import record_cache
+
+# Prune expired artifacts once every this many writes rather than on each one
+PRUNE_EVERY = 64
+
+ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def artifact_id(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def ttl_seconds() -> float:
+    return float(os.getenv('ARTIFACT_TTL_SECONDS', str(7 * 24 * 3600)))
+
+
+class ArtifactStore:
+    """Base class: subclasses implement _write, _read and prune"""
+
+    def __init__(self):
+        self._writes = 0
+
+    def put(self, content: str, metadata: dict = None) -> str:
+        """Save content and return its id"""
+        key = artifact_id(content)
+        self._write(key, content, metadata or {}, time.time())
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self.prune()
+        return key
+
+    def get(self, key: str) -> tuple:
+        """(content, metadata) for an id, or None if unknown or expired"""
+        found = self._read(key) if ID_PATTERN.fullmatch(key or "") else None
+        if found is not None and found[2] < time.time() - ttl_seconds():
+            found = None
+        record_cache("artifact", found is not None)
+        return found[:2] if found is not None else None
+
+    def _write(self, key: str, content: str, metadata: dict, saved_at: float):
+        raise NotImplementedError
+
+    def _read(self, key: str) -> tuple:
+        """(content, metadata, saved_at), or None"""
+        raise NotImplementedError
+
+    def prune(self):
+        """Delete expired artifacts"""
+        raise NotImplementedError
+
+
+class SQLiteArtifactStore(ArtifactStore):
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        # One connection per thread, opened on first use (so after any fork)
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(path, timeout=10)
+        try:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS artifacts "
+                    "(id TEXT PRIMARY KEY, content TEXT NOT NULL, metadata TEXT NOT NULL, saved_at REAL NOT NULL)"
+                )
+        finally:
+            db.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=10)
+            # Readers don't wait on writers
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _write(self, key: str, content: str, metadata: dict, saved_at: float):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO artifacts VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET metadata = excluded.metadata, saved_at = excluded.saved_at",
+                (key, content, json.dumps(metadata), saved_at),
+            )
+
+    def _read(self, key: str) -> tuple:
+        row = self._connect().execute(
+            "SELECT content, metadata, saved_at FROM artifacts WHERE id = ?", (key,)
+        ).fetchone()
+        return (row[0], json.loads(row[1]), row[2]) if row else None
+
+    def prune(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM artifacts WHERE saved_at < ?", (time.time() - ttl_seconds(),))
+
+
+class FileArtifactStore(ArtifactStore):
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _write(self, key: str, content: str, metadata: dict, saved_at: float):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"content": content, "metadata": metadata, "saved_at": saved_at}, f)
+        os.replace(tmp_path, path)
+
+    def _read(self, key: str) -> tuple:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record["content"], record["metadata"], record["saved_at"]
+
+    def prune(self):
+        cutoff = time.time() - ttl_seconds()
+        for path in self.directory.glob("*/*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+def make_artifact_store(spec: str = None) -> ArtifactStore:
+    """Build the store described by spec (default ARTIFACT_STORE); see the module docstring"""
+    spec = spec or os.getenv('ARTIFACT_STORE', '')
+    if not spec or spec.startswith("sqlite:"):
+        path = spec[len("sqlite:"):] or os.path.join(tempfile.gettempdir(), "worksheet-artifacts", "artifacts.db")
+        return SQLiteArtifactStore(path)
+    if spec.startswith("file:"):
+        return FileArtifactStore(spec[len("file:"):])
+    module_name, _, class_name = spec.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,131 @@
+"""Request deadlines, propagated to every upstream call, and cancellation on disconnect.
+
+A request's budget comes from its X-Request-Timeout header (seconds), capped
+at MAX_REQUEST_TIMEOUT_SECONDS, or REQUEST_TIMEOUT_SECONDS (default 120)
+when absent. deadline_scope() makes it the current deadline for everything
+the request runs, threads started with asyncio.to_thread included:
+
+    with deadline_scope(Deadline.from_header(request.headers.get(DEADLINE_HEADER))):
+        ...
+        client.chat.completions.create(..., **timeout_kwargs())
+
+check_deadline() stops CPU-bound work (e.g. between PDF pages) and
+timeout_kwargs() bounds OpenAI calls by what is left. run_cancellable()
+cancels async work when the client disconnects (wait_for_disconnect()) or
+the deadline passes; cancelling an httpx request closes its connection, so
+the upstream stops generating (and billing) tokens.
+
+Stdlib only, and asyncio is imported on use, to keep cold starts cheap.
+"""
+from contextlib import contextmanager
+import contextvars
+import os
+import time
+
+from metrics import record_cancellation
+
+DEADLINE_HEADER = "X-Request-Timeout"
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value: str = None) -> "Deadline":
+        """Deadline from a timeout header value, falling back to the configured default"""
+        default = float(os.getenv('REQUEST_TIMEOUT_SECONDS', '120'))
+        maximum = float(os.getenv('MAX_REQUEST_TIMEOUT_SECONDS', '300'))
+        try:
+            seconds = float(value) if value else default
+        except ValueError:
+            seconds = default
+        if not seconds > 0:
+            seconds = default
+        return cls(min(seconds, maximum))
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str = None):
+        if self.expired:
+            where = f" during {stage}" if stage else ""
+            raise DeadlineExceeded(f"Request deadline of {self.seconds:g}s exceeded{where}")
+
+
+_current = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    """Make deadline the current one for this context (and tasks and threads started from it)"""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def current_deadline() -> Deadline:
+    return _current.get()
+
+
+def check_deadline(stage: str = None):
+    """Raise DeadlineExceeded if the current request is out of time; no-op outside a request"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def timeout_kwargs() -> dict:
+    """``timeout=`` for an OpenAI call, bounded by the current deadline ({} outside a request)"""
+    deadline = _current.get()
+    if deadline is None:
+        return {}
+    deadline.check()
+    return {"timeout": deadline.remaining()}
+
+
+async def wait_for_disconnect(receive):
+    """Complete once an ASGI receive channel reports the client gone; only call it after the body is read"""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def run_cancellable(coro, disconnected=None, deadline: Deadline = None):
+    """Await coro, cancelling it if the disconnected awaitable completes first or the deadline passes"""
+    import asyncio
+
+    deadline = deadline or _current.get()
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(disconnected) if disconnected is not None else None
+    try:
+        timeout = max(deadline.remaining(), 0) if deadline is not None else None
+        done, _ = await asyncio.wait({task, watcher} - {None}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        if watcher in done:
+            record_cancellation("disconnect")
+            raise ClientDisconnected("Client disconnected")
+        record_cancellation("deadline")
+        raise DeadlineExceeded(f"Request deadline of {deadline.seconds:g}s exceeded")
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # Let the task unwind (closing upstream connections) before returning
+            await asyncio.gather(task, return_exceptions=True)
@@ -1,10 +1,21 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
+from starlette.routing import Match
 import json
 import io
+import time
 from pypdf import PdfReader
 from rag_processor import DocumentEnhancer
+from metrics import registry, track_stage, record_request
+from profiling import request_profiler, profiled, PROFILE_ID_HEADER
+from admission import AdmissionController, Shed, PRIORITY_HEADER, request_priority
+from deadlines import (
+    DEADLINE_HEADER, Deadline, DeadlineExceeded, ClientDisconnected, deadline_scope, check_deadline, run_cancellable,
+    wait_for_disconnect
+)
+from text_compaction import PAGE_BREAK
+import asyncio
 import logging
 from dotenv import load_dotenv
 from reportlab.pdfgen import canvas
@@ -22,7 +33,24 @@ logger = logging.getLogger(__name__)
 # Initialize FastAPI app
 app = FastAPI()
 
-# Add CORS middleware
+# Enhancement requests go through admission control; see admission.py
+admission = AdmissionController()
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Bound concurrent enhancements, queueing briefly and shedding the rest with Retry-After"""
+    if request.method != "POST" or request.url.path != "/api/enhance-document":
+        return await call_next(request)
+    # The deadline starts on arrival, so time spent queued counts against it
+    deadline = request.state.deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    try:
+        async with admission.admit(request_priority(request.headers.get(PRIORITY_HEADER)), deadline):
+            return await call_next(request)
+    except Shed as e:
+        logger.warning(f"Shed enhancement request: {str(e)}")
+        return JSONResponse({"detail": str(e)}, status_code=e.status, headers={"Retry-After": str(e.retry_after)})
+
+# Add CORS middleware (after admission control so shed responses get CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allow all origins
@@ -31,6 +59,34 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count every request and its latency by route"""
+    start = time.perf_counter()
+    # Label by route template rather than raw URL to keep label cardinality bounded
+    path = next(
+        (route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL),
+        "unmatched"
+    )
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_request(request.method, path, 500, time.perf_counter() - start)
+        raise
+    record_request(request.method, path, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile the request when asked to by the admin header or the sample rate"""
+    if not request_profiler.should_profile(request.headers):
+        return await call_next(request)
+    with request_profiler.profile(f"{request.method} {request.url.path}") as profile:
+        response = await call_next(request)
+    if profile.id:
+        response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
+
 # Initialize RAG processor
 document_enhancer = DocumentEnhancer()
 
@@ -46,8 +102,32 @@ async def options_enhance():
 async def options_download():
     return Response(status_code=200)
 
+def extract_pdf_text(content: bytes) -> str:
+    """Extract the text of every page, giving up once the request deadline passes"""
+    with track_stage("extract"):
+        pdf_reader = PdfReader(io.BytesIO(content))
+        document_text = ""
+        for page in pdf_reader.pages:
+            check_deadline("extract")
+            # Page breaks let compaction find repeated headers and footers
+            document_text += page.extract_text() + "\n" + PAGE_BREAK
+    return document_text
+
 @app.post("/api/enhance-document")
-async def enhance_document(file: UploadFile = File(...)):
+async def enhance_document(request: Request, file: UploadFile = File(...)):
+    # Bounded by the request deadline (started on arrival by admission control)
+    # and cancelled if the client goes away
+    with deadline_scope(request.state.deadline):
+        try:
+            return await run_cancellable(enhance_upload(file), wait_for_disconnect(request.receive))
+        except DeadlineExceeded as e:
+            logger.warning(str(e))
+            return JSONResponse(status_code=504, content={"detail": str(e)})
+        except ClientDisconnected:
+            logger.info("Client disconnected, enhancement cancelled")
+            return Response(status_code=499)
+
+async def enhance_upload(file: UploadFile):
     try:
         # Log request
         logger.info(f"Received enhance request for file: {file.filename}")
@@ -67,11 +147,9 @@ async def enhance_document(file: UploadFile = File(...)):
         # Process PDF files
         if file.filename.endswith('.pdf'):
             try:
-                pdf_file = io.BytesIO(content)
-                pdf_reader = PdfReader(pdf_file)
-                document_text = ""
-                for page in pdf_reader.pages:
-                    document_text += page.extract_text() + "\n"
+                document_text = await asyncio.to_thread(profiled(extract_pdf_text), content)
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Error reading PDF: {str(e)}")
                 return JSONResponse(
@@ -97,16 +175,20 @@ async def enhance_document(file: UploadFile = File(...)):
         
         # Process with RAG
         try:
-            enhanced_content = document_enhancer.enhance_document(document_text)
+            enhanced_content = await document_enhancer.enhance_document_async(document_text)
             logger.info("Document enhancement successful")
             return {"enhanced_content": enhanced_content}
         except Exception as e:
+            # An upstream timeout caused by the deadline is a 504
+            check_deadline("completion")
             logger.error(f"Error enhancing document: {str(e)}")
             return JSONResponse(
                 status_code=500,
                 content={"detail": f"Error enhancing document: {str(e)}"}
             )
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return JSONResponse(
@@ -117,25 +199,26 @@ async def enhance_document(file: UploadFile = File(...)):
 @app.post("/api/download-pdf")
 async def download_pdf(content: str):
     try:
-        # Create a PDF buffer
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        
-        # Write content to PDF
-        y = 750  # Starting y position
-        for line in content.split('\n'):
-            if y < 50:  # If we're near the bottom of the page
-                c.showPage()  # Start a new page
-                y = 750  # Reset y position
+        with track_stage("render_pdf"):
+            # Create a PDF buffer
+            buffer = io.BytesIO()
+            c = canvas.Canvas(buffer, pagesize=letter)
             
-            c.drawString(50, y, line)
-            y -= 15  # Move down for next line
-        
-        c.save()
-        
-        # Get the value from the buffer
-        pdf_value = buffer.getvalue()
-        buffer.close()
+            # Write content to PDF
+            y = 750  # Starting y position
+            for line in content.split('\n'):
+                if y < 50:  # If we're near the bottom of the page
+                    c.showPage()  # Start a new page
+                    y = 750  # Reset y position
+                
+                c.drawString(50, y, line)
+                y -= 15  # Move down for next line
+            
+            c.save()
+            
+            # Get the value from the buffer
+            pdf_value = buffer.getvalue()
+            buffer.close()
         
         return Response(
             content=pdf_value,
@@ -146,6 +229,11 @@ async def download_pdf(content: str):
         logger.error(f"Error generating PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating PDF: {str(e)}")
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
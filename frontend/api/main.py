@@ -1,13 +1,25 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Match
 from rag_processor import DocumentEnhancer
+from metrics import registry, track_stage, record_request
+from profiling import request_profiler, profiled, PROFILE_ID_HEADER
+from admission import AdmissionController, Shed, PRIORITY_HEADER, request_priority
+from artifact_store import make_artifact_store
+from pdf_cache import PDFCache, etag_matches
+from deadlines import (
+    DEADLINE_HEADER, Deadline, DeadlineExceeded, ClientDisconnected, deadline_scope, check_deadline, run_cancellable,
+    wait_for_disconnect
+)
 from pypdf import PdfReader
+import asyncio
 import io
 import json
 import logging
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+import time
+from worksheet_document import parse_worksheet, render_pdf as render_worksheet_pdf
+from text_compaction import PAGE_BREAK
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -15,178 +27,116 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
-# Setup CORS
+# Enhancement requests go through admission control; see admission.py
+admission = AdmissionController()
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Bound concurrent enhancements, queueing briefly and shedding the rest with Retry-After"""
+    if request.method != "POST" or request.url.path != "/api/enhance-document":
+        return await call_next(request)
+    # The deadline starts on arrival, so time spent queued counts against it
+    deadline = request.state.deadline = Deadline.from_header(request.headers.get(DEADLINE_HEADER))
+    try:
+        async with admission.admit(request_priority(request.headers.get(PRIORITY_HEADER)), deadline):
+            return await call_next(request)
+    except Shed as e:
+        logger.warning(f"Shed enhancement request: {str(e)}")
+        return JSONResponse({"detail": str(e)}, status_code=e.status, headers={"Retry-After": str(e.retry_after)})
+
+# Setup CORS (after admission control so shed responses get CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count every request and its latency by route"""
+    start = time.perf_counter()
+    # Label by route template rather than raw URL to keep label cardinality bounded
+    path = next(
+        (route.path for route in app.routes if route.matches(request.scope)[0] == Match.FULL),
+        "unmatched"
+    )
+    try:
+        response = await call_next(request)
+    except Exception:
+        record_request(request.method, path, 500, time.perf_counter() - start)
+        raise
+    record_request(request.method, path, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Profile the request when asked to by the admin header or the sample rate"""
+    if not request_profiler.should_profile(request.headers):
+        return await call_next(request)
+    with request_profiler.profile(f"{request.method} {request.url.path}") as profile:
+        response = await call_next(request)
+    if profile.id:
+        response.headers[PROFILE_ID_HEADER] = profile.id
+    return response
+
 # Initialize RAG processor
 document_enhancer = DocumentEnhancer()
 
+# Enhanced worksheets, downloadable by id; see artifact_store.py
+artifact_store = make_artifact_store()
+
+# Bump whenever render_stored_pdf's output changes so cached PDFs are re-rendered
+PDF_RENDERER_VERSION = "frontend-1"
+pdf_cache = PDFCache(PDF_RENDERER_VERSION)
+
 def create_pdf(content: str) -> bytes:
     try:
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        def new_page():
-            nonlocal y
-            c.showPage()
-            c.setFont("Helvetica", normal_font_size)
-            y = height - 40
-        
-        # Font configurations
-        title_font_size = 16
-        header_font_size = 14
-        normal_font_size = 12
-        line_height = 15
-        margin_bottom = 50  # Minimum space at bottom of page
-        
-        # Start position
-        y = height - 40
-        
-        # Pre-process content to handle \n and \n\n properly
+        # Content sometimes arrives with its newlines escaped
         content = content.replace('\\n\\n', '\n\n')
         content = content.replace('\\n', '\n')
-        
-        # Split content into lines and clean up
-        lines = content.split('\n')
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                y -= line_height
-                if y < margin_bottom:
-                    new_page()
-                continue
-            
-            # Reset font for each line
-            c.setFont("Helvetica", normal_font_size)
-            
-            # Handle main title (double asterisks)
-            if line.startswith('**') and line.endswith('**'):
-                # Check if enough space for title
-                if y < margin_bottom + line_height * 3:
-                    new_page()
-                
-                text = line.replace('**', '')
-                c.setFont("Helvetica-Bold", title_font_size)
-                
-                words = text.split()
-                current_line = []
-                x = 40
-                
-                for word in words:
-                    current_line.append(word)
-                    if c.stringWidth(' '.join(current_line)) > width - 80:
-                        if y < margin_bottom:
-                            new_page()
-                        c.drawString(x, y, ' '.join(current_line[:-1]))
-                        y -= line_height
-                        current_line = [word]
-                
-                if current_line:
-                    if y < margin_bottom:
-                        new_page()
-                    c.drawString(x, y, ' '.join(current_line))
-                y -= line_height * 2
-                continue
-            
-            # Handle URLs
-            if line.startswith('http://') or line.startswith('https://'):
-                c.setFont("Helvetica-Oblique", normal_font_size)
-                while line:
-                    if y < margin_bottom:
-                        new_page()
-                    width_of_line = c.stringWidth(line)
-                    if width_of_line <= width - 80:
-                        c.drawString(40, y, line)
-                        break
-                    break_point = len(line)
-                    while break_point > 0 and c.stringWidth(line[:break_point]) > width - 80:
-                        break_point = line.rfind('/', 0, break_point)
-                    if break_point <= 0:
-                        break_point = len(line)
-                    c.drawString(40, y, line[:break_point])
-                    line = line[break_point:]
-                    y -= line_height
-                y -= line_height * 1.5
-                continue
-            
-            # Handle questions (numbered lines)
-            if line.strip() and line[0].isdigit() and '. ' in line:
-                if y < margin_bottom + line_height * 3:
-                    new_page()
-                
-                parts = line.split('. ', 1)
-                if len(parts) == 2:
-                    number, text = parts
-                    
-                    # Draw question number
-                    c.setFont("Helvetica-Bold", normal_font_size)
-                    c.drawString(40, y, f"{number}.")
-                    
-                    # Handle the rest of the question text
-                    c.setFont("Helvetica", normal_font_size)
-                    words = text.split()
-                    current_line = []
-                    x = 60
-                    
-                    for word in words:
-                        current_line.append(word)
-                        if c.stringWidth(' '.join(current_line)) > width - 100:
-                            if y < margin_bottom:
-                                new_page()
-                            c.drawString(x, y, ' '.join(current_line[:-1]))
-                            y -= line_height
-                            current_line = [word]
-                    
-                    if current_line:
-                        if y < margin_bottom:
-                            new_page()
-                        c.drawString(x, y, ' '.join(current_line))
-                    
-                    y -= line_height * 1.5
-                    continue
-            
-            # Regular text
-            words = line.split()
-            current_line = []
-            x = 40
-            
-            for word in words:
-                current_line.append(word)
-                if c.stringWidth(' '.join(current_line)) > width - 80:
-                    if y < margin_bottom:
-                        new_page()
-                    c.drawString(x, y, ' '.join(current_line[:-1]))
-                    y -= line_height
-                    current_line = [word]
-            
-            if current_line:
-                if y < margin_bottom:
-                    new_page()
-                c.drawString(x, y, ' '.join(current_line))
-            y -= line_height
-        
-        c.save()
-        buffer.seek(0)
-        return buffer.getvalue()
+        return render_worksheet_pdf(parse_worksheet(content))
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Error generating PDF: {str(e)}"
         )
 
+def render_stored_pdf(content: str) -> bytes:
+    """PDF of an enhancement as stored: it was never escaped, so it is rendered as it is"""
+    with track_stage("render_pdf"):
+        return render_worksheet_pdf(pdf_cache.document(content, parse_worksheet))
+
+def extract_pdf_text(content: bytes) -> str:
+    """Extract the text of every page, giving up once the request deadline passes"""
+    with track_stage("extract"):
+        pdf_reader = PdfReader(io.BytesIO(content))
+        document_text = ""
+        for page in pdf_reader.pages:
+            check_deadline("extract")
+            # Page breaks let compaction find repeated headers and footers
+            document_text += page.extract_text() + "\n" + PAGE_BREAK
+    return document_text
+
 @app.post("/api/enhance-document")
 async def enhance_document(
+    request: Request,
     file: UploadFile = File(...),
     subject_area: str = "biology"
 ):
+    # Bounded by the request deadline (started on arrival by admission control)
+    # and cancelled if the client goes away
+    with deadline_scope(request.state.deadline):
+        try:
+            return await run_cancellable(enhance_upload(file, subject_area), wait_for_disconnect(request.receive))
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except ClientDisconnected:
+            return Response(status_code=499)
+
+async def enhance_upload(file: UploadFile, subject_area: str) -> dict:
     try:
         content = await file.read()
         
@@ -197,11 +147,7 @@ async def enhance_document(
             )
             
         try:
-            pdf_file = io.BytesIO(content)
-            pdf_reader = PdfReader(pdf_file)
-            document_text = ""
-            for page in pdf_reader.pages:
-                document_text += page.extract_text() + "\n"
+            document_text = await asyncio.to_thread(profiled(extract_pdf_text), content)
                 
             if not document_text.strip():
                 raise HTTPException(
@@ -210,19 +156,29 @@ async def enhance_document(
                 )
                 
             # Process with RAG
-            enhanced_content = document_enhancer.enhance_document(
+            enhanced_content = await document_enhancer.enhance_document_async(
                 document_text,
                 subject_area
             )
             
-            return {"enhanced_content": enhanced_content}
+            # Saved so downloads can ask for it by id instead of posting it back
+            document_id = await asyncio.to_thread(profiled(artifact_store.put), enhanced_content, {"filename": file.filename})
+            return {
+                "enhanced_content": enhanced_content,
+                "document_id": document_id,
+                "pdf_url": f"/api/documents/{document_id}.pdf"
+            }
             
         except Exception as e:
+            # Out of time is a 504, whichever step noticed
+            check_deadline()
             raise HTTPException(
                 status_code=500,
                 detail=f"Error processing PDF: {str(e)}"
             )
             
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -245,15 +201,14 @@ async def download_pdf(request: Request):
         content = content.strip()
         
         # Generate PDF
-        pdf_content = create_pdf(content)
+        with track_stage("render_pdf"):
+            pdf_content = create_pdf(content)
         
-        return StreamingResponse(
-            io.BytesIO(pdf_content),
+        # Sent whole: a StreamingResponse over BytesIO goes out a line at a time
+        return Response(
+            pdf_content,
             media_type="application/pdf",
-            headers={
-                "Content-Disposition": "attachment; filename=enhanced_worksheet.pdf",
-                "Content-Type": "application/pdf"
-            }
+            headers={"Content-Disposition": "attachment; filename=enhanced_worksheet.pdf"}
         )
     except Exception as e:
         raise HTTPException(
@@ -261,6 +216,44 @@ async def download_pdf(request: Request):
             detail=f"Error generating PDF: {str(e)}"
         )
 
+@app.get("/api/documents/{document_id}.pdf")
+async def download_document_pdf(request: Request, document_id: str):
+    """PDF of a stored enhancement, rendered on first request and cached after"""
+    artifact = artifact_store.get(document_id)
+    if artifact is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Document not found or expired"
+        )
+    content, _ = artifact
+    
+    etag = pdf_cache.etag(content)
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+    
+    try:
+        pdf_content, _ = pdf_cache.get_or_render(content, render_stored_pdf)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error generating PDF: {str(e)}"
+        )
+    
+    return Response(
+        pdf_content,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": "attachment; filename=enhanced_worksheet.pdf",
+            **cache_headers
+        }
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=3002) 
\ No newline at end of file
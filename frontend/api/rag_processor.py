@@ -1,8 +1,11 @@
-from openai import OpenAI
 import os
 import numpy as np
 from dotenv import load_dotenv
 from pathlib import Path
+from metrics import track_stage, record_token_usage
+from openai_client import get_openai_client, get_async_openai_client
+from deadlines import timeout_kwargs
+from text_compaction import compact_text
 
 # Load environment variables from .env file
 env_path = Path(__file__).parent / '.env'
@@ -14,16 +17,27 @@ class DocumentEnhancer:
         if not api_key:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
             
-        self.client = OpenAI()
+        self.client = get_openai_client()
         self.model_name = "gpt-3.5-turbo"
     
-    def enhance_document(self, document_text: str, subject_area: str = None) -> str:
-        try:
-            # Execute enhancement using the model
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": """You are an expert educator enhancing worksheets with climate change concepts.
+    def _chat_completion(self, stage: str = "completion", **kwargs):
+        """Run a chat completion, recording latency under the given stage and token usage"""
+        with track_stage(stage):
+            response = self.client.chat.completions.create(**kwargs, **timeout_kwargs())
+        record_token_usage(kwargs["model"], response.usage)
+        return response
+    
+    async def _chat_completion_async(self, stage: str = "completion", **kwargs):
+        """_chat_completion() on the async client; cancelling it closes the upstream request"""
+        with track_stage(stage):
+            response = await get_async_openai_client().chat.completions.create(**kwargs, **timeout_kwargs())
+        record_token_usage(kwargs["model"], response.usage)
+        return response
+    
+    def enhancement_messages(self, document_text: str) -> list[dict]:
+        """Prompt for enhancing document_text"""
+        return [
+            {"role": "system", "content": """You are an expert educator enhancing worksheets with climate change concepts.
 
 STRICT REQUIREMENTS:
 1. PRESERVE ALL ORIGINAL CONTENT EXACTLY AS IS
@@ -49,7 +63,7 @@ Enhanced:
 **Cell Biology**
 1. What is the function of mitochondria? (How might mitochondrial function be affected by rising temperatures due to climate change?)
 2. Draw and label the parts of a cell. (Consider how cellular structures might adapt to environmental stresses from climate change)"""},
-                    {"role": "system", "content": """ENHANCEMENT RULES:
+            {"role": "system", "content": """ENHANCEMENT RULES:
 1. DO NOT remove or modify ANY original content
 2. DO NOT fill in answers or blank spaces
 3. DO NOT add new questions (except optional climate-specific questions at the very end)
@@ -61,10 +75,28 @@ Enhanced:
    - Line breaks
    - URLs
    - Instructions"""},
-                    {"role": "user", "content": f"Enhance this worksheet by adding climate-related extensions in parentheses while preserving ALL original content exactly:\n\n{document_text}"}
-                ]
+            {"role": "user", "content": f"Enhance this worksheet by adding climate-related extensions in parentheses while preserving ALL original content exactly:\n\n{document_text}"}
+        ]
+    
+    def enhance_document(self, document_text: str, subject_area: str = None) -> str:
+        try:
+            # Strip extraction noise first; blanks come back exactly in the output
+            compacted = compact_text(document_text)
+            # Execute enhancement using the model
+            response = self._chat_completion(
+                model=self.model_name,
+                messages=self.enhancement_messages(compacted.text)
             )
-            return response.choices[0].message.content
+            return compacted.restore(response.choices[0].message.content)
         except Exception as e:
             print(f"Error in enhance_document: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
+    
+    async def enhance_document_async(self, document_text: str, subject_area: str = None) -> str:
+        """enhance_document() for async routes, cancellable while the completion runs"""
+        compacted = compact_text(document_text)
+        response = await self._chat_completion_async(
+            model=self.model_name,
+            messages=self.enhancement_messages(compacted.text)
+        )
+        return compacted.restore(response.choices[0].message.content)
@@ -53,6 +53,8 @@ const getApiUrl = (endpoint: string) => {
 export default function FileUpload() {
   const [file, setFile] = React.useState<File | null>(null)
   const [enhancedContent, setEnhancedContent] = React.useState('')
+  // Set by servers that store the result; downloads then only send the id
+  const [documentId, setDocumentId] = React.useState<string | null>(null)
   const [loading, setLoading] = React.useState(false)
   const [downloadLoading, setDownloadLoading] = React.useState(false)
   const [error, setError] = React.useState<string | null>(null)
@@ -127,11 +129,13 @@ export default function FileUpload() {
       }
 
       setEnhancedContent(data.enhanced_content)
+      setDocumentId(data.document_id || null)
       setError(null)
     } catch (error) {
       console.error('Error:', error)
       setError(error instanceof Error ? error.message : 'An unexpected error occurred')
       setEnhancedContent('')
+      setDocumentId(null)
     } finally {
       setLoading(false)
     }
@@ -145,14 +149,23 @@ export default function FileUpload() {
 
     setDownloadLoading(true)
     try {
-      const response = await fetch(getApiUrl('/api/download-pdf'), {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Accept': 'application/pdf'
-        },
-        body: JSON.stringify(enhancedContent)
-      })
+      let response = documentId
+        ? await fetch(getApiUrl(`/api/documents/${documentId}.pdf`), {
+            headers: { 'Accept': 'application/pdf' }
+          })
+        : null
+
+      // No stored copy (or it expired): send the content instead
+      if (!response || response.status === 404) {
+        response = await fetch(getApiUrl('/api/download-pdf'), {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/pdf'
+          },
+          body: JSON.stringify(enhancedContent)
+        })
+      }
 
       if (!response.ok) {
         throw new Error('Failed to generate PDF')